@@ -0,0 +1,78 @@
+# bench_csv.py - Time import_csv and CsvExportFile.read on a generated CSV file
+
+import argparse
+import asyncio
+import csv
+import os
+import random
+from datetime import datetime, timedelta
+
+from common import Timer, temp_database
+
+import database as db
+from csv_transfer import CSV_COLUMNS, CsvExportFile, import_csv
+from strings import UTILITY_TYPES
+
+USER_ID = 1
+
+
+def write_csv(path: str, rows: int):
+    """A CSV of `rows` random transactions, debts and utility payments over ~3 years."""
+    rng = random.Random(8)
+    utility_types = sorted(UTILITY_TYPES)
+    start = datetime(2022, 1, 1)
+    with open(path, "w", newline="") as file:
+        writer = csv.writer(file, lineterminator="\n")
+        writer.writerow(CSV_COLUMNS)
+        for _ in range(rows):
+            moment = (start + timedelta(minutes=rng.randrange(3 * 365 * 24 * 60))).strftime("%Y-%m-%d %H:%M")
+            currency = rng.choice(("UZS", "USD", "RUB", "CNY"))
+            amount = f"{rng.uniform(1, 100000):.2f}"
+            pick = rng.random()
+            if pick < 0.8:
+                writer.writerow(("transaction", rng.choice(("expense", "income")), "groceries", amount, currency, moment))
+            elif pick < 0.9:
+                writer.writerow(("debt", rng.choice(("owed_to_me", "i_owe")), "Friend", amount, currency, moment))
+            else:
+                writer.writerow(("utility", rng.choice(utility_types), "", amount, currency, moment))
+
+
+async def read_chunks(path: str, chunk_size: int):
+    """The file in chunks, as stream_document delivers an upload."""
+    with open(path, "rb") as file:
+        while True:
+            chunk = file.read(chunk_size)
+            if not chunk:
+                return
+            yield chunk
+
+
+async def main(args):
+    with temp_database() as path:
+        csv_path = os.path.join(os.path.dirname(path), "import.csv")
+        write_csv(csv_path, args.rows)
+        print(f"{args.rows} rows, {os.path.getsize(csv_path) / 1024 / 1024:.1f} MB")
+
+        await db.init_db(path)
+        try:
+            with Timer() as timer:
+                imported, skipped = await import_csv(USER_ID, read_chunks(csv_path, args.chunk_size), args.batch_size)
+            print(f"import_csv:          {timer.elapsed:6.2f}s  {imported / timer.elapsed:9.0f} rows/s "
+                  f"({imported} imported, {skipped} skipped)")
+
+            size = 0
+            with Timer() as timer:
+                async for chunk in CsvExportFile(USER_ID, chunk_size=args.chunk_size).read(None):
+                    size += len(chunk)
+            print(f"CsvExportFile.read:  {timer.elapsed:6.2f}s  {imported / timer.elapsed:9.0f} rows/s "
+                  f"({size / 1024 / 1024:.1f} MB)")
+        finally:
+            await db.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="CSV import and export time on a generated file.")
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--batch-size", type=int, default=5000, help="records per import transaction")
+    parser.add_argument("--chunk-size", type=int, default=64 * 1024)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,62 @@
+# bench_metrics.py - Overhead of the metrics middleware and of instrumented coroutines
+
+import argparse
+import asyncio
+import time
+from types import SimpleNamespace
+
+from common import Timer
+
+import metrics
+
+
+async def noop_handler(event, data):
+    return None
+
+
+async def noop_query(user_id: int):
+    return None
+
+
+async def per_call(call, number: int) -> float:
+    """Mean seconds per awaited call."""
+    with Timer() as timer:
+        for _ in range(number):
+            await call()
+    return timer.elapsed / number
+
+
+async def main(args):
+    n = args.number
+    middleware = metrics.HandlerMetricsMiddleware()
+    data = {"handler": SimpleNamespace(callback=noop_handler)}
+    timed_query = metrics._timed(noop_query, metrics.db_seconds, "noop_query")
+
+    bare_handler = await per_call(lambda: noop_handler(None, data), n)
+    with_middleware = await per_call(lambda: middleware(noop_handler, None, data), n)
+    bare_query = await per_call(lambda: noop_query(1), n)
+    with_timing = await per_call(lambda: timed_query(1), n)
+    print(f"{n} calls each")
+    print(f"handler middleware: {(with_middleware - bare_handler) * 1e6:6.2f}us per update")
+    print(f"instrumented call:  {(with_timing - bare_query) * 1e6:6.2f}us per call")
+
+    # A scrape with many label series, and the merge the front process does when sharded
+    for index in range(args.series):
+        metrics.update_seconds.observe(0.01, f"handler_{index}")
+        metrics.updates_total.inc(f"handler_{index}")
+    start = time.perf_counter()
+    text = metrics.registry.render()
+    rendered = time.perf_counter() - start
+    start = time.perf_counter()
+    metrics.merge_expositions({str(shard): text for shard in range(args.shards)}, "shard")
+    merged = time.perf_counter() - start
+    print(f"render, {args.series} handlers: {rendered * 1000:6.2f}ms ({len(text) / 1024:.0f} KB)")
+    print(f"merge of {args.shards} shards:   {merged * 1000:6.2f}ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Per-update and per-call cost of the metrics hooks.")
+    parser.add_argument("--number", type=int, default=200000)
+    parser.add_argument("--series", type=int, default=60, help="handler label values for the render timing")
+    parser.add_argument("--shards", type=int, default=4)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,85 @@
+# bench_pool.py - ops/sec of a mixed insert/read workload: connection per call vs the pool
+
+import argparse
+import asyncio
+import random
+
+import aiosqlite
+
+from common import Timer, temp_database
+
+import database as db
+
+READ_SQL = "SELECT * FROM transactions WHERE user_id = ? ORDER BY id DESC LIMIT 20"
+
+
+def insert_params(user_id: int) -> tuple:
+    return (user_id, "expense", "bench", 1000.0, "UZS", "2024-05-01 12:00", "2024-05", 1714564800)
+
+
+# How every query ran before the pool: a new connection (and thread) per call
+async def naive_insert(path: str, user_id: int):
+    async with aiosqlite.connect(path) as conn:
+        await conn.execute(db._INSERT_TRANSACTION, insert_params(user_id))
+        await conn.commit()
+
+
+async def naive_read(path: str, user_id: int):
+    async with aiosqlite.connect(path) as conn:
+        conn.row_factory = aiosqlite.Row
+        async with conn.execute(READ_SQL, (user_id,)) as cursor:
+            await cursor.fetchall()
+
+
+async def pooled_insert(path: str, user_id: int):
+    async with db._get_pool().write() as conn:
+        await conn.execute(db._INSERT_TRANSACTION, insert_params(user_id))
+        await conn.commit()
+
+
+async def pooled_read(path: str, user_id: int):
+    async with db._get_pool().read() as conn:
+        async with conn.execute(READ_SQL, (user_id,)) as cursor:
+            await cursor.fetchall()
+
+
+async def run(path: str, insert, read, ops: int, read_ratio: float, concurrency: int) -> float:
+    """Run `ops` operations from `concurrency` tasks; returns ops/sec."""
+    rng = random.Random(1)
+    plan = [rng.random() < read_ratio for _ in range(ops)]
+    queue = iter(plan)
+
+    async def client():
+        for is_read in queue:
+            user_id = rng.randrange(100)
+            await (read if is_read else insert)(path, user_id)
+
+    with Timer() as timer:
+        await asyncio.gather(*(client() for _ in range(concurrency)))
+    return ops / timer.elapsed
+
+
+async def main(args):
+    for profile in args.profiles:
+        settings = db.PROFILES[profile]
+        with temp_database() as path:
+            await db.init_db(path, settings)
+            await db.close_db()
+            naive = await run(path, naive_insert, naive_read, args.ops, args.read_ratio, args.concurrency)
+        with temp_database() as path:
+            await db.init_db(path, settings)
+            try:
+                pooled = await run(path, pooled_insert, pooled_read, args.ops, args.read_ratio, args.concurrency)
+            finally:
+                await db.close_db()
+        print(f"{profile:>8}: connection per call {naive:8.0f} ops/s | pool {pooled:8.0f} ops/s "
+              f"| x{pooled / naive:.1f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mixed insert/read ops/sec with and without the connection pool.")
+    parser.add_argument("--ops", type=int, default=3000)
+    parser.add_argument("--read-ratio", type=float, default=0.75, help="share of reads in the mix")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--profiles", nargs="+", default=["wal"], choices=sorted(db.PROFILES))
+    asyncio.run(main(parser.parse_args()))
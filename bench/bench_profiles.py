@@ -0,0 +1,64 @@
+# bench_profiles.py - p50/p99 latency of concurrent inserts and reports under each DB profile
+
+import argparse
+import asyncio
+import random
+import time
+from typing import Dict, List
+
+from common import format_ms, percentiles, temp_database
+
+import database as db
+
+
+async def insert(user_id: int):
+    await db.add_transaction(user_id, "expense", "bench", 1000.0, "UZS")
+
+
+async def report(user_id: int):
+    # What the statistics and daily report screens read
+    await db.get_transaction_totals(user_id)
+    await db.get_transactions_page(user_id)
+
+
+async def run_profile(profile: str, args) -> Dict[str, List[float]]:
+    latencies: Dict[str, List[float]] = {"insert": [], "report": []}
+    rng = random.Random(2)
+    with temp_database() as path:
+        await db.init_db(path, db.PROFILES[profile])
+        try:
+            deadline = time.perf_counter() + args.seconds
+
+            async def client(kind: str, operation):
+                while time.perf_counter() < deadline:
+                    user_id = rng.randrange(args.users)
+                    start = time.perf_counter()
+                    await operation(user_id)
+                    latencies[kind].append(time.perf_counter() - start)
+
+            await asyncio.gather(
+                *(client("insert", insert) for _ in range(args.writers)),
+                *(client("report", report) for _ in range(args.readers)),
+            )
+        finally:
+            await db.close_db()
+    return latencies
+
+
+async def main(args):
+    for profile in args.profiles:
+        latencies = await run_profile(profile, args)
+        for kind, samples in latencies.items():
+            stats = percentiles(samples, (50, 99))
+            print(f"{profile:>8} {kind:>6}: {len(samples) / args.seconds:7.0f} ops/s  "
+                  f"p50 {format_ms(stats['p50'])}  p99 {format_ms(stats['p99'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Insert and report latency percentiles per DB profile.")
+    parser.add_argument("--seconds", type=float, default=5)
+    parser.add_argument("--writers", type=int, default=8, help="concurrent inserting clients")
+    parser.add_argument("--readers", type=int, default=8, help="concurrent report clients")
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--profiles", nargs="+", default=sorted(db.PROFILES), choices=sorted(db.PROFILES))
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,89 @@
+# bench_render.py - Micro-benchmark of the rendering work done by the report and menu handlers
+
+import argparse
+import asyncio
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+from common import temp_database
+
+# main builds its Bot at import; nothing here talks to Telegram
+os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+os.environ.setdefault("FSM_STORAGE", "memory")
+
+import database as db
+import main as bot_main
+
+USER_ID = 1
+
+
+def per_call(function, number: int) -> float:
+    """Mean seconds per call of a synchronous function."""
+    start = time.perf_counter()
+    for _ in range(number):
+        function()
+    return (time.perf_counter() - start) / number
+
+
+async def per_call_async(function, number: int) -> float:
+    start = time.perf_counter()
+    for _ in range(number):
+        await function()
+    return (time.perf_counter() - start) / number
+
+
+def report(name: str, seconds: float):
+    print(f"{name:<44} {seconds * 1e6:10.2f}us")
+
+
+async def seed(days: int):
+    """One user with income and expenses in two currencies on each of `days` days."""
+    rng = random.Random(7)
+    start = datetime(2024, 1, 1, 12, 0)
+    records = []
+    for offset in range(days):
+        moment = start + timedelta(days=offset)
+        for trans_type in ("income", "expense"):
+            for currency in ("UZS", "USD"):
+                records.append(("transaction", trans_type, "bench", rng.uniform(1, 1000), currency, moment))
+    await db.import_records(USER_ID, records)
+
+
+async def run(args):
+    with temp_database() as path:
+        await db.init_db(path)
+        try:
+            await seed(args.days)
+            months = await db.get_months(USER_ID, "transaction")
+            totals = await db.get_transaction_totals(USER_ID)
+            n = args.number
+
+            print(f"{args.days} days of transactions, {len(totals)} daily total rows, {n} calls each")
+            report("days keyboard, uncached", per_call(lambda: bot_main.get_days_keyboard.__wrapped__("day_2024-05", "en"), n))
+            report("days keyboard, cached", per_call(lambda: bot_main.get_days_keyboard("day_2024-05", "en"), n))
+            report("main menu keyboard, uncached", per_call(lambda: bot_main.get_main_menu_keyboard.__wrapped__("en"), n))
+            report("main menu keyboard, cached", per_call(lambda: bot_main.get_main_menu_keyboard("en"), n))
+            report(f"months keyboard ({len(months)} months)", per_call(lambda: bot_main.get_months_keyboard(months), n))
+            report("sum_totals", per_call(lambda: bot_main.sum_totals(totals, "UZS"), n))
+            report("render_totals", per_call(
+                lambda: bot_main.render_totals("en", "Title\n", 1234567.5, 765432.25, "UZS"), n))
+
+            async def uncached_report():
+                await bot_main.render_transaction_report(USER_ID, "en", "UZS", None)
+
+            async def cached_report():
+                await bot_main.cached_report(USER_ID, "stats", None, "en", bot_main.render_transaction_report)
+
+            report("statistics report, rendered", await per_call_async(uncached_report, n))
+            report("statistics report, from report_cache", await per_call_async(cached_report, n))
+        finally:
+            await db.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Handler rendering time: keyboards and report text.")
+    parser.add_argument("--number", type=int, default=2000, help="calls per measurement")
+    parser.add_argument("--days", type=int, default=365, help="days of seeded transactions")
+    asyncio.run(run(parser.parse_args()))
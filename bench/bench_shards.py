@@ -0,0 +1,82 @@
+# bench_shards.py - Update throughput of the sharded bot by number of worker processes
+
+import argparse
+import asyncio
+import os
+import random
+import time
+
+from common import temp_database
+from load_webhook import synthetic_update
+
+import database as db
+from sharding import ShardRouter
+
+READY_SUFFIX = ".ready"
+
+
+async def fake_bot_api(make_request, bot, method):
+    return True
+
+
+def bench_worker(index: int, queue):
+    """Shard worker running the real handlers, with Bot API calls answered locally."""
+    directory = os.environ["BENCH_SHARD_DIR"]
+    os.chdir(directory)
+    import main
+
+    main.bot.session.middleware(fake_bot_api)
+    main.rates_service.start = lambda session: None  # no CBU requests
+    open(os.path.join(directory, f"{index}{READY_SUFFIX}"), "w").close()
+    main.run_worker(index, queue)
+
+
+def wait_ready(directory: str, workers: int):
+    while sum(name.endswith(READY_SUFFIX) for name in os.listdir(directory)) < workers:
+        time.sleep(0.05)
+
+
+def run(workers: int, args) -> float:
+    """Updates/sec from the first route() until every worker has drained its queue."""
+    rng = random.Random(5)
+    updates = [synthetic_update(update_id, rng.randrange(1, args.users + 1), rng)
+               for update_id in range(1, args.updates + 1)]
+    with temp_database() as path:
+        directory = os.path.dirname(path)
+        os.environ["BENCH_SHARD_DIR"] = directory
+        # Migrate once up front, as run_sharded() does
+        asyncio.run(init_database(os.path.join(directory, db.DATABASE_NAME)))
+        router = ShardRouter(workers, bench_worker)
+        router.start()
+        try:
+            wait_ready(directory, workers)
+            start = time.perf_counter()
+            for update in updates:
+                router.route(update)
+        finally:
+            # Blocks until the workers have processed their queues
+            router.stop()
+        return args.updates / (time.perf_counter() - start)
+
+
+async def init_database(path: str):
+    await db.init_db(path)
+    await db.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded update throughput vs. worker count.")
+    parser.add_argument("--workers", default="1,2,4", help="comma-separated worker counts")
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--users", type=int, default=2000)
+    args = parser.parse_args()
+
+    os.environ.setdefault("BOT_TOKEN", "123456:BENCHMARK")
+    os.environ.setdefault("FSM_STORAGE", "memory")
+    # Measure the workers, not Telegram's send limits or the per-user drop limit
+    os.environ.setdefault("SEND_GLOBAL_RATE", "1000000")
+    os.environ.setdefault("SEND_CHAT_RATE", "1000000")
+    os.environ.setdefault("USER_QUEUE_LIMIT", "1000000")
+    print(f"{os.cpu_count()} CPUs, {args.updates} updates from {args.users} users")
+    for workers in map(int, args.workers.split(",")):
+        print(f"{workers:>3} workers: {run(workers, args):8.0f} updates/s")
@@ -0,0 +1,77 @@
+# bench_storage.py - get/set throughput of the FSM storage backends
+
+import argparse
+import asyncio
+import random
+
+from aiogram.fsm.storage.base import BaseStorage, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+from common import Timer, temp_database
+
+import database as db
+from storage import RespClient, RespStorage, SQLiteStorage
+from tests.resp_server import RespServer
+
+
+async def run(storage: BaseStorage, args) -> dict:
+    """ops/sec of set_state+set_data pairs and of get_state+get_data pairs."""
+    rng = random.Random(3)
+    keys = [StorageKey(bot_id=1, chat_id=user_id, user_id=user_id) for user_id in range(args.users)]
+
+    async def client(operation, count: int):
+        for _ in range(count):
+            await operation(rng.choice(keys))
+
+    async def write(key: StorageKey):
+        await storage.set_state(key, "UserStates:waiting_amount")
+        await storage.set_data(key, {"language": "en", "amount": 1250.0})
+
+    async def read(key: StorageKey):
+        await storage.get_state(key)
+        await storage.get_data(key)
+
+    results = {}
+    per_client = args.ops // args.concurrency
+    for name, operation in (("set", write), ("get", read)):
+        with Timer() as timer:
+            await asyncio.gather(*(client(operation, per_client) for _ in range(args.concurrency)))
+        results[name] = per_client * args.concurrency / timer.elapsed
+    await storage.close()
+    return results
+
+
+async def main(args):
+    results = {"memory": await run(MemoryStorage(), args)}
+
+    with temp_database() as path:
+        await db.init_db(path, db.PROFILES["wal"])
+        try:
+            results["sqlite"] = await run(SQLiteStorage(), args)
+        finally:
+            await db.close_db()
+
+    server = None
+    url = args.redis_url
+    if url is None:
+        server = await RespServer().start()
+        url = server.url
+    try:
+        results["resp"] = await run(RespStorage(RespClient.from_url(url)), args)
+    finally:
+        if server is not None:
+            await server.stop()
+
+    for name, result in results.items():
+        print(f"{name:>7}: set {result['set']:9.0f} ops/s | get {result['get']:9.0f} ops/s")
+    if args.redis_url is None:
+        print("(resp ran against the in-process stand-in; pass --redis-url for a real server)")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="FSM storage get/set throughput per backend.")
+    parser.add_argument("--ops", type=int, default=20000, help="operations per phase")
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--redis-url", help="benchmark a real server instead of the stand-in")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,56 @@
+# bench_write_batch.py - Inserts/sec of add_transaction at different write-behind batch sizes
+
+import argparse
+import asyncio
+import dataclasses
+import random
+import time
+
+from common import Timer, format_ms, percentiles, temp_database
+
+import database as db
+
+
+async def run(settings: db.DatabaseSettings, args) -> tuple:
+    """Insert `args.inserts` transactions from concurrent clients; returns (inserts/sec, latencies)."""
+    rng = random.Random(6)
+    latencies = []
+    remaining = iter(range(args.inserts))
+
+    async def client():
+        for _ in remaining:
+            start = time.perf_counter()
+            await db.add_transaction(rng.randrange(1, 1000), "expense", "bench", 1000.0, "UZS")
+            latencies.append(time.perf_counter() - start)
+
+    with temp_database() as path:
+        await db.init_db(path, settings)
+        try:
+            with Timer() as timer:
+                await asyncio.gather(*(client() for _ in range(args.concurrency)))
+        finally:
+            # Flushes whatever is still queued in the batcher
+            await db.close_db()
+    return args.inserts / timer.elapsed, latencies
+
+
+async def main(args):
+    base = db.PROFILES[args.profile]
+    print(f"profile {args.profile}, {args.inserts} inserts, {args.concurrency} clients, "
+          f"batch window {args.batch_ms}ms")
+    for size in args.batch_sizes:
+        settings = dataclasses.replace(base, write_batch_size=size, write_batch_ms=args.batch_ms)
+        rate, latencies = await run(settings, args)
+        stats = percentiles(latencies)
+        label = "no batching" if size == 0 else f"batch {size}"
+        print(f"{label:>12}: {rate:8.0f} inserts/s | p50 {format_ms(stats['p50'])}  p99 {format_ms(stats['p99'])}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="add_transaction throughput by write batch size.")
+    parser.add_argument("--inserts", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[0, 10, 50, 200])
+    parser.add_argument("--batch-ms", type=int, default=10, help="write_batch_ms for every batched run")
+    parser.add_argument("--profile", default="wal", choices=sorted(db.PROFILES))
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,52 @@
+# common.py - Shared helpers for the benchmark scripts in bench/
+
+import os
+import sys
+import tempfile
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List
+
+# The scripts import the bot modules from the repository root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+
+def percentiles(samples: List[float], points=(50, 90, 99)) -> Dict[str, float]:
+    """Nearest-rank percentiles of `samples`, in the samples' unit."""
+    ordered = sorted(samples)
+    if not ordered:
+        return {f"p{point}": 0.0 for point in points}
+    return {
+        f"p{point}": ordered[min(len(ordered) - 1, max(0, round(point / 100 * len(ordered)) - 1))]
+        for point in points
+    }
+
+
+def format_ms(seconds: float) -> str:
+    return f"{seconds * 1000:.2f}ms"
+
+
+@contextmanager
+def temp_database() -> Iterator[str]:
+    """Path of a fresh SQLite file, removed (with its WAL files) afterwards."""
+    directory = tempfile.mkdtemp(prefix="smartbalance-bench-")
+    path = os.path.join(directory, "bench.db")
+    try:
+        yield path
+    finally:
+        for name in os.listdir(directory):
+            os.remove(os.path.join(directory, name))
+        os.rmdir(directory)
+
+
+class Timer:
+    """Wall time of a block: `with Timer() as t: ...; t.elapsed`."""
+
+    def __enter__(self) -> "Timer":
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
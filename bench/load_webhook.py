@@ -0,0 +1,136 @@
+# load_webhook.py - Post synthetic Telegram updates to the webhook and report throughput and latency
+
+import argparse
+import asyncio
+import itertools
+import logging
+import os
+import random
+import time
+from typing import List
+
+import aiohttp
+
+from common import format_ms, percentiles, temp_database
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+TEXTS = ["/start", "📊 Statistics", "📅 Monthly Report", "💸 Expenses", "12500", "🔙 Back"]
+
+
+def synthetic_update(update_id: int, user_id: int, rng: random.Random) -> dict:
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private"},
+            "from": {"id": user_id, "is_bot": False, "first_name": "Load", "language_code": "en"},
+            "text": rng.choice(TEXTS),
+        },
+    }
+
+
+async def post_updates(url: str, secret: str, total: int, concurrency: int, users: int) -> List[float]:
+    """POST `total` updates from `concurrency` clients; returns per-request latencies."""
+    rng = random.Random(4)
+    update_ids = itertools.count(1)
+    latencies: List[float] = []
+    errors = 0
+
+    async def client(session: aiohttp.ClientSession):
+        nonlocal errors
+        while True:
+            update_id = next(update_ids)
+            if update_id > total:
+                return
+            update = synthetic_update(update_id, rng.randrange(1, users + 1), rng)
+            start = time.perf_counter()
+            async with session.post(url, json=update, headers={SECRET_HEADER: secret}) as response:
+                await response.read()
+                if response.status != 200:
+                    errors += 1
+            latencies.append(time.perf_counter() - start)
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(client(session) for _ in range(concurrency)))
+    if errors:
+        print(f"{errors} requests failed")
+    return latencies
+
+
+async def serve_bot(port: int, secret: str):
+    """Start the bot's own webhook server in-process, with Bot API calls answered locally."""
+    os.environ.update(
+        BOT_TOKEN=os.environ.get("BOT_TOKEN", "123456:LOADTEST"), BOT_MODE="webhook",
+        WEBHOOK_SECRET=secret, FSM_STORAGE="memory", PORT=str(port)
+    )
+    # Telegram's send limits would pace the run to 30 messages/s; measure the bot itself
+    os.environ.setdefault("SEND_GLOBAL_RATE", "1000000")
+    os.environ.setdefault("SEND_CHAT_RATE", "1000000")
+    import main
+
+    for name in ("aiogram.event", "aiohttp.access"):
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+    processed = [0]
+
+    async def fake_bot_api(make_request, bot, method):
+        return True
+
+    async def count_processed(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            processed[0] += 1
+
+    main.bot.session.middleware(fake_bot_api)
+    main.dp.update.outer_middleware(count_processed)
+    main.warm_keyboards()
+    runner = await main.start_server()
+    return main, runner, processed
+
+
+async def run(args):
+    main = runner = processed = None
+    with temp_database() as path:
+        if args.serve:
+            import database as db
+            await db.init_db(path, db.DatabaseSettings.from_env())
+            main, runner, processed = await serve_bot(args.port, args.secret)
+            url = f"http://127.0.0.1:{args.port}{main.WEBHOOK_PATH}"
+        else:
+            url = args.url
+        try:
+            start = time.perf_counter()
+            latencies = await post_updates(url, args.secret, args.updates, args.concurrency, args.users)
+            acked = time.perf_counter() - start
+            stats = percentiles(latencies)
+            print(f"acknowledged {len(latencies)} updates in {acked:.2f}s: {len(latencies) / acked:.0f} updates/s")
+            print(f"ack latency p50 {format_ms(stats['p50'])}  p90 {format_ms(stats['p90'])}  "
+                  f"p99 {format_ms(stats['p99'])}")
+            if processed is not None:
+                # Updates are handled in the background after the 200 reply; the
+                # scheduler rejects a user's updates beyond USER_QUEUE_LIMIT
+                while processed[0] + main.scheduler.dropped < len(latencies):
+                    await asyncio.sleep(0.01)
+                done = time.perf_counter() - start
+                print(f"processed {processed[0]} updates in {done:.2f}s: {processed[0] / done:.0f} updates/s "
+                      f"({main.scheduler.dropped} dropped by the per-user queue limit)")
+        finally:
+            if runner is not None:
+                await runner.cleanup()
+                await main.db.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Webhook load test with synthetic updates.")
+    parser.add_argument("--url", default="http://127.0.0.1:8080/webhook", help="webhook of a running bot")
+    parser.add_argument("--secret", default=os.environ.get("WEBHOOK_SECRET", "load-test-secret"))
+    parser.add_argument("--serve", action="store_true",
+                        help="start the bot's webhook server in this process (temporary DB, no Telegram calls)")
+    parser.add_argument("--port", type=int, default=8099, help="port for --serve")
+    parser.add_argument("--updates", type=int, default=5000)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--users", type=int, default=500)
+    asyncio.run(run(parser.parse_args()))
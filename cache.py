@@ -0,0 +1,107 @@
+# cache.py - Small in-process caches
+
+import sys
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Hashable, Optional
+
+
+class LRUCache:
+    """Bounded least-recently-used mapping that counts hits and misses."""
+
+    def __init__(self, maxsize: int):
+        self.maxsize = max(1, maxsize)
+        self.hits = 0
+        self.misses = 0
+        self._data: "OrderedDict[Hashable, Any]" = OrderedDict()
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value and mark it as recently used."""
+        try:
+            value = self._data[key]
+        except KeyError:
+            self.misses += 1
+            return default
+        self._data.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def peek(self, key: Hashable, default: Any = None) -> Any:
+        """Return the cached value without touching recency or statistics."""
+        return self._data.get(key, default)
+
+    def set(self, key: Hashable, value: Any):
+        """Store a value, evicting the least recently used entry when full."""
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        """Remove and return a cached value."""
+        return self._data.pop(key, default)
+
+    def clear(self):
+        self._data.clear()
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._data
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    @property
+    def hit_rate(self) -> Optional[float]:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else None
+
+    def stats(self) -> Dict[str, Any]:
+        """Size and hit/miss counters, e.g. for logging."""
+        return {
+            "size": len(self._data),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hit_rate,
+        }
+
+
+class SizedLRUCache(LRUCache):
+    """LRU cache bounded by entry count and by the total size of its values.
+
+    Sizes come from `sizeof` (sys.getsizeof by default, exact for str and
+    bytes); the least recently used entries are evicted until both limits hold.
+    """
+
+    def __init__(self, maxsize: int, maxbytes: int, sizeof: Callable[[Any], int] = sys.getsizeof):
+        super().__init__(maxsize)
+        self.maxbytes = maxbytes
+        self.sizeof = sizeof
+        self.bytes = 0
+        self.evictions = 0
+        self._sizes: Dict[Hashable, int] = {}
+
+    def set(self, key: Hashable, value: Any):
+        size = self.sizeof(value)
+        if size > self.maxbytes:
+            self.pop(key)
+            return
+        self.bytes += size - self._sizes.get(key, 0)
+        self._sizes[key] = size
+        self._data[key] = value
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize or self.bytes > self.maxbytes:
+            evicted, _ = self._data.popitem(last=False)
+            self.bytes -= self._sizes.pop(evicted)
+            self.evictions += 1
+
+    def pop(self, key: Hashable, default: Any = None) -> Any:
+        self.bytes -= self._sizes.pop(key, 0)
+        return self._data.pop(key, default)
+
+    def clear(self):
+        super().clear()
+        self._sizes.clear()
+        self.bytes = 0
+
+    def stats(self) -> Dict[str, Any]:
+        return {**super().stats(), "bytes": self.bytes, "maxbytes": self.maxbytes, "evictions": self.evictions}
@@ -0,0 +1,178 @@
+# csv_transfer.py - Streaming CSV export and import of a user's records
+
+import codecs
+import csv
+import io
+import logging
+import math
+from datetime import datetime
+from typing import AsyncGenerator, AsyncIterator, List, Optional, Tuple
+
+from aiogram import Bot
+from aiogram.types.input_file import DEFAULT_CHUNK_SIZE, InputFile
+
+import database as db
+from strings import UTILITY_TYPES
+
+CSV_COLUMNS = ("kind", "type", "name", "amount", "currency", "date")
+CURRENCIES = {"UZS", "USD", "RUB", "CNY"}
+RECORD_TYPES = {
+    "transaction": {"expense", "income"},
+    "debt": {"owed_to_me", "i_owe"},
+    "utility": set(UTILITY_TYPES),
+}
+DATE_FORMATS = ("%Y-%m-%d %H:%M", "%Y-%m-%d")
+EXPORT_PAGE_SIZE = 1000
+IMPORT_BATCH_SIZE = 5000
+
+logger = logging.getLogger(__name__)
+
+
+# ===================== EXPORT =====================
+
+class CsvExportFile(InputFile):
+    """All records of one user as CSV, generated while it is being uploaded.
+
+    Rows are read from the database page by page and encoded in chunks of
+    `chunk_size`, so memory use does not grow with the size of the history.
+    """
+
+    def __init__(self, user_id: int, filename: str = "smartbalance.csv",
+                 chunk_size: int = DEFAULT_CHUNK_SIZE):
+        super().__init__(filename=filename, chunk_size=chunk_size)
+        self.user_id = user_id
+
+    async def _rows(self) -> AsyncIterator[tuple]:
+        async for row in db.iter_transactions(self.user_id, EXPORT_PAGE_SIZE):
+            yield "transaction", row["type"], row["goal"], row["amount"], row["currency"], row["date"]
+        async for row in db.iter_debts(self.user_id, EXPORT_PAGE_SIZE):
+            yield "debt", row["type"], row["name"], row["amount"], row["currency"], row["date"]
+        async for row in db.iter_utilities(self.user_id, EXPORT_PAGE_SIZE):
+            yield "utility", row["utility_type"], "", row["amount"], row["currency"], row["date"]
+
+    async def read(self, bot: Bot) -> AsyncGenerator[bytes, None]:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator="\n")
+        writer.writerow(CSV_COLUMNS)
+        async for row in self._rows():
+            writer.writerow(row)
+            if buffer.tell() >= self.chunk_size:
+                yield buffer.getvalue().encode()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue().encode()
+
+
+# ===================== IMPORT =====================
+
+async def stream_document(bot: Bot, file_id: str, chunk_size: int = DEFAULT_CHUNK_SIZE) -> AsyncIterator[bytes]:
+    """Download a file sent to the bot chunk by chunk."""
+    file = await bot.get_file(file_id)
+    url = bot.session.api.file_url(bot.token, file.file_path)
+    async for chunk in bot.session.stream_content(url, chunk_size=chunk_size):
+        yield chunk
+
+
+class ImportFailed(Exception):
+    """Raised when a batch cannot be stored; `imported` records were committed before it."""
+
+    def __init__(self, imported: int):
+        super().__init__(f"import failed after {imported} records")
+        self.imported = imported
+
+
+async def iter_csv_records(chunks: AsyncIterator[bytes]) -> AsyncIterator[List[str]]:
+    """Parse CSV records from a stream of byte chunks as they arrive.
+
+    Quoted fields may contain line breaks: lines are collected until their
+    quotes balance before being handed to the csv module.
+    """
+    decoder = codecs.getincrementaldecoder("utf-8-sig")()
+    pending = ""
+    record_lines: List[str] = []
+    quotes = 0
+
+    def complete(lines: List[str]):
+        nonlocal record_lines, quotes
+        for line in lines:
+            record_lines.append(line)
+            quotes += line.count('"')
+            if quotes % 2 == 0:
+                text = "\n".join(record_lines)
+                record_lines, quotes = [], 0
+                if text.strip():
+                    yield next(csv.reader([text]))
+
+    async for chunk in chunks:
+        lines = (pending + decoder.decode(chunk)).split("\n")
+        pending = lines.pop()
+        for record in complete(lines):
+            yield record
+    for record in complete([pending + decoder.decode(b"", final=True)]):
+        yield record
+
+
+def _parse_date(value: str) -> Optional[datetime]:
+    for date_format in DATE_FORMATS:
+        try:
+            return datetime.strptime(value, date_format)
+        except ValueError:
+            pass
+    return None
+
+
+def parse_record(fields: List[str]) -> Optional[tuple]:
+    """(kind, type, name, amount, currency, moment) from a CSV record, None if invalid."""
+    if len(fields) < len(CSV_COLUMNS):
+        return None
+    kind, entry_type, name, amount, currency, date = (field.strip() for field in fields[:len(CSV_COLUMNS)])
+    kind = kind.lower()
+    currency = currency.upper()
+    if entry_type not in RECORD_TYPES.get(kind, ()) or currency not in CURRENCIES:
+        return None
+    try:
+        amount = float(amount.replace(" ", "").replace(",", "."))
+    except ValueError:
+        return None
+    moment = _parse_date(date)
+    # float() also accepts nan and inf, which would poison the stored totals
+    if not math.isfinite(amount) or amount <= 0 or moment is None:
+        return None
+    return kind, entry_type, name, amount, currency, moment
+
+
+async def import_csv(user_id: int, chunks: AsyncIterator[bytes],
+                     batch_size: int = IMPORT_BATCH_SIZE) -> Tuple[int, int]:
+    """Import a CSV stream in transactions of `batch_size` records; returns (imported, skipped).
+
+    Batches committed before a failure stay imported; the failure is raised
+    as ImportFailed carrying their count.
+    """
+    imported = 0
+    skipped = 0
+    batch = []
+    first = True
+    async for fields in iter_csv_records(chunks):
+        if first:
+            first = False
+            if [field.strip().lower() for field in fields] == list(CSV_COLUMNS):
+                continue
+        record = parse_record(fields)
+        if record is None:
+            skipped += 1
+            continue
+        batch.append(record)
+        if len(batch) >= batch_size:
+            imported += await _import_batch(user_id, batch, imported)
+            batch = []
+    if batch:
+        imported += await _import_batch(user_id, batch, imported)
+    logger.info(f"Imported {imported} records for user {user_id}, skipped {skipped}")
+    return imported, skipped
+
+
+async def _import_batch(user_id: int, batch: List[tuple], imported: int) -> int:
+    try:
+        return await db.import_records(user_id, batch)
+    except Exception as e:
+        raise ImportFailed(imported) from e
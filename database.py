@@ -1,19 +1,392 @@
 # database.py - Database operations with aiosqlite
 
+import argparse
+import asyncio
 import aiosqlite
+import calendar
 import logging
-from datetime import datetime
-from typing import Optional, List, Dict, Any
+import os
+import time
+from bisect import bisect_left
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, fields, replace
+from datetime import datetime, timedelta
+from typing import Optional, List, Dict, Any, AsyncIterator, Tuple
+
+from cache import LRUCache
 
 DATABASE_NAME = "finance_bot.db"
+PAGE_SIZE = 20
 
 logger = logging.getLogger(__name__)
 
 
-async def init_db():
-    """Initialize the database and create tables."""
+# ===================== SETTINGS =====================
+
+JOURNAL_MODES = {"DELETE", "TRUNCATE", "PERSIST", "MEMORY", "WAL", "OFF"}
+SYNCHRONOUS_MODES = {"OFF", "NORMAL", "FULL", "EXTRA"}
+TEMP_STORES = {"DEFAULT", "FILE", "MEMORY"}
+
+
+@dataclass(frozen=True)
+class DatabaseSettings:
+    """SQLite performance profile applied to every pooled connection.
+
+    The defaults use WAL with synchronous=NORMAL: commits no longer fsync the
+    main database file and readers are not blocked by the writer, while the
+    database stays consistent after a crash.
+    """
+    readers: int = 4
+    journal_mode: str = "WAL"
+    synchronous: str = "NORMAL"
+    mmap_size: int = 64 * 1024 * 1024
+    cache_size: int = -16000  # negative values are KiB, i.e. ~16 MB
+    temp_store: str = "MEMORY"
+    busy_timeout: int = 5000  # milliseconds
+    user_cache_size: int = 10000
+    month_index_size: int = 20000  # (user, kind) month lists kept in memory
+    data_version_size: int = 100000  # users whose data version is tracked individually
+    write_batch_size: int = 0  # rows per write-behind batch; 0 commits every insert on its own
+    write_batch_ms: int = 10  # longest a queued insert waits for its batch
+
+    def __post_init__(self):
+        if self.journal_mode.upper() not in JOURNAL_MODES:
+            raise ValueError(f"Unsupported journal_mode: {self.journal_mode}")
+        if self.synchronous.upper() not in SYNCHRONOUS_MODES:
+            raise ValueError(f"Unsupported synchronous mode: {self.synchronous}")
+        if self.temp_store.upper() not in TEMP_STORES:
+            raise ValueError(f"Unsupported temp_store: {self.temp_store}")
+
+    def pragmas(self) -> List[str]:
+        """Per-connection PRAGMA statements for this profile."""
+        return [
+            f"PRAGMA synchronous = {self.synchronous.upper()}",
+            f"PRAGMA mmap_size = {int(self.mmap_size)}",
+            f"PRAGMA cache_size = {int(self.cache_size)}",
+            f"PRAGMA temp_store = {self.temp_store.upper()}",
+            f"PRAGMA busy_timeout = {int(self.busy_timeout)}",
+        ]
+
+    @classmethod
+    def from_env(cls) -> "DatabaseSettings":
+        """Build settings from DB_PROFILE plus optional DB_<FIELD> overrides."""
+        profile_name = os.getenv("DB_PROFILE", "wal").lower()
+        if profile_name not in PROFILES:
+            raise ValueError(f"Unknown DB_PROFILE: {profile_name}")
+        overrides: Dict[str, Any] = {}
+        for field in fields(cls):
+            value = os.getenv(f"DB_{field.name.upper()}")
+            if value is not None:
+                overrides[field.name] = int(value) if field.type is int else value
+        return replace(PROFILES[profile_name], **overrides)
+
+
+PROFILES = {
+    # SQLite's own defaults: rollback journal, fsync on every commit
+    "default": DatabaseSettings(
+        journal_mode="DELETE", synchronous="FULL", mmap_size=0,
+        cache_size=-2000, temp_store="DEFAULT", busy_timeout=5000
+    ),
+    "wal": DatabaseSettings(),
+}
+
+
+# ===================== CONNECTION POOL =====================
+
+class ConnectionPool:
+    """One writer connection plus a small pool of reader connections.
+
+    Connections are opened once and reused, so queries no longer pay for a
+    new worker thread and file open on every call. Writes are serialized
+    through a lock so each caller's statements and commit run together.
+    """
+
+    def __init__(self, database: str, settings: DatabaseSettings):
+        self.database = database
+        self.settings = settings
+        self.size = max(1, settings.readers)
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._readers: "asyncio.Queue[aiosqlite.Connection]" = asyncio.Queue()
+        self._all_readers: List[aiosqlite.Connection] = []
+
+    async def _connect(self) -> aiosqlite.Connection:
+        conn = await aiosqlite.connect(self.database)
+        conn.row_factory = aiosqlite.Row
+        for pragma in self.settings.pragmas():
+            await conn.execute(pragma)
+        return conn
+
+    async def open(self):
+        """Open the writer and reader connections."""
+        self._writer = await self._connect()
+        # journal_mode is persistent, so setting it once on the writer is enough
+        async with self._writer.execute(
+            f"PRAGMA journal_mode = {self.settings.journal_mode.upper()}"
+        ) as cursor:
+            row = await cursor.fetchone()
+            logger.info(f"SQLite journal mode: {row[0]}")
+        for _ in range(self.size):
+            conn = await self._connect()
+            self._all_readers.append(conn)
+            self._readers.put_nowait(conn)
+
+    async def close(self):
+        """Close every connection owned by the pool."""
+        for conn in self._all_readers:
+            await conn.close()
+        self._all_readers.clear()
+        self._readers = asyncio.Queue()
+        if self._writer is not None:
+            await self._writer.close()
+            self._writer = None
+
+    @asynccontextmanager
+    async def read(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Borrow a reader connection for the duration of the block."""
+        conn = await self._readers.get()
+        try:
+            yield conn
+        finally:
+            self._readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def write(self) -> AsyncIterator[aiosqlite.Connection]:
+        """Hold the writer connection; uncommitted work is rolled back on error."""
+        async with self._write_lock:
+            try:
+                yield self._writer
+            except BaseException:
+                await self._writer.rollback()
+                raise
+
+
+_pool: Optional[ConnectionPool] = None
+
+
+# ===================== WRITE-BEHIND BATCHING =====================
+
+class WriteBatcher:
+    """Queue of inserts committed together in one transaction.
+
+    A batch is written with executemany once `batch_size` inserts are queued
+    or `interval` seconds after its first insert, whichever comes first, and
+    its monthly_totals changes are applied in the same transaction. submit()
+    returns only after the batch holding the insert has committed (or raises
+    if it failed), so callers get the same durability as a direct write.
+    """
+
+    def __init__(self, pool: ConnectionPool, batch_size: int, interval: float):
+        self.pool = pool
+        self.batch_size = max(1, batch_size)
+        self.interval = interval
+        self.batches = 0
+        self.rows = 0
+        self._queue: "asyncio.Queue[Optional[tuple]]" = asyncio.Queue()
+        self._full = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def submit(self, sql: str, params: tuple, totals: Optional[tuple] = None):
+        """Queue one insert (plus its monthly_totals key and amount) and wait for its commit."""
+        future = asyncio.get_running_loop().create_future()
+        self._queue.put_nowait((sql, params, totals, future))
+        # The flush task has already taken the batch's first insert off the queue
+        if self._queue.qsize() + 1 >= self.batch_size:
+            self._full.set()
+        await future
+
+    async def _run(self):
+        while True:
+            first = await self._queue.get()
+            if first is None:
+                return
+            if self._queue.qsize() + 1 < self.batch_size:
+                self._full.clear()
+                try:
+                    await asyncio.wait_for(self._full.wait(), self.interval)
+                except asyncio.TimeoutError:
+                    pass
+            batch = [first]
+            stop = False
+            while len(batch) < self.batch_size and not self._queue.empty():
+                item = self._queue.get_nowait()
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+            await self._write(batch)
+            if stop:
+                return
+
+    async def _write(self, batch: List[tuple]):
+        statements: Dict[str, List[tuple]] = {}
+        for sql, params, _, _ in batch:
+            statements.setdefault(sql, []).append(params)
+        totals = _aggregate_totals(total for _, _, total, _ in batch if total is not None)
+        try:
+            async with self.pool.write() as db:
+                for sql, rows in statements.items():
+                    await db.executemany(sql, rows)
+                if totals:
+                    await db.executemany(_MONTHLY_TOTALS_UPSERT, totals)
+                await db.commit()
+        except Exception as e:
+            for *_, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+            return
+        self.batches += 1
+        self.rows += len(batch)
+        for *_, future in batch:
+            if not future.done():
+                future.set_result(None)
+
+    async def close(self):
+        """Write everything still queued, then stop the flush task."""
+        if self._task is not None:
+            self._queue.put_nowait(None)
+            self._full.set()
+            await self._task
+            self._task = None
+        logger.info(f"Write-behind stats: {self.rows} rows in {self.batches} batches")
+
+
+_batcher: Optional[WriteBatcher] = None
+
+
+# ===================== MIGRATIONS =====================
+
+# Per-day sums of the raw rows, in monthly_totals column order. Used to
+# backfill and rebuild the table and to check it against the raw data.
+_MONTHLY_TOTALS_SOURCE = """
+    SELECT user_id, 'transaction', month, substr(date, 1, 10), type, currency, SUM(amount), COUNT(*)
+    FROM transactions
+    WHERE user_id IS NOT NULL AND month IS NOT NULL AND type IS NOT NULL AND currency IS NOT NULL
+    GROUP BY user_id, month, substr(date, 1, 10), type, currency
+    UNION ALL
+    SELECT user_id, 'utility', month, substr(date, 1, 10), utility_type, currency, SUM(amount), COUNT(*)
+    FROM utilities
+    WHERE user_id IS NOT NULL AND month IS NOT NULL AND utility_type IS NOT NULL AND currency IS NOT NULL
+    GROUP BY user_id, month, substr(date, 1, 10), utility_type, currency
+"""
+
+# Schema changes applied on top of the base tables created by init_db().
+# Entry N upgrades the schema to version N + 1; PRAGMA user_version stores
+# the last applied version, so existing databases are migrated in place.
+MIGRATIONS: List[List[str]] = [
+    # 1: secondary indexes for per-user lookups
+    [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_month_date ON transactions (user_id, month, date)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_type ON transactions (user_id, type)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_date ON transactions (user_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_debts_user_type ON debts (user_id, type)",
+        "CREATE INDEX IF NOT EXISTS idx_debts_user_date ON debts (user_id, date)",
+        "CREATE INDEX IF NOT EXISTS idx_utilities_user_month_date ON utilities (user_id, month, date)",
+        "CREATE INDEX IF NOT EXISTS idx_utilities_user_date ON utilities (user_id, date)",
+    ],
+    # 2: integer timestamps for indexed day range scans, backfilled from date
+    [
+        "ALTER TABLE transactions ADD COLUMN ts INTEGER",
+        "UPDATE transactions SET ts = CAST(strftime('%s', date) AS INTEGER)",
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_ts ON transactions (user_id, ts)",
+        "ALTER TABLE utilities ADD COLUMN ts INTEGER",
+        "UPDATE utilities SET ts = CAST(strftime('%s', date) AS INTEGER)",
+        "CREATE INDEX IF NOT EXISTS idx_utilities_user_ts ON utilities (user_id, ts)",
+    ],
+    # 3: historical exchange rates (UZS per unit) keyed by effective date
+    [
+        """CREATE TABLE IF NOT EXISTS rates (
+               date TEXT NOT NULL,
+               currency TEXT NOT NULL,
+               rate REAL NOT NULL,
+               PRIMARY KEY (date, currency)
+           ) WITHOUT ROWID""",
+    ],
+    # 4: per-day sums kept up to date by add_transaction and add_utility, so
+    # every amount is converted at the rate of the day it was recorded;
+    # kind is 'transaction' (type = expense/income) or 'utility' (type = utility type)
+    [
+        """CREATE TABLE IF NOT EXISTS monthly_totals (
+               user_id INTEGER NOT NULL,
+               kind TEXT NOT NULL,
+               month TEXT NOT NULL,
+               day TEXT NOT NULL,
+               type TEXT NOT NULL,
+               currency TEXT NOT NULL,
+               total REAL NOT NULL,
+               count INTEGER NOT NULL,
+               PRIMARY KEY (user_id, kind, month, day, type, currency)
+           ) WITHOUT ROWID""",
+        "INSERT INTO monthly_totals " + _MONTHLY_TOTALS_SOURCE,
+    ],
+    # 5: persistent FSM state and data for storage.SQLiteStorage
+    [
+        """CREATE TABLE IF NOT EXISTS fsm_states (
+               key TEXT PRIMARY KEY,
+               state TEXT,
+               data TEXT NOT NULL,
+               updated_at INTEGER NOT NULL
+           ) WITHOUT ROWID""",
+        "CREATE INDEX IF NOT EXISTS idx_fsm_states_updated_at ON fsm_states (updated_at)",
+    ],
+    # 6: (user_id, id) order for keyset pagination
+    [
+        "CREATE INDEX IF NOT EXISTS idx_transactions_user_id ON transactions (user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_debts_user_id ON debts (user_id, id)",
+        "CREATE INDEX IF NOT EXISTS idx_utilities_user_id ON utilities (user_id, id)",
+    ],
+    # 7: database-wide counters; data_epoch is bumped by rewrites of derived
+    # data so every process serving the database drops its cached reports
+    [
+        """CREATE TABLE IF NOT EXISTS meta (
+               key TEXT PRIMARY KEY,
+               value INTEGER NOT NULL
+           ) WITHOUT ROWID""",
+        "INSERT OR IGNORE INTO meta (key, value) VALUES ('data_epoch', 0)",
+    ],
+]
+
+
+async def _migrate(db: aiosqlite.Connection):
+    """Apply pending migrations, each one in its own transaction."""
+    async with db.execute("PRAGMA user_version") as cursor:
+        version = (await cursor.fetchone())[0]
+    for number, statements in enumerate(MIGRATIONS[version:], start=version + 1):
+        await db.execute("BEGIN")
+        for statement in statements:
+            await db.execute(statement)
+        await db.execute(f"PRAGMA user_version = {number}")
+        await db.commit()
+        logger.info(f"Database migrated to schema version {number}")
+
+
+def _get_pool() -> ConnectionPool:
+    if _pool is None:
+        raise RuntimeError("Database is not initialized, call init_db() first")
+    return _pool
+
+
+async def init_db(database: str = DATABASE_NAME, settings: Optional[DatabaseSettings] = None):
+    """Open the connection pool with the given performance profile, then create tables."""
+    global _pool, _user_cache, _month_index, _data_versions, _batcher
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
+        if _pool is None:
+            settings = settings or DatabaseSettings()
+            pool = ConnectionPool(database, settings)
+            await pool.open()
+            _pool = pool
+            _user_cache = LRUCache(settings.user_cache_size)
+            _month_index = LRUCache(settings.month_index_size)
+            _data_versions = LRUCache(settings.data_version_size)
+            _forget_data_versions()
+            if settings.write_batch_size > 0:
+                _batcher = WriteBatcher(pool, settings.write_batch_size, settings.write_batch_ms / 1000)
+                _batcher.start()
+        async with _pool.write() as db:
             # Users table
             await db.execute('''
                 CREATE TABLE IF NOT EXISTS users (
@@ -68,24 +441,262 @@ async def init_db():
             ''')
             
             await db.commit()
-            logger.info("Database initialized successfully")
+            await _migrate(db)
+        await _refresh_data_epoch()
+        logger.info("Database initialized successfully")
     except Exception as e:
         logger.error(f"Error initializing database: {e}")
         raise
 
 
+async def close_db():
+    """Close the connection pool opened by init_db()."""
+    global _pool, _batcher
+    if _pool is None:
+        return
+    try:
+        if _batcher is not None:
+            await _batcher.close()
+            _batcher = None
+        logger.info(f"User cache stats: {_user_cache.stats()}")
+        logger.info(f"Month index stats: {_month_index.stats()}")
+        await _pool.close()
+        logger.info("Database connections closed")
+    except Exception as e:
+        logger.error(f"Error closing database: {e}")
+    finally:
+        _pool = None
+
+
+# ===================== DATE HELPERS =====================
+
+def _timestamp(moment: datetime) -> int:
+    """Seconds since the epoch for a naive local datetime.
+
+    The wall-clock time is encoded as if it were UTC, which matches
+    strftime('%s', date) in SQLite and keeps ts aligned with the date column.
+    """
+    return calendar.timegm(moment.timetuple())
+
+
+def _day_range(month: str, day: int) -> Optional[tuple]:
+    """Inclusive ts bounds covering one calendar day of a YYYY-MM month.
+
+    Returns None for days the month does not have (e.g. 2024-02-30).
+    """
+    try:
+        start = datetime.strptime(f"{month}-{day:02d}", "%Y-%m-%d")
+    except ValueError:
+        return None
+    return _timestamp(start), _timestamp(start + timedelta(days=1)) - 1
+
+
+# ===================== PAGINATION =====================
+
+def _page_query(table: str, where: str, params: tuple, after_id: Optional[int] = None,
+                before_id: Optional[int] = None, limit: int = PAGE_SIZE,
+                seek_by_id: bool = True) -> Tuple[str, tuple]:
+    """SQL and parameters of one _fetch_page page.
+
+    With `seek_by_id` false the id cursor is written as `+id`, which SQLite
+    cannot serve from an index; a narrow `where` (one day of one user) then
+    stays on its own index instead of walking the user's (user_id, id) index
+    back through their whole history.
+    """
+    column = "id" if seek_by_id else "+id"
+    if before_id is not None:
+        sql = f"SELECT * FROM {table} WHERE {where} AND {column} > ? ORDER BY id ASC LIMIT ?"
+        params = (*params, before_id, limit)
+    elif after_id is not None:
+        sql = f"SELECT * FROM {table} WHERE {where} AND {column} < ? ORDER BY id DESC LIMIT ?"
+        params = (*params, after_id, limit)
+    else:
+        sql = f"SELECT * FROM {table} WHERE {where} ORDER BY id DESC LIMIT ?"
+        params = (*params, limit)
+    return sql, params
+
+
+async def _fetch_page(table: str, where: str, params: tuple, after_id: Optional[int] = None,
+                      before_id: Optional[int] = None, limit: int = PAGE_SIZE,
+                      seek_by_id: bool = True) -> List[Dict[str, Any]]:
+    """One keyset page of `table` rows matching `where`, newest (highest id) first.
+
+    `after_id` returns the rows listed after that id (the next page),
+    `before_id` the rows listed before it (the previous page). Only `limit`
+    rows are read, however long the history is.
+    """
+    sql, params = _page_query(table, where, params, after_id, before_id, limit, seek_by_id)
+    async with _get_pool().read() as db:
+        async with db.execute(sql, params) as cursor:
+            rows = [dict(row) for row in await cursor.fetchall()]
+    if before_id is not None:
+        rows.reverse()
+    return rows
+
+
+async def _stream(table: str, user_id: int, page_size: int) -> AsyncIterator[Dict[str, Any]]:
+    """Yield every row of a user, newest first, one page at a time.
+
+    A reader connection is only held while a page is fetched, never while
+    the consumer works on the rows.
+    """
+    after_id = None
+    while True:
+        rows = await _fetch_page(table, "user_id = ?", (user_id,), after_id=after_id, limit=page_size)
+        for row in rows:
+            yield row
+        if len(rows) < page_size:
+            return
+        after_id = rows[-1]["id"]
+
+
+# ===================== DATA VERSIONS =====================
+
+# Seconds between reads of the data epoch stored in the meta table
+DATA_EPOCH_CHECK_INTERVAL = 5
+
+# Per-user versions: the value of _data_writes at the user's last committed
+# write. Users missing from the LRU get _evicted_version, which is at least
+# the version any evicted user had, so no user's version ever goes back.
+_data_versions = LRUCache(DatabaseSettings.data_version_size)
+_data_writes = 0
+_evicted_version = 0
+# meta.data_epoch as last read; bumped by rewrites that touch every user,
+# possibly from another process (python database.py rebuild-totals)
+_data_epoch = 0
+_epoch_checked_at = float("-inf")
+
+
+def _data_changed(user_id: int):
+    global _data_writes, _evicted_version
+    if user_id not in _data_versions and len(_data_versions) >= _data_versions.maxsize:
+        _evicted_version = _data_writes
+    _data_writes += 1
+    _data_versions.set(user_id, _data_writes)
+
+
+def _forget_data_versions():
+    """Move every user's version past all versions handed out so far."""
+    global _data_writes, _evicted_version
+    _data_writes += 1
+    _evicted_version = _data_writes
+    _data_versions.clear()
+
+
+async def _refresh_data_epoch():
+    """Read meta.data_epoch; a new value outdates every data version and the month index."""
+    global _data_epoch, _epoch_checked_at, _month_writes
+    _epoch_checked_at = time.monotonic()
+    try:
+        async with _get_pool().read() as db:
+            async with db.execute("SELECT value FROM meta WHERE key = 'data_epoch'") as cursor:
+                row = await cursor.fetchone()
+    except Exception as e:
+        logger.error(f"Error reading data epoch: {e}")
+        return
+    epoch = row[0] if row else 0
+    if epoch != _data_epoch:
+        _data_epoch = epoch
+        _forget_data_versions()
+        _month_index.clear()
+        # Keeps a month list loaded before the rebuild out of the index
+        _month_writes += 1
+
+
+async def get_data_version(user_id: int) -> int:
+    """A number that grows with every write to the user's records.
+
+    Caches of derived data (rendered reports) put it in their keys; read it
+    before the data it describes, so a write racing with the read leaves
+    the entry under an outdated version instead of a current one. A rebuild
+    run by another process is seen within DATA_EPOCH_CHECK_INTERVAL seconds.
+    """
+    if time.monotonic() - _epoch_checked_at >= DATA_EPOCH_CHECK_INTERVAL:
+        await _refresh_data_epoch()
+    return _data_versions.get(user_id, _evicted_version)
+
+
+# ===================== MONTH INDEX =====================
+
+# Ascending months with records per (user_id, kind), loaded from
+# monthly_totals on first use and extended as inserts land in new months
+_month_index = LRUCache(DatabaseSettings.month_index_size)
+# Bumped on every insert so a load that raced with one is not cached
+_month_writes = 0
+
+
+def _month_added(user_id: int, kind: str, month: str):
+    """Record that the user now has `kind` rows in `month`."""
+    global _month_writes
+    _month_writes += 1
+    months = _month_index.peek((user_id, kind))
+    if months is None:
+        return
+    i = bisect_left(months, month)
+    if i == len(months) or months[i] != month:
+        months.insert(i, month)
+
+
+async def get_months(user_id: int, kind: str) -> List[str]:
+    """Months in which the user has `kind` (transaction or utility) records, newest first."""
+    try:
+        months = _month_index.get((user_id, kind))
+        if months is None:
+            writes = _month_writes
+            async with _get_pool().read() as db:
+                async with db.execute(
+                    "SELECT DISTINCT month FROM monthly_totals WHERE user_id = ? AND kind = ? ORDER BY month",
+                    (user_id, kind)
+                ) as cursor:
+                    months = [row[0] for row in await cursor.fetchall()]
+            if writes == _month_writes:
+                _month_index.set((user_id, kind), months)
+        return months[::-1]
+    except Exception as e:
+        logger.error(f"Error getting {kind} months: {e}")
+        return []
+
+
 # ===================== USER OPERATIONS =====================
 
+# Profiles read by get_user, kept current by the user update functions
+_user_cache = LRUCache(DatabaseSettings.user_cache_size)
+# Bumped on every user write so a lookup that raced with one is not cached
+_user_writes = 0
+
+
+def _user_changed(user_id: int, **changes):
+    """Apply a committed profile change to the cache."""
+    global _user_writes
+    _user_writes += 1
+    cached = _user_cache.peek(user_id)
+    if cached is not None:
+        _user_cache.set(user_id, {**cached, **changes})
+
+
+def get_user_cache_stats() -> Dict[str, Any]:
+    """Hit/miss counters and size of the user profile cache."""
+    return _user_cache.stats()
+
+
 async def get_user(user_id: int) -> Optional[Dict[str, Any]]:
     """Get user by ID."""
+    cached = _user_cache.get(user_id)
+    if cached is not None:
+        return dict(cached)
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            db.row_factory = aiosqlite.Row
+        writes = _user_writes
+        async with _get_pool().read() as db:
             async with db.execute(
                 "SELECT * FROM users WHERE user_id = ?", (user_id,)
             ) as cursor:
                 row = await cursor.fetchone()
-                return dict(row) if row else None
+                if row is None:
+                    return None
+                user = dict(row)
+                if writes == _user_writes:
+                    _user_cache.set(user_id, user)
+                return dict(user)
     except Exception as e:
         logger.error(f"Error getting user {user_id}: {e}")
         return None
@@ -94,12 +705,13 @@ async def get_user(user_id: int) -> Optional[Dict[str, Any]]:
 async def create_user(user_id: int, language: str = "en"):
     """Create a new user."""
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
+        async with _get_pool().write() as db:
             await db.execute(
                 "INSERT OR IGNORE INTO users (user_id, language, main_currency, created_at) VALUES (?, ?, ?, ?)",
                 (user_id, language, "UZS", datetime.now().isoformat())
             )
             await db.commit()
+        _user_changed(user_id)
     except Exception as e:
         logger.error(f"Error creating user {user_id}: {e}")
 
@@ -107,12 +719,13 @@ async def create_user(user_id: int, language: str = "en"):
 async def update_user_language(user_id: int, language: str):
     """Update user's language."""
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
+        async with _get_pool().write() as db:
             await db.execute(
                 "UPDATE users SET language = ? WHERE user_id = ?",
                 (language, user_id)
             )
             await db.commit()
+        _user_changed(user_id, language=language)
     except Exception as e:
         logger.error(f"Error updating language for user {user_id}: {e}")
 
@@ -120,12 +733,14 @@ async def update_user_language(user_id: int, language: str):
 async def update_main_currency(user_id: int, currency: str):
     """Update user's main currency."""
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
+        async with _get_pool().write() as db:
             await db.execute(
                 "UPDATE users SET main_currency = ? WHERE user_id = ?",
                 (currency, user_id)
             )
             await db.commit()
+        _user_changed(user_id, main_currency=currency)
+        _data_changed(user_id)
     except Exception as e:
         logger.error(f"Error updating main currency for user {user_id}: {e}")
 
@@ -144,131 +759,123 @@ async def get_user_main_currency(user_id: int) -> str:
 
 # ===================== TRANSACTION OPERATIONS =====================
 
+_INSERT_TRANSACTION = """INSERT INTO transactions (user_id, type, goal, amount, currency, date, month, ts)
+                         VALUES (?, ?, ?, ?, ?, ?, ?, ?)"""
+
 async def add_transaction(user_id: int, trans_type: str, goal: str, amount: float, currency: str):
     """Add a new transaction (expense or income)."""
     try:
-        now = datetime.now()
+        now = datetime.now().replace(second=0, microsecond=0)
         date_str = now.strftime("%Y-%m-%d %H:%M")
         month_str = now.strftime("%Y-%m")
         
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            await db.execute(
-                """INSERT INTO transactions (user_id, type, goal, amount, currency, date, month)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (user_id, trans_type, goal, amount, currency, date_str, month_str)
-            )
-            await db.commit()
+        await _insert(
+            _INSERT_TRANSACTION,
+            (user_id, trans_type, goal, amount, currency, date_str, month_str, _timestamp(now)),
+            (user_id, "transaction", month_str, date_str[:10], trans_type, currency, amount)
+        )
+        _data_changed(user_id)
         return date_str
     except Exception as e:
         logger.error(f"Error adding transaction: {e}")
         return None
 
 
-async def get_all_transactions(user_id: int) -> List[Dict[str, Any]]:
-    """Get all transactions for a user."""
+async def get_transactions_page(user_id: int, after_id: Optional[int] = None,
+                                before_id: Optional[int] = None, limit: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Get one page of a user's transactions, newest first."""
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM transactions WHERE user_id = ? ORDER BY date DESC",
-                (user_id,)
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        return await _fetch_page("transactions", "user_id = ?", (user_id,), after_id, before_id, limit)
     except Exception as e:
-        logger.error(f"Error getting transactions: {e}")
+        logger.error(f"Error getting transactions page: {e}")
         return []
 
 
-async def get_transactions_by_month(user_id: int, month: str) -> List[Dict[str, Any]]:
-    """Get transactions for a specific month."""
+def iter_transactions(user_id: int, page_size: int = PAGE_SIZE) -> AsyncIterator[Dict[str, Any]]:
+    """Stream all transactions of a user, newest first."""
+    return _stream("transactions", user_id, page_size)
+
+
+async def get_transactions_page_by_date(user_id: int, month: str, day: int,
+                                        after_id: Optional[int] = None, before_id: Optional[int] = None,
+                                        limit: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Get one page of the transactions of a specific date."""
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM transactions WHERE user_id = ? AND month = ? ORDER BY date DESC",
-                (user_id, month)
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        day_range = _day_range(month, day)
+        if day_range is None:
+            return []
+        return await _fetch_page(
+            "transactions", "user_id = ? AND ts BETWEEN ? AND ?", (user_id, *day_range),
+            after_id, before_id, limit, seek_by_id=False
+        )
     except Exception as e:
-        logger.error(f"Error getting transactions by month: {e}")
+        logger.error(f"Error getting transactions page by date: {e}")
         return []
 
 
-async def get_transactions_by_date(user_id: int, month: str, day: int) -> List[Dict[str, Any]]:
-    """Get transactions for a specific date."""
+async def get_transaction_totals(user_id: int, month: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Transaction sums per day, type and currency, optionally for one month."""
     try:
-        date_pattern = f"{month}-{day:02d}%"
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM transactions WHERE user_id = ? AND date LIKE ? ORDER BY date DESC",
-                (user_id, date_pattern)
-            ) as cursor:
+        query = """SELECT month, day, type, currency, total FROM monthly_totals
+                   WHERE user_id = ? AND kind = 'transaction'"""
+        params: tuple = (user_id,)
+        if month is not None:
+            query += " AND month = ?"
+            params += (month,)
+        async with _get_pool().read() as db:
+            async with db.execute(query, params) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
     except Exception as e:
-        logger.error(f"Error getting transactions by date: {e}")
+        logger.error(f"Error getting transaction totals: {e}")
         return []
 
 
 async def get_available_months(user_id: int) -> List[str]:
     """Get all available months for a user."""
-    try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            async with db.execute(
-                "SELECT DISTINCT month FROM transactions WHERE user_id = ? ORDER BY month DESC",
-                (user_id,)
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [row[0] for row in rows]
-    except Exception as e:
-        logger.error(f"Error getting available months: {e}")
-        return []
+    return await get_months(user_id, "transaction")
 
 
 # ===================== DEBT OPERATIONS =====================
 
+_INSERT_DEBT = """INSERT INTO debts (user_id, name, amount, currency, type, date)
+                  VALUES (?, ?, ?, ?, ?, ?)"""
+
 async def add_debt(user_id: int, name: str, amount: float, currency: str, debt_type: str):
     """Add a new debt."""
     try:
         date_str = datetime.now().strftime("%Y-%m-%d %H:%M")
         
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            await db.execute(
-                """INSERT INTO debts (user_id, name, amount, currency, type, date)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (user_id, name, amount, currency, debt_type, date_str)
-            )
-            await db.commit()
+        await _insert(
+            _INSERT_DEBT,
+            (user_id, name, amount, currency, debt_type, date_str)
+        )
+        _data_changed(user_id)
         return date_str
     except Exception as e:
         logger.error(f"Error adding debt: {e}")
         return None
 
 
-async def get_all_debts(user_id: int) -> List[Dict[str, Any]]:
-    """Get all debts for a user."""
+async def get_debts_page(user_id: int, after_id: Optional[int] = None,
+                         before_id: Optional[int] = None, limit: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Get one page of a user's debts, newest first."""
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM debts WHERE user_id = ? ORDER BY date DESC",
-                (user_id,)
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        return await _fetch_page("debts", "user_id = ?", (user_id,), after_id, before_id, limit)
     except Exception as e:
-        logger.error(f"Error getting debts: {e}")
+        logger.error(f"Error getting debts page: {e}")
         return []
 
 
+def iter_debts(user_id: int, page_size: int = PAGE_SIZE) -> AsyncIterator[Dict[str, Any]]:
+    """Stream all debts of a user, newest first."""
+    return _stream("debts", user_id, page_size)
+
+
 async def get_debt_by_id(debt_id: int) -> Optional[Dict[str, Any]]:
     """Get a debt by ID."""
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            db.row_factory = aiosqlite.Row
+        async with _get_pool().read() as db:
             async with db.execute(
                 "SELECT * FROM debts WHERE id = ?", (debt_id,)
             ) as cursor:
@@ -282,12 +889,15 @@ async def get_debt_by_id(debt_id: int) -> Optional[Dict[str, Any]]:
 async def update_debt_amount(debt_id: int, new_amount: float):
     """Update a debt's amount."""
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            await db.execute(
-                "UPDATE debts SET amount = ? WHERE id = ?",
+        async with _get_pool().write() as db:
+            async with db.execute(
+                "UPDATE debts SET amount = ? WHERE id = ? RETURNING user_id",
                 (new_amount, debt_id)
-            )
+            ) as cursor:
+                row = await cursor.fetchone()
             await db.commit()
+        if row:
+            _data_changed(row[0])
     except Exception as e:
         logger.error(f"Error updating debt: {e}")
 
@@ -295,29 +905,34 @@ async def update_debt_amount(debt_id: int, new_amount: float):
 async def delete_debt(debt_id: int):
     """Delete a debt."""
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            await db.execute("DELETE FROM debts WHERE id = ?", (debt_id,))
+        async with _get_pool().write() as db:
+            async with db.execute("DELETE FROM debts WHERE id = ? RETURNING user_id", (debt_id,)) as cursor:
+                row = await cursor.fetchone()
             await db.commit()
+        if row:
+            _data_changed(row[0])
     except Exception as e:
         logger.error(f"Error deleting debt: {e}")
 
 
 # ===================== UTILITY OPERATIONS =====================
 
+_INSERT_UTILITY = """INSERT INTO utilities (user_id, utility_type, amount, currency, date, month, ts)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)"""
+
 async def add_utility(user_id: int, utility_type: str, amount: float, currency: str):
     """Add a new utility payment."""
     try:
-        now = datetime.now()
+        now = datetime.now().replace(second=0, microsecond=0)
         date_str = now.strftime("%Y-%m-%d %H:%M")
         month_str = now.strftime("%Y-%m")
         
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            await db.execute(
-                """INSERT INTO utilities (user_id, utility_type, amount, currency, date, month)
-                   VALUES (?, ?, ?, ?, ?, ?)""",
-                (user_id, utility_type, amount, currency, date_str, month_str)
-            )
-            await db.commit()
+        await _insert(
+            _INSERT_UTILITY,
+            (user_id, utility_type, amount, currency, date_str, month_str, _timestamp(now)),
+            (user_id, "utility", month_str, date_str[:10], utility_type, currency, amount)
+        )
+        _data_changed(user_id)
         return date_str
     except Exception as e:
         logger.error(f"Error adding utility: {e}")
@@ -327,8 +942,7 @@ async def add_utility(user_id: int, utility_type: str, amount: float, currency:
 async def get_utilities_by_month(user_id: int, month: str) -> List[Dict[str, Any]]:
     """Get utilities for a specific month."""
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            db.row_factory = aiosqlite.Row
+        async with _get_pool().read() as db:
             async with db.execute(
                 "SELECT * FROM utilities WHERE user_id = ? AND month = ? ORDER BY date DESC",
                 (user_id, month)
@@ -340,49 +954,257 @@ async def get_utilities_by_month(user_id: int, month: str) -> List[Dict[str, Any
         return []
 
 
-async def get_utilities_by_date(user_id: int, month: str, day: int) -> List[Dict[str, Any]]:
-    """Get utilities for a specific date."""
+async def get_utilities_page_by_date(user_id: int, month: str, day: int,
+                                     after_id: Optional[int] = None, before_id: Optional[int] = None,
+                                     limit: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Get one page of the utility payments of a specific date."""
     try:
-        date_pattern = f"{month}-{day:02d}%"
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            db.row_factory = aiosqlite.Row
-            async with db.execute(
-                "SELECT * FROM utilities WHERE user_id = ? AND date LIKE ? ORDER BY date DESC",
-                (user_id, date_pattern)
-            ) as cursor:
-                rows = await cursor.fetchall()
-                return [dict(row) for row in rows]
+        day_range = _day_range(month, day)
+        if day_range is None:
+            return []
+        return await _fetch_page(
+            "utilities", "user_id = ? AND ts BETWEEN ? AND ?", (user_id, *day_range),
+            after_id, before_id, limit, seek_by_id=False
+        )
     except Exception as e:
-        logger.error(f"Error getting utilities by date: {e}")
+        logger.error(f"Error getting utilities page by date: {e}")
         return []
 
 
-async def get_all_utilities(user_id: int) -> List[Dict[str, Any]]:
-    """Get all utilities for a user."""
+async def get_utilities_page(user_id: int, after_id: Optional[int] = None,
+                             before_id: Optional[int] = None, limit: int = PAGE_SIZE) -> List[Dict[str, Any]]:
+    """Get one page of a user's utility payments, newest first."""
+    try:
+        return await _fetch_page("utilities", "user_id = ?", (user_id,), after_id, before_id, limit)
+    except Exception as e:
+        logger.error(f"Error getting utilities page: {e}")
+        return []
+
+
+def iter_utilities(user_id: int, page_size: int = PAGE_SIZE) -> AsyncIterator[Dict[str, Any]]:
+    """Stream all utility payments of a user, newest first."""
+    return _stream("utilities", user_id, page_size)
+
+
+async def get_utility_totals(user_id: int) -> List[Dict[str, Any]]:
+    """Utility payment sums per day, utility type and currency."""
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
-            db.row_factory = aiosqlite.Row
+        async with _get_pool().read() as db:
             async with db.execute(
-                "SELECT * FROM utilities WHERE user_id = ? ORDER BY date DESC",
+                """SELECT month, day, type AS utility_type, currency, total FROM monthly_totals
+                   WHERE user_id = ? AND kind = 'utility'""",
                 (user_id,)
             ) as cursor:
                 rows = await cursor.fetchall()
                 return [dict(row) for row in rows]
     except Exception as e:
-        logger.error(f"Error getting all utilities: {e}")
+        logger.error(f"Error getting utility totals: {e}")
         return []
 
 
 async def get_utility_months(user_id: int) -> List[str]:
     """Get all available months for utilities."""
+    return await get_months(user_id, "utility")
+
+
+# ===================== MONTHLY TOTALS =====================
+
+# Adds (total, count) to one monthly_totals key
+_MONTHLY_TOTALS_UPSERT = """
+    INSERT INTO monthly_totals (user_id, kind, month, day, type, currency, total, count)
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, kind, month, day, type, currency)
+    DO UPDATE SET total = total + excluded.total, count = count + excluded.count
+"""
+
+
+def _aggregate_totals(changes) -> List[tuple]:
+    """Sum (user_id, kind, month, day, type, currency, amount) changes into upsert parameters."""
+    sums: Dict[tuple, List[float]] = {}
+    for change in changes:
+        entry = sums.setdefault(change[:-1], [0.0, 0])
+        entry[0] += change[-1]
+        entry[1] += 1
+    return [(*key, total, count) for key, (total, count) in sums.items()]
+
+
+async def _insert(sql: str, params: tuple, totals: Optional[tuple] = None):
+    """Insert one row and add `totals` (user_id, kind, month, day, type, currency, amount)
+    to monthly_totals in the same transaction; queued for a batch when write-behind is on."""
+    if _batcher is not None:
+        await _batcher.submit(sql, params, totals)
+    else:
+        async with _get_pool().write() as db:
+            await db.execute(sql, params)
+            if totals is not None:
+                await db.execute(_MONTHLY_TOTALS_UPSERT, (*totals, 1))
+            await db.commit()
+    if totals is not None:
+        _month_added(*totals[:3])
+
+
+async def rebuild_monthly_totals() -> int:
+    """Recompute monthly_totals from the raw transactions and utilities.
+
+    The data epoch is bumped in the same transaction; running bot processes
+    pick it up through get_data_version().
+    """
+    async with _get_pool().write() as db:
+        await db.execute("DELETE FROM monthly_totals")
+        await db.execute("INSERT INTO monthly_totals " + _MONTHLY_TOTALS_SOURCE)
+        await db.execute("UPDATE meta SET value = value + 1 WHERE key = 'data_epoch'")
+        await db.commit()
+        async with db.execute("SELECT COUNT(*) FROM monthly_totals") as cursor:
+            count = (await cursor.fetchone())[0]
+    await _refresh_data_epoch()
+    logger.info(f"Rebuilt monthly totals: {count} rows")
+    return count
+
+
+async def check_monthly_totals(tolerance: float = 1e-6) -> List[Dict[str, Any]]:
+    """Diff monthly_totals against sums of the raw rows; returns mismatching keys."""
+    async with _get_pool().read() as db:
+        async with db.execute(_MONTHLY_TOTALS_SOURCE) as cursor:
+            expected = {tuple(row[:6]): (row[6], row[7]) for row in await cursor.fetchall()}
+        async with db.execute(
+            "SELECT user_id, kind, month, day, type, currency, total, count FROM monthly_totals"
+        ) as cursor:
+            stored = {tuple(row[:6]): (row[6], row[7]) for row in await cursor.fetchall()}
+    mismatches = []
+    for key in expected.keys() | stored.keys():
+        want = expected.get(key)
+        have = stored.get(key)
+        if want is None or have is None or abs(want[0] - have[0]) > tolerance or want[1] != have[1]:
+            user_id, kind, month, day, entry_type, currency = key
+            mismatches.append({
+                "user_id": user_id, "kind": kind, "month": month, "day": day, "type": entry_type,
+                "currency": currency, "expected": want, "stored": have
+            })
+    return mismatches
+
+
+# ===================== BULK IMPORT =====================
+
+async def import_records(user_id: int, records: List[tuple]) -> int:
+    """Insert (kind, type, name, amount, currency, moment) records in one transaction.
+
+    kind is transaction, debt or utility; name is the goal of a transaction
+    or the name of a debt. monthly_totals is updated in the same
+    transaction. Raises on failure, leaving none of the records stored.
+    """
+    transactions, debts, utilities, changes = [], [], [], []
+    for kind, entry_type, name, amount, currency, moment in records:
+        date_str = moment.strftime("%Y-%m-%d %H:%M")
+        if kind == "debt":
+            debts.append((user_id, name, amount, currency, entry_type, date_str))
+            continue
+        month_str = moment.strftime("%Y-%m")
+        if kind == "transaction":
+            transactions.append((user_id, entry_type, name, amount, currency, date_str, month_str, _timestamp(moment)))
+        else:
+            utilities.append((user_id, entry_type, amount, currency, date_str, month_str, _timestamp(moment)))
+        changes.append((user_id, kind, month_str, date_str[:10], entry_type, currency, amount))
+    async with _get_pool().write() as db:
+        await db.executemany(_INSERT_TRANSACTION, transactions)
+        await db.executemany(_INSERT_DEBT, debts)
+        await db.executemany(_INSERT_UTILITY, utilities)
+        await db.executemany(_MONTHLY_TOTALS_UPSERT, _aggregate_totals(changes))
+        await db.commit()
+    _data_changed(user_id)
+    for kind_month in {change[1:3] for change in changes}:
+        _month_added(user_id, *kind_month)
+    return len(records)
+
+
+# ===================== EXCHANGE RATE OPERATIONS =====================
+
+async def save_rates(rates: List[tuple]):
+    """Store (date, currency, rate) rows, replacing existing ones."""
+    try:
+        async with _get_pool().write() as db:
+            await db.executemany(
+                "INSERT OR REPLACE INTO rates (date, currency, rate) VALUES (?, ?, ?)",
+                rates
+            )
+            await db.commit()
+    except Exception as e:
+        logger.error(f"Error saving rates: {e}")
+
+
+async def get_all_rates() -> List[Dict[str, Any]]:
+    """Get every stored rate ordered by currency and date."""
     try:
-        async with aiosqlite.connect(DATABASE_NAME) as db:
+        async with _get_pool().read() as db:
             async with db.execute(
-                "SELECT DISTINCT month FROM utilities WHERE user_id = ? ORDER BY month DESC",
-                (user_id,)
+                "SELECT date, currency, rate FROM rates ORDER BY currency, date"
             ) as cursor:
                 rows = await cursor.fetchall()
-                return [row[0] for row in rows]
+                return [dict(row) for row in rows]
     except Exception as e:
-        logger.error(f"Error getting utility months: {e}")
+        logger.error(f"Error getting rates: {e}")
         return []
+
+
+# ===================== FSM STORAGE OPERATIONS =====================
+
+async def get_fsm_record(key: str) -> Optional[Dict[str, Any]]:
+    """Get the stored FSM state and data for a storage key."""
+    try:
+        async with _get_pool().read() as db:
+            async with db.execute(
+                "SELECT state, data, updated_at FROM fsm_states WHERE key = ?", (key,)
+            ) as cursor:
+                row = await cursor.fetchone()
+                return dict(row) if row else None
+    except Exception as e:
+        logger.error(f"Error getting FSM record: {e}")
+        return None
+
+
+async def save_fsm_records(records: List[tuple], deleted: List[str]):
+    """Upsert (key, state, data, updated_at) rows and delete keys in one transaction."""
+    async with _get_pool().write() as db:
+        if records:
+            await db.executemany(
+                "INSERT OR REPLACE INTO fsm_states (key, state, data, updated_at) VALUES (?, ?, ?, ?)",
+                records
+            )
+        if deleted:
+            await db.executemany("DELETE FROM fsm_states WHERE key = ?", [(key,) for key in deleted])
+        await db.commit()
+
+
+async def delete_fsm_records_before(updated_at: int) -> int:
+    """Delete FSM records not written since `updated_at` (epoch seconds)."""
+    try:
+        async with _get_pool().write() as db:
+            cursor = await db.execute("DELETE FROM fsm_states WHERE updated_at < ?", (updated_at,))
+            await db.commit()
+            return cursor.rowcount
+    except Exception as e:
+        logger.error(f"Error deleting expired FSM records: {e}")
+        return 0
+
+
+async def _maintenance_command(command: str):
+    await init_db()
+    try:
+        if command == "rebuild-totals":
+            await rebuild_monthly_totals()
+        elif command == "check-totals":
+            mismatches = await check_monthly_totals()
+            for mismatch in mismatches:
+                logger.warning(f"monthly_totals mismatch: {mismatch}")
+            logger.info(f"Consistency check finished: {len(mismatches)} mismatches")
+            if mismatches:
+                raise SystemExit(1)
+    finally:
+        await close_db()
+
+
+if __name__ == "__main__":
+    # python database.py rebuild-totals | check-totals
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Database maintenance")
+    parser.add_argument("command", choices=["rebuild-totals", "check-totals"])
+    asyncio.run(_maintenance_command(parser.parse_args().command))
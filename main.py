@@ -7,34 +7,90 @@ import aiohttp
 import os
 from aiohttp import web
 from datetime import datetime
-from typing import Dict, Any
+from functools import lru_cache, partial
+from typing import Dict, Any, Optional
 
 from aiogram import Bot, Dispatcher, Router, F
-from aiogram.filters import Command
+from aiogram.filters import Command, ExceptionTypeFilter
 from aiogram.types import (
-    Message, CallbackQuery, 
+    Message, CallbackQuery, ErrorEvent,
     ReplyKeyboardMarkup, KeyboardButton,
     InlineKeyboardMarkup, InlineKeyboardButton
 )
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import State, StatesGroup
-from aiogram.fsm.storage.memory import MemoryStorage
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler
 
 import database as db
-from strings import get_text, get_utility_name, UTILITY_TYPES
+import metrics
+import tracing
+from rates import RatesService
+from scheduler import UpdateDropped, UpdateScheduler
+from send_limiter import SendLimiter
+from sharding import ShardRouter, iter_queue, poll_updates
+from cache import SizedLRUCache
+from csv_transfer import CsvExportFile, ImportFailed, import_csv, stream_document
+from storage import create_storage
+from strings import build_label_index, check_catalog, format_text, get_text, get_utility_name, STRINGS, UTILITY_TYPES
 
 # ===================== CONFIGURATION =====================
 
 import os 
 BOT_TOKEN = os.getenv('BOT_TOKEN')
 
-# Exchange rates (fallback values, updated from API)
-EXCHANGE_RATES = {
-    "UZS": 1,
-    "USD": 12500,
-    "RUB": 135,
-    "CNY": 1750
-}
+# Exchange rates are refreshed in the background every RATES_TTL seconds
+RATES_TTL = int(os.getenv('RATES_TTL', 3600))
+
+# Outbound HTTP (shared by every integration through http_session)
+HTTP_TOTAL_TIMEOUT = float(os.getenv('HTTP_TOTAL_TIMEOUT', 10))
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', 3))
+HTTP_POOL_LIMIT = int(os.getenv('HTTP_POOL_LIMIT', 20))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv('HTTP_POOL_LIMIT_PER_HOST', 5))
+HTTP_DNS_CACHE_TTL = 300
+HTTP_KEEPALIVE_TIMEOUT = 30
+
+# Update delivery: polling, or webhook on the built-in web server
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')  # public base URL, e.g. https://bot.example.com
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')  # required in webhook mode
+
+# FSM storage: sqlite (bot database), redis (any RESP server) or memory
+FSM_STORAGE = os.getenv('FSM_STORAGE', 'sqlite')
+FSM_TTL = int(os.getenv('FSM_TTL', 7 * 24 * 3600))
+REDIS_URL = os.getenv('REDIS_URL', 'redis://localhost:6379/0')
+REDIS_POOL_SIZE = int(os.getenv('REDIS_POOL_SIZE', 8))  # connections to the RESP server
+
+# Updates processed at once, and per-user backlog before new updates are dropped
+UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', 64))
+USER_QUEUE_LIMIT = int(os.getenv('USER_QUEUE_LIMIT', 10))
+
+# Outbound Telegram limits: messages per second overall and per chat
+SEND_GLOBAL_RATE = float(os.getenv('SEND_GLOBAL_RATE', 30))
+SEND_CHAT_RATE = float(os.getenv('SEND_CHAT_RATE', 1))
+SEND_CHAT_BURST = int(os.getenv('SEND_CHAT_BURST', 3))
+
+# Rows per page of the debt list and daily reports, months per page of month pickers
+PAGE_SIZE = int(os.getenv('PAGE_SIZE', 10))
+MONTHS_PAGE_SIZE = int(os.getenv('MONTHS_PAGE_SIZE', 12))
+
+# Worker processes; above 1 this process only receives updates and routes
+# them by user_id to workers that each own a shard of users
+WORKERS = int(os.getenv('WORKERS', 1))
+# Worker i serves its own /metrics on localhost at this port + i; the
+# front process's /metrics collects them, labelled by shard
+WORKER_METRICS_PORT = int(os.getenv('WORKER_METRICS_PORT', 9100))
+WORKER_METRICS_TIMEOUT = 2  # seconds
+
+# Tracing: share of updates traced (0 disables it), appended as JSON lines
+# to TRACE_FILE or POSTed as OTLP/JSON to TRACE_COLLECTOR_URL when set
+TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', 0))
+TRACE_FILE = os.getenv('TRACE_FILE', 'traces.jsonl')
+TRACE_COLLECTOR_URL = os.getenv('TRACE_COLLECTOR_URL')
+
+# Rendered statistics and monthly reports kept per process
+REPORT_CACHE_SIZE = int(os.getenv('REPORT_CACHE_SIZE', 10000))
+REPORT_CACHE_MB = float(os.getenv('REPORT_CACHE_MB', 16))
 
 # Configure logging
 logging.basicConfig(
@@ -45,10 +101,67 @@ logger = logging.getLogger(__name__)
 
 # Initialize bot and dispatcher
 bot = Bot(token=BOT_TOKEN)
-storage = MemoryStorage()
-dp = Dispatcher(storage=storage)
+tracer = tracing.Tracer(TRACE_SAMPLE_RATE)
+bot.session.middleware(tracing.TelegramTracingMiddleware(tracer))
+# Every process sending replies gets an equal share of the global limit
+send_limiter = SendLimiter(SEND_GLOBAL_RATE / max(1, WORKERS), SEND_CHAT_RATE, SEND_CHAT_BURST)
+bot.session.middleware(send_limiter)
+storage = create_storage(FSM_STORAGE, ttl=FSM_TTL, redis_url=REDIS_URL, redis_pool_size=REDIS_POOL_SIZE)
+scheduler = UpdateScheduler(UPDATE_CONCURRENCY, USER_QUEUE_LIMIT)
+dp = Dispatcher(storage=storage, events_isolation=scheduler)
 router = Router()
 dp.include_router(router)
+rates_service = RatesService(ttl=RATES_TTL)
+report_cache = SizedLRUCache(REPORT_CACHE_SIZE, int(REPORT_CACHE_MB * 1024 * 1024))
+http_session: Optional[aiohttp.ClientSession] = None
+shard_router: Optional[ShardRouter] = None
+
+# Metrics: handler latency and errors, DB and FSM storage time, scheduler
+# and send limiter state; served on /metrics
+def menu_handler_name(data: Dict[str, Any]) -> Optional[str]:
+    """Menu buttons are reported under the handler they are dispatched to."""
+    action = data.get("menu_action")
+    return MENU_HANDLERS[action].__name__ if action else None
+
+
+router.message.middleware(metrics.HandlerMetricsMiddleware(menu_handler_name))
+router.callback_query.middleware(metrics.HandlerMetricsMiddleware())
+# On the root logger: errors the database functions catch count for their handler
+logging.getLogger().addHandler(metrics.ErrorLogCounter())
+metrics.instrument(db, metrics.db_seconds)
+metrics.instrument(storage, metrics.fsm_seconds, ["get_state", "set_state", "get_data", "set_data"])
+metrics.registry.register(metrics.Gauge(
+    "smartbalance_scheduler", "Update scheduler state.", ("stat",),
+    lambda: {(name,): value for name, value in scheduler.stats().items()}
+))
+metrics.registry.register(metrics.Gauge(
+    "smartbalance_send_limiter", "Outbound send limiter counters.", ("stat",),
+    lambda: {(name,): value for name, value in send_limiter.stats().items()}
+))
+metrics.registry.register(metrics.Gauge(
+    "smartbalance_user_cache", "User profile cache.", ("stat",),
+    lambda: {(name,): value for name, value in db.get_user_cache_stats().items()}
+))
+metrics.registry.register(metrics.Gauge(
+    "smartbalance_rates_stale", "1 while the exchange rate snapshot is stale.", (),
+    lambda: {(): int(rates_service.is_stale)}
+))
+metrics.registry.register(metrics.Gauge(
+    "smartbalance_report_cache", "Rendered report cache.", ("stat",),
+    lambda: {(name,): value for name, value in report_cache.stats().items()}
+))
+metrics.registry.register(metrics.Gauge(
+    "smartbalance_tracing", "Spans buffered, exported and dropped.", ("stat",),
+    lambda: {(name,): value for name, value in tracer.stats().items()}
+))
+
+# Tracing: a root span per sampled update with handler, DB, FSM, HTTP and
+# Telegram API child spans; started with an exporter in main()
+dp.update.outer_middleware(tracing.UpdateTracingMiddleware(tracer))
+router.message.middleware(tracing.HandlerTracingMiddleware(tracer, menu_handler_name))
+router.callback_query.middleware(tracing.HandlerTracingMiddleware(tracer))
+tracing.instrument(tracer, db, "db")
+tracing.instrument(tracer, storage, "fsm", ["get_state", "set_state", "get_data", "set_data"])
 
 
 # ===================== FSM STATES =====================
@@ -83,10 +196,27 @@ class UserStates(StatesGroup):
     # Converter
     selecting_convert_currency = State()
     entering_convert_amount = State()
+    
+    # Import
+    waiting_import_file = State()
 
 
 # ===================== KEYBOARDS =====================
 
+MAIN_MENU_BUTTONS = (
+    "btn_expenses", "btn_income",
+    "btn_statistics", "btn_monthly_report",
+    "btn_daily_report", "btn_debts",
+    "btn_utilities", "btn_converter"
+)
+# Any localized main-menu label -> its button key
+MENU_INDEX = build_label_index(MAIN_MENU_BUTTONS)
+
+# Keyboards only depend on their arguments, so each one is built (and
+# validated by pydantic) once and the same markup object is reused for every
+# message. Callers must not modify a returned keyboard.
+
+@lru_cache(maxsize=None)
 def get_language_keyboard() -> InlineKeyboardMarkup:
     """Get language selection keyboard."""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -96,6 +226,7 @@ def get_language_keyboard() -> InlineKeyboardMarkup:
     ])
 
 
+@lru_cache(maxsize=None)
 def get_main_menu_keyboard(lang: str) -> ReplyKeyboardMarkup:
     """Get main menu keyboard."""
     return ReplyKeyboardMarkup(
@@ -121,6 +252,7 @@ def get_main_menu_keyboard(lang: str) -> ReplyKeyboardMarkup:
     )
 
 
+@lru_cache(maxsize=None)
 def get_currency_keyboard(prefix: str = "curr") -> InlineKeyboardMarkup:
     """Get currency selection keyboard."""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -135,6 +267,7 @@ def get_currency_keyboard(prefix: str = "curr") -> InlineKeyboardMarkup:
     ])
 
 
+@lru_cache(maxsize=None)
 def get_debts_menu_keyboard(lang: str) -> InlineKeyboardMarkup:
     """Get debts menu keyboard."""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -145,6 +278,7 @@ def get_debts_menu_keyboard(lang: str) -> InlineKeyboardMarkup:
     ])
 
 
+@lru_cache(maxsize=None)
 def get_utilities_menu_keyboard(lang: str) -> InlineKeyboardMarkup:
     """Get utilities menu keyboard."""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -156,6 +290,7 @@ def get_utilities_menu_keyboard(lang: str) -> InlineKeyboardMarkup:
     ])
 
 
+@lru_cache(maxsize=None)
 def get_utility_types_keyboard(lang: str) -> InlineKeyboardMarkup:
     """Get utility types keyboard."""
     buttons = []
@@ -168,6 +303,7 @@ def get_utility_types_keyboard(lang: str) -> InlineKeyboardMarkup:
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@lru_cache(maxsize=None)
 def get_converter_menu_keyboard(lang: str) -> InlineKeyboardMarkup:
     """Get converter menu keyboard."""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -177,17 +313,43 @@ def get_converter_menu_keyboard(lang: str) -> InlineKeyboardMarkup:
     ])
 
 
-def get_months_keyboard(months: list, prefix: str = "month") -> InlineKeyboardMarkup:
-    """Get months selection keyboard."""
+@lru_cache(maxsize=None)
+def get_convert_from_keyboard() -> InlineKeyboardMarkup:
+    """Get source currency keyboard for the converter."""
+    return InlineKeyboardMarkup(inline_keyboard=[
+        [
+            InlineKeyboardButton(text="🇺🇸 USD", callback_data="convfrom_USD"),
+            InlineKeyboardButton(text="🇷🇺 RUB", callback_data="convfrom_RUB")
+        ],
+        [
+            InlineKeyboardButton(text="🇨🇳 CNY", callback_data="convfrom_CNY")
+        ]
+    ])
+
+
+def get_months_keyboard(months: list, prefix: str = "month", page: int = 0) -> InlineKeyboardMarkup:
+    """Get months selection keyboard showing one page of MONTHS_PAGE_SIZE months."""
+    page = max(0, min(page, (len(months) - 1) // MONTHS_PAGE_SIZE))
+    start = page * MONTHS_PAGE_SIZE
+    shown = months[start:start + MONTHS_PAGE_SIZE]
     buttons = []
-    for i in range(0, len(months), 2):
-        row = [InlineKeyboardButton(text=months[i], callback_data=f"{prefix}_{months[i]}")]
-        if i + 1 < len(months):
-            row.append(InlineKeyboardButton(text=months[i + 1], callback_data=f"{prefix}_{months[i + 1]}"))
+    for i in range(0, len(shown), 2):
+        row = [InlineKeyboardButton(text=shown[i], callback_data=f"{prefix}_{shown[i]}")]
+        if i + 1 < len(shown):
+            row.append(InlineKeyboardButton(text=shown[i + 1], callback_data=f"{prefix}_{shown[i + 1]}"))
         buttons.append(row)
+    nav = []
+    if page > 0:
+        nav.append(InlineKeyboardButton(text="⬅️", callback_data=f"mpage_{prefix}_{page - 1}"))
+    if start + MONTHS_PAGE_SIZE < len(months):
+        nav.append(InlineKeyboardButton(text="➡️", callback_data=f"mpage_{prefix}_{page + 1}"))
+    if nav:
+        buttons.append(nav)
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+# The prefix carries the selected month, so keep only the recent ones
+@lru_cache(maxsize=256)
 def get_days_keyboard(prefix: str = "day", lang: str = "en") -> InlineKeyboardMarkup:
     """Get days selection keyboard (1-31)."""
     buttons = []
@@ -202,6 +364,7 @@ def get_days_keyboard(prefix: str = "day", lang: str = "en") -> InlineKeyboardMa
     return InlineKeyboardMarkup(inline_keyboard=buttons)
 
 
+@lru_cache(maxsize=None)
 def get_back_keyboard(lang: str, callback: str = "main_menu") -> InlineKeyboardMarkup:
     """Get back button keyboard."""
     return InlineKeyboardMarkup(inline_keyboard=[
@@ -209,47 +372,134 @@ def get_back_keyboard(lang: str, callback: str = "main_menu") -> InlineKeyboardM
     ])
 
 
+def get_page_nav_row(prefix: str, rows: list, has_prev: bool, has_next: bool) -> list:
+    """Previous/next buttons for a page of rows; their callback data carries the keyset cursor."""
+    row = []
+    if has_prev:
+        row.append(InlineKeyboardButton(text="⬅️", callback_data=f"{prefix}_b_{rows[0]['id']}"))
+    if has_next:
+        row.append(InlineKeyboardButton(text="➡️", callback_data=f"{prefix}_a_{rows[-1]['id']}"))
+    return row
+
+
+def warm_keyboards():
+    """Build the static keyboards of every language up front."""
+    get_language_keyboard()
+    get_convert_from_keyboard()
+    for prefix in ("trans", "debt", "util", "setcurr"):
+        get_currency_keyboard(prefix)
+    for lang in STRINGS:
+        get_main_menu_keyboard(lang)
+        get_debts_menu_keyboard(lang)
+        get_utilities_menu_keyboard(lang)
+        get_utility_types_keyboard(lang)
+        get_converter_menu_keyboard(lang)
+        for callback in ("main_menu", "debts_menu", "utilities_menu"):
+            get_back_keyboard(lang, callback)
+
+
 # ===================== UTILITY FUNCTIONS =====================
 
-async def get_exchange_rates():
-    """Fetch exchange rates from CBU API."""
-    global EXCHANGE_RATES
-    try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get("https://cbu.uz/ru/arkhiv-kursov-valyut/json/") as response:
-                if response.status == 200:
-                    data = await response.json()
-                    for item in data:
-                        if item["Ccy"] == "USD":
-                            EXCHANGE_RATES["USD"] = float(item["Rate"])
-                        elif item["Ccy"] == "RUB":
-                            EXCHANGE_RATES["RUB"] = float(item["Rate"])
-                        elif item["Ccy"] == "CNY":
-                            EXCHANGE_RATES["CNY"] = float(item["Rate"])
-                    logger.info(f"Exchange rates updated: {EXCHANGE_RATES}")
-    except Exception as e:
-        logger.error(f"Error fetching exchange rates: {e}")
+def create_http_session() -> aiohttp.ClientSession:
+    """Create the application-wide session used for all outbound HTTP calls."""
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT
+    )
+    timeout = aiohttp.ClientTimeout(total=HTTP_TOTAL_TIMEOUT, connect=HTTP_CONNECT_TIMEOUT)
+    return aiohttp.ClientSession(
+        connector=connector,
+        timeout=timeout,
+        trace_configs=[metrics.http_trace_config(), tracing.http_trace_config(tracer)]
+    )
+
 
+def create_span_exporter(session: aiohttp.ClientSession):
+    """The exporter for sampled spans, None when tracing is disabled."""
+    if TRACE_SAMPLE_RATE <= 0:
+        return None
+    if TRACE_COLLECTOR_URL:
+        return tracing.CollectorExporter(TRACE_COLLECTOR_URL, session)
+    return tracing.JsonLinesExporter(TRACE_FILE)
 
-def convert_to_main_currency(amount: float, from_currency: str, to_currency: str) -> float:
-    """Convert amount from one currency to another."""
+
+def convert_to_main_currency(amount: float, from_currency: str, to_currency: str,
+                             day: Optional[str] = None) -> float:
+    """Convert amount from one currency to another, at the rates of `day` if given."""
     try:
         # First convert to UZS
-        amount_in_uzs = amount * EXCHANGE_RATES.get(from_currency, 1)
+        amount_in_uzs = amount * rates_service.rate(from_currency, day)
         # Then convert to target currency
         if to_currency == "UZS":
             return amount_in_uzs
-        return amount_in_uzs / EXCHANGE_RATES.get(to_currency, 1)
+        return amount_in_uzs / rates_service.rate(to_currency, day)
     except Exception as e:
         logger.error(f"Error converting currency: {e}")
         return amount
 
 
+def sum_totals(totals: list, main_currency: str) -> tuple:
+    """Convert daily (type, currency) totals and return (income, expenses).
+
+    Each day's sum is converted at the rate in effect on that day, as if
+    every transaction were converted on its own date.
+    """
+    total_income = 0
+    total_expenses = 0
+    for row in totals:
+        converted = convert_to_main_currency(
+            row["total"], row["currency"], main_currency, row["day"]
+        )
+        if row["type"] == "income":
+            total_income += converted
+        else:
+            total_expenses += converted
+    return total_income, total_expenses
+
+
+def parse_page_cursor(data: str) -> tuple:
+    """Split callback data into (rest, after_id, before_id).
+
+    A trailing `_a_<id>` asks for the page after that row, `_b_<id>` for the
+    page before it; without either the first page is meant.
+    """
+    parts = data.rsplit("_", 2)
+    if len(parts) == 3 and parts[1] in ("a", "b") and parts[2].isdigit():
+        row_id = int(parts[2])
+        return (parts[0], row_id, None) if parts[1] == "a" else (parts[0], None, row_id)
+    return data, None, None
+
+
+async def load_page(fetch, after_id: Optional[int], before_id: Optional[int]) -> tuple:
+    """Fetch one page with `fetch(after_id=, before_id=, limit=)`; returns (rows, has_prev, has_next).
+
+    One row more than a page is requested to learn whether the listing goes
+    on in the direction we are moving.
+    """
+    rows = await fetch(after_id=after_id, before_id=before_id, limit=PAGE_SIZE + 1)
+    more = len(rows) > PAGE_SIZE
+    if before_id is not None:
+        return (rows[1:] if more else rows), more, True
+    return rows[:PAGE_SIZE], after_id is not None, more
+
+
 def format_number(num: float) -> str:
     """Format number with thousand separators."""
     return f"{num:,.2f}".replace(",", " ")
 
 
+def render_totals(lang: str, title: str, total_income: float, total_expenses: float, currency: str) -> str:
+    """Report text with income, expenses and net profit lines under `title`."""
+    return "".join([
+        title,
+        format_text(lang, "total_income", amount=format_number(total_income), currency=currency), "\n",
+        format_text(lang, "total_expenses", amount=format_number(total_expenses), currency=currency), "\n",
+        format_text(lang, "net_profit", amount=format_number(total_income - total_expenses), currency=currency)
+    ])
+
+
 async def get_lang(state: FSMContext, user_id: int) -> str:
     """Get user's language from state or database."""
     data = await state.get_data()
@@ -260,8 +510,85 @@ async def get_lang(state: FSMContext, user_id: int) -> str:
     return lang
 
 
+async def cached_report(user_id: int, kind: str, month: Optional[str], lang: str, render) -> Optional[str]:
+    """Report text from report_cache, produced by `render(user_id, lang, main_currency, month)` on a miss.
+
+    The key holds everything the text depends on: the user's data version
+    and the rates version are read first, so a write or rate update that
+    lands while rendering leaves the new text under an outdated key. None
+    (no data) is not cached.
+    """
+    data_version = await db.get_data_version(user_id)
+    rates_version = rates_service.version
+    main_currency = await db.get_user_main_currency(user_id)
+    key = (user_id, kind, month, main_currency, lang, rates_version, data_version)
+    text = report_cache.get(key)
+    if text is None:
+        text = await render(user_id, lang, main_currency, month)
+        if text is not None:
+            report_cache.set(key, text)
+    return text
+
+
+async def render_transaction_report(user_id: int, lang: str, main_currency: str,
+                                    month: Optional[str]) -> Optional[str]:
+    """Income/expense totals of one month, or of all time without `month`."""
+    totals = await db.get_transaction_totals(user_id, month)
+    if not totals:
+        return None
+    total_income, total_expenses = sum_totals(totals, main_currency)
+    if month is None:
+        title = get_text(lang, "statistics_title")
+    else:
+        title = format_text(lang, "monthly_report_title", month=month)
+    return render_totals(lang, title, total_income, total_expenses, main_currency)
+
+
+async def render_utility_month(user_id: int, lang: str, main_currency: str, month: str) -> Optional[str]:
+    """Utility payments of one month."""
+    utilities = await db.get_utilities_by_month(user_id, month)
+    if not utilities:
+        return None
+    parts = [format_text(lang, "monthly_report_title", month=month)]
+    for util in utilities:
+        parts.append(f"{get_utility_name(lang, util['utility_type'])}: {format_number(util['amount'])} {util['currency']}\n")
+    return "".join(parts)
+
+
+async def render_utility_stats(user_id: int, lang: str, main_currency: str, month: Optional[str] = None) -> Optional[str]:
+    """All-time utility totals per type in the main currency."""
+    totals = await db.get_utility_totals(user_id)
+    if not totals:
+        return None
+    
+    # Group by utility type
+    stats: Dict[str, float] = {}
+    for row in totals:
+        converted = convert_to_main_currency(
+            row["total"],
+            row["currency"],
+            main_currency,
+            row["day"]
+        )
+        util_type = row["utility_type"]
+        stats[util_type] = stats.get(util_type, 0) + converted
+    
+    parts = [get_text(lang, "utility_stats_title")]
+    for util_type, amount in stats.items():
+        parts.append(f"{get_utility_name(lang, util_type)}: {format_number(amount)} {main_currency}\n")
+    parts.append(f"\n💰 Total: {format_number(sum(stats.values()))} {main_currency}")
+    return "".join(parts)
+
+
 # ===================== HANDLERS =====================
 
+@dp.errors(ExceptionTypeFilter(UpdateDropped))
+async def on_update_dropped(event: ErrorEvent):
+    """Skip updates rejected by the scheduler because the user's queue is full."""
+    logger.warning(f"Update {event.update.update_id} dropped: {event.exception}")
+    return True
+
+
 @router.message(Command("start"))
 async def cmd_start(message: Message, state: FSMContext):
     """Handle /start command."""
@@ -313,19 +640,82 @@ async def process_main_menu(callback: CallbackQuery, state: FSMContext):
         logger.error(f"Error in main menu: {e}")
 
 
+@router.message(F.text.func(MENU_INDEX.get).as_("menu_action"))
+async def process_menu_button(message: Message, state: FSMContext, menu_action: str):
+    """Route a main menu button to its handler with one index lookup.
+
+    Registered ahead of the state input handlers, so a menu button always
+    opens its section, even in the middle of entering a value.
+    """
+    await MENU_HANDLERS[menu_action](message, state)
+
+
+# ===================== EXPORT/IMPORT HANDLERS =====================
+
+@router.message(Command("export"))
+async def cmd_export(message: Message, state: FSMContext):
+    """Send all records of the user as a CSV document."""
+    try:
+        lang = await get_lang(state, message.from_user.id)
+        await message.answer_document(
+            CsvExportFile(message.from_user.id),
+            caption=get_text(lang, "export_caption")
+        )
+    except Exception as e:
+        logger.error(f"Error in export: {e}")
+        lang = await get_lang(state, message.from_user.id)
+        await message.answer(get_text(lang, "error_message"))
+
+
+@router.message(Command("import"))
+async def cmd_import(message: Message, state: FSMContext):
+    """Ask for a CSV file to import."""
+    try:
+        lang = await get_lang(state, message.from_user.id)
+        await state.set_state(UserStates.waiting_import_file)
+        await message.answer(
+            get_text(lang, "import_prompt"),
+            reply_markup=get_back_keyboard(lang, "main_menu")
+        )
+    except Exception as e:
+        logger.error(f"Error in import: {e}")
+        lang = await get_lang(state, message.from_user.id)
+        await message.answer(get_text(lang, "error_message"))
+
+
+@router.message(UserStates.waiting_import_file, F.document)
+async def process_import_file(message: Message, state: FSMContext):
+    """Stream the uploaded CSV into the database."""
+    try:
+        lang = await get_lang(state, message.from_user.id)
+        await state.clear()
+        await state.update_data(language=lang)
+        try:
+            imported, skipped = await import_csv(
+                message.from_user.id, stream_document(bot, message.document.file_id)
+            )
+        except ImportFailed as e:
+            logger.error(f"Error importing records: {e.__cause__}")
+            await message.answer(format_text(lang, "import_failed", imported=e.imported))
+            return
+        await message.answer(
+            format_text(lang, "import_done", imported=imported, skipped=skipped),
+            reply_markup=get_main_menu_keyboard(lang)
+        )
+    except Exception as e:
+        logger.error(f"Error in import file: {e}")
+        lang = await get_lang(state, message.from_user.id)
+        await message.answer(get_text(lang, "error_message"))
+
+
 # ===================== EXPENSES/INCOME HANDLERS =====================
 
-@router.message(F.text.in_([
-    "💸 Xarajatlar", "💸 Расходы", "💸 Expenses",
-    "💰 Daromad", "💰 Доходы", "💰 Income"
-]))
 async def process_transaction_button(message: Message, state: FSMContext):
     """Handle expense/income buttons."""
     try:
         lang = await get_lang(state, message.from_user.id)
-        text = message.text
         
-        if "💸" in text:  # Expenses
+        if MENU_INDEX[message.text] == "btn_expenses":
             await state.set_state(UserStates.entering_expense)
             await state.update_data(transaction_type="expense")
         else:  # Income
@@ -398,7 +788,8 @@ async def process_transaction_currency(callback: CallbackQuery, state: FSMContex
             msg_key = "income_saved"
         
         await callback.message.edit_text(
-            get_text(lang, msg_key).format(
+            format_text(
+                lang, msg_key,
                 goal=goal,
                 amount=format_number(amount),
                 currency=currency,
@@ -415,52 +806,18 @@ async def process_transaction_currency(callback: CallbackQuery, state: FSMContex
 
 # ===================== STATISTICS HANDLERS =====================
 
-@router.message(F.text.in_(["📊 Statistika", "📊 Статистика", "📊 Statistics"]))
 async def process_statistics(message: Message, state: FSMContext):
     """Handle statistics button."""
     try:
         lang = await get_lang(state, message.from_user.id)
         user_id = message.from_user.id
         
-        transactions = await db.get_all_transactions(user_id)
-        main_currency = await db.get_user_main_currency(user_id)
+        text = await cached_report(user_id, "statistics", None, lang, render_transaction_report)
         
-        if not transactions:
+        if text is None:
             await message.answer(get_text(lang, "no_data"))
             return
         
-        await get_exchange_rates()
-        
-        total_income = 0
-        total_expenses = 0
-        
-        for trans in transactions:
-            converted = convert_to_main_currency(
-                trans["amount"],
-                trans["currency"],
-                main_currency
-            )
-            if trans["type"] == "income":
-                total_income += converted
-            else:
-                total_expenses += converted
-        
-        net_profit = total_income - total_expenses
-        
-        text = get_text(lang, "statistics_title")
-        text += get_text(lang, "total_income").format(
-            amount=format_number(total_income),
-            currency=main_currency
-        ) + "\n"
-        text += get_text(lang, "total_expenses").format(
-            amount=format_number(total_expenses),
-            currency=main_currency
-        ) + "\n"
-        text += get_text(lang, "net_profit").format(
-            amount=format_number(net_profit),
-            currency=main_currency
-        )
-        
         await message.answer(text)
     except Exception as e:
         logger.error(f"Error in statistics: {e}")
@@ -470,7 +827,6 @@ async def process_statistics(message: Message, state: FSMContext):
 
 # ===================== MONTHLY REPORT HANDLERS =====================
 
-@router.message(F.text.in_(["📅 Oylik hisobot", "📅 Месячный отчет", "📅 Monthly Report"]))
 async def process_monthly_report(message: Message, state: FSMContext):
     """Handle monthly report button."""
     try:
@@ -501,45 +857,12 @@ async def process_monthly_selection(callback: CallbackQuery, state: FSMContext):
         lang = await get_lang(state, callback.from_user.id)
         month = callback.data.replace("monthly_", "")
         
-        transactions = await db.get_transactions_by_month(callback.from_user.id, month)
-        main_currency = await db.get_user_main_currency(callback.from_user.id)
+        text = await cached_report(callback.from_user.id, "monthly", month, lang, render_transaction_report)
         
-        if not transactions:
+        if text is None:
             await callback.message.edit_text(get_text(lang, "no_data"))
             return
         
-        await get_exchange_rates()
-        
-        total_income = 0
-        total_expenses = 0
-        
-        for trans in transactions:
-            converted = convert_to_main_currency(
-                trans["amount"],
-                trans["currency"],
-                main_currency
-            )
-            if trans["type"] == "income":
-                total_income += converted
-            else:
-                total_expenses += converted
-        
-        net_profit = total_income - total_expenses
-        
-        text = get_text(lang, "monthly_report_title").format(month=month)
-        text += get_text(lang, "total_income").format(
-            amount=format_number(total_income),
-            currency=main_currency
-        ) + "\n"
-        text += get_text(lang, "total_expenses").format(
-            amount=format_number(total_expenses),
-            currency=main_currency
-        ) + "\n"
-        text += get_text(lang, "net_profit").format(
-            amount=format_number(net_profit),
-            currency=main_currency
-        )
-        
         await callback.message.edit_text(text)
     except Exception as e:
         logger.error(f"Error in monthly selection: {e}")
@@ -547,9 +870,29 @@ async def process_monthly_selection(callback: CallbackQuery, state: FSMContext):
         await callback.message.answer(get_text(lang, "error_message"))
 
 
+# Record kind listed by each month picker, by its callback prefix
+MONTH_PICKER_KINDS = {
+    "monthly": "transaction",
+    "dailym": "transaction",
+    "utilmonth": "utility",
+    "utildailym": "utility",
+}
+
+
+@router.callback_query(F.data.startswith("mpage_"))
+async def process_months_page(callback: CallbackQuery, state: FSMContext):
+    """Show another page of a month picker."""
+    try:
+        await callback.answer()
+        _, prefix, page = callback.data.split("_")
+        months = await db.get_months(callback.from_user.id, MONTH_PICKER_KINDS[prefix])
+        await callback.message.edit_reply_markup(reply_markup=get_months_keyboard(months, prefix, int(page)))
+    except Exception as e:
+        logger.error(f"Error in months page: {e}")
+
+
 # ===================== DAILY REPORT HANDLERS =====================
 
-@router.message(F.text.in_(["🔍 Kunlik hisobot", "🔍 Дневной отчет", "🔍 Daily Report"]))
 async def process_daily_report(message: Message, state: FSMContext):
     """Handle daily report button."""
     try:
@@ -602,12 +945,15 @@ async def process_daily_day_selection(callback: CallbackQuery, state: FSMContext
         await callback.answer()
         lang = await get_lang(state, callback.from_user.id)
         
-        # Parse: dailyd_2024-03_15
-        parts = callback.data.replace("dailyd_", "").rsplit("_", 1)
-        month = parts[0]
-        day = int(parts[1])
+        # Parse: dailyd_2024-03_15, optionally followed by a page cursor (_a_<id> / _b_<id>)
+        selection, after_id, before_id = parse_page_cursor(callback.data.replace("dailyd_", ""))
+        month, day = selection.rsplit("_", 1)
+        day = int(day)
         
-        transactions = await db.get_transactions_by_date(callback.from_user.id, month, day)
+        transactions, has_prev, has_next = await load_page(
+            partial(db.get_transactions_page_by_date, callback.from_user.id, month, day),
+            after_id, before_id
+        )
         
         if not transactions:
             await callback.message.edit_text(
@@ -617,15 +963,19 @@ async def process_daily_day_selection(callback: CallbackQuery, state: FSMContext
             return
         
         date_str = f"{month}-{day:02d}"
-        text = get_text(lang, "daily_report_title").format(date=date_str)
-        
+        parts = [format_text(lang, "daily_report_title", date=date_str)]
         for trans in transactions:
             emoji = "💰" if trans["type"] == "income" else "💸"
-            text += f"{emoji} {trans['goal']}: {format_number(trans['amount'])} {trans['currency']}\n"
+            parts.append(f"{emoji} {trans['goal']}: {format_number(trans['amount'])} {trans['currency']}\n")
+        text = "".join(parts)
+        
+        nav = get_page_nav_row(f"dailyd_{month}_{day}", transactions, has_prev, has_next)
+        buttons = [nav] if nav else []
+        buttons.append([InlineKeyboardButton(text=get_text(lang, "btn_back"), callback_data="main_menu")])
         
         await callback.message.edit_text(
             text,
-            reply_markup=get_back_keyboard(lang, "main_menu")
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
         )
     except Exception as e:
         logger.error(f"Error in daily day selection: {e}")
@@ -635,7 +985,6 @@ async def process_daily_day_selection(callback: CallbackQuery, state: FSMContext
 
 # ===================== DEBTS HANDLERS =====================
 
-@router.message(F.text.in_(["🤝 Oldi-berdi", "🤝 Долги", "🤝 Debts"]))
 async def process_debts_menu(message: Message, state: FSMContext):
     """Handle debts menu button."""
     try:
@@ -727,7 +1076,8 @@ async def process_debt_currency(callback: CallbackQuery, state: FSMContext):
         )
         
         await callback.message.edit_text(
-            get_text(lang, "debt_saved").format(
+            format_text(
+                lang, "debt_saved",
                 name=name,
                 amount=format_number(amount),
                 currency=currency,
@@ -743,13 +1093,17 @@ async def process_debt_currency(callback: CallbackQuery, state: FSMContext):
 
 
 @router.callback_query(F.data == "debt_list")
+@router.callback_query(F.data.startswith("debtpage_"))
 async def process_debt_list(callback: CallbackQuery, state: FSMContext):
-    """Handle debt list button."""
+    """Handle debt list button and its page buttons."""
     try:
         await callback.answer()
         lang = await get_lang(state, callback.from_user.id)
         
-        debts = await db.get_all_debts(callback.from_user.id)
+        _, after_id, before_id = parse_page_cursor(callback.data)
+        debts, has_prev, has_next = await load_page(
+            partial(db.get_debts_page, callback.from_user.id), after_id, before_id
+        )
         
         if not debts:
             await callback.message.edit_text(
@@ -758,7 +1112,7 @@ async def process_debt_list(callback: CallbackQuery, state: FSMContext):
             )
             return
         
-        text = get_text(lang, "debt_list_title")
+        parts = [get_text(lang, "debt_list_title")]
         
         owed_to_me = [d for d in debts if d["type"] == "owed_to_me"]
         i_owe = [d for d in debts if d["type"] == "i_owe"]
@@ -766,30 +1120,33 @@ async def process_debt_list(callback: CallbackQuery, state: FSMContext):
         buttons = []
         
         if owed_to_me:
-            text += f"\n{get_text(lang, 'owed_to_me')}\n"
+            parts.append(f"\n{get_text(lang, 'owed_to_me')}\n")
             for debt in owed_to_me:
-                text += f"👤 {debt['name']}: {format_number(debt['amount'])} {debt['currency']}\n"
+                parts.append(f"👤 {debt['name']}: {format_number(debt['amount'])} {debt['currency']}\n")
                 buttons.append([InlineKeyboardButton(
                     text=f"✅ {debt['name']}",
                     callback_data=f"pay_{debt['id']}"
                 )])
         
         if i_owe:
-            text += f"\n{get_text(lang, 'i_owe')}\n"
+            parts.append(f"\n{get_text(lang, 'i_owe')}\n")
             for debt in i_owe:
-                text += f"👤 {debt['name']}: {format_number(debt['amount'])} {debt['currency']}\n"
+                parts.append(f"👤 {debt['name']}: {format_number(debt['amount'])} {debt['currency']}\n")
                 buttons.append([InlineKeyboardButton(
                     text=f"✅ {debt['name']}",
                     callback_data=f"pay_{debt['id']}"
                 )])
         
+        nav = get_page_nav_row("debtpage", debts, has_prev, has_next)
+        if nav:
+            buttons.append(nav)
         buttons.append([InlineKeyboardButton(
             text=get_text(lang, "btn_back"),
             callback_data="debts_menu"
         )])
         
         await callback.message.edit_text(
-            text,
+            "".join(parts),
             reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
         )
     except Exception as e:
@@ -855,12 +1212,13 @@ async def process_payment_amount(message: Message, state: FSMContext):
         if remaining <= 0:
             await db.delete_debt(debt_id)
             await message.answer(
-                get_text(lang, "debt_cleared").format(name=debt["name"])
+                format_text(lang, "debt_cleared", name=debt["name"])
             )
         else:
             await db.update_debt_amount(debt_id, remaining)
             await message.answer(
-                get_text(lang, "debt_updated").format(
+                format_text(
+                    lang, "debt_updated",
                     name=debt["name"],
                     old_amount=format_number(old_amount),
                     currency=debt["currency"],
@@ -879,7 +1237,6 @@ async def process_payment_amount(message: Message, state: FSMContext):
 
 # ===================== UTILITIES HANDLERS =====================
 
-@router.message(F.text.in_(["🏠 Kommunal", "🏠 Коммунальные", "🏠 Utilities"]))
 async def process_utilities_menu(message: Message, state: FSMContext):
     """Handle utilities menu button."""
     try:
@@ -984,7 +1341,8 @@ async def process_utility_currency(callback: CallbackQuery, state: FSMContext):
         )
         
         await callback.message.edit_text(
-            get_text(lang, "utility_saved").format(
+            format_text(
+                lang, "utility_saved",
                 type=get_utility_name(lang, utility_type),
                 amount=format_number(amount),
                 currency=currency,
@@ -1031,20 +1389,15 @@ async def process_utility_month_selection(callback: CallbackQuery, state: FSMCon
         lang = await get_lang(state, callback.from_user.id)
         month = callback.data.replace("utilmonth_", "")
         
-        utilities = await db.get_utilities_by_month(callback.from_user.id, month)
+        text = await cached_report(callback.from_user.id, "utility_month", month, lang, render_utility_month)
         
-        if not utilities:
+        if text is None:
             await callback.message.edit_text(
                 get_text(lang, "no_data"),
                 reply_markup=get_back_keyboard(lang, "utilities_menu")
             )
             return
         
-        text = get_text(lang, "monthly_report_title").format(month=month)
-        
-        for util in utilities:
-            text += f"{get_utility_name(lang, util['utility_type'])}: {format_number(util['amount'])} {util['currency']}\n"
-        
         await callback.message.edit_text(
             text,
             reply_markup=get_back_keyboard(lang, "utilities_menu")
@@ -1101,12 +1454,15 @@ async def process_utility_daily_day(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         lang = await get_lang(state, callback.from_user.id)
         
-        # Parse: utildailyd_2024-03_15
-        parts = callback.data.replace("utildailyd_", "").rsplit("_", 1)
-        month = parts[0]
-        day = int(parts[1])
+        # Parse: utildailyd_2024-03_15, optionally followed by a page cursor (_a_<id> / _b_<id>)
+        selection, after_id, before_id = parse_page_cursor(callback.data.replace("utildailyd_", ""))
+        month, day = selection.rsplit("_", 1)
+        day = int(day)
         
-        utilities = await db.get_utilities_by_date(callback.from_user.id, month, day)
+        utilities, has_prev, has_next = await load_page(
+            partial(db.get_utilities_page_by_date, callback.from_user.id, month, day),
+            after_id, before_id
+        )
         
         if not utilities:
             await callback.message.edit_text(
@@ -1116,14 +1472,18 @@ async def process_utility_daily_day(callback: CallbackQuery, state: FSMContext):
             return
         
         date_str = f"{month}-{day:02d}"
-        text = get_text(lang, "daily_report_title").format(date=date_str)
-        
+        parts = [format_text(lang, "daily_report_title", date=date_str)]
         for util in utilities:
-            text += f"{get_utility_name(lang, util['utility_type'])}: {format_number(util['amount'])} {util['currency']}\n"
+            parts.append(f"{get_utility_name(lang, util['utility_type'])}: {format_number(util['amount'])} {util['currency']}\n")
+        text = "".join(parts)
+        
+        nav = get_page_nav_row(f"utildailyd_{month}_{day}", utilities, has_prev, has_next)
+        buttons = [nav] if nav else []
+        buttons.append([InlineKeyboardButton(text=get_text(lang, "btn_back"), callback_data="utilities_menu")])
         
         await callback.message.edit_text(
             text,
-            reply_markup=get_back_keyboard(lang, "utilities_menu")
+            reply_markup=InlineKeyboardMarkup(inline_keyboard=buttons)
         )
     except Exception as e:
         logger.error(f"Error in utility daily day: {e}")
@@ -1138,38 +1498,15 @@ async def process_utility_stats(callback: CallbackQuery, state: FSMContext):
         await callback.answer()
         lang = await get_lang(state, callback.from_user.id)
         
-        utilities = await db.get_all_utilities(callback.from_user.id)
-        main_currency = await db.get_user_main_currency(callback.from_user.id)
+        text = await cached_report(callback.from_user.id, "utility_stats", None, lang, render_utility_stats)
         
-        if not utilities:
+        if text is None:
             await callback.message.edit_text(
                 get_text(lang, "no_data"),
                 reply_markup=get_back_keyboard(lang, "utilities_menu")
             )
             return
         
-        await get_exchange_rates()
-        
-        # Group by utility type
-        stats: Dict[str, float] = {}
-        for util in utilities:
-            converted = convert_to_main_currency(
-                util["amount"],
-                util["currency"],
-                main_currency
-            )
-            util_type = util["utility_type"]
-            stats[util_type] = stats.get(util_type, 0) + converted
-        
-        text = get_text(lang, "utility_stats_title")
-        total = 0
-        
-        for util_type, amount in stats.items():
-            text += f"{get_utility_name(lang, util_type)}: {format_number(amount)} {main_currency}\n"
-            total += amount
-        
-        text += f"\n💰 Total: {format_number(total)} {main_currency}"
-        
         await callback.message.edit_text(
             text,
             reply_markup=get_back_keyboard(lang, "utilities_menu")
@@ -1180,7 +1517,6 @@ async def process_utility_stats(callback: CallbackQuery, state: FSMContext):
 
 # ===================== CONVERTER HANDLERS =====================
 
-@router.message(F.text.in_(["📈 Konverter/Valyuta", "📈 Конвертер/Валюта", "📈 Converter/Currency"]))
 async def process_converter_menu(message: Message, state: FSMContext):
     """Handle converter menu button."""
     try:
@@ -1203,19 +1539,9 @@ async def process_convert_start(callback: CallbackQuery, state: FSMContext):
         lang = await get_lang(state, callback.from_user.id)
         await state.set_state(UserStates.selecting_convert_currency)
         
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="🇺🇸 USD", callback_data="convfrom_USD"),
-                InlineKeyboardButton(text="🇷🇺 RUB", callback_data="convfrom_RUB")
-            ],
-            [
-                InlineKeyboardButton(text="🇨🇳 CNY", callback_data="convfrom_CNY")
-            ]
-        ])
-        
         await callback.message.edit_text(
             get_text(lang, "select_from_currency"),
-            reply_markup=keyboard
+            reply_markup=get_convert_from_keyboard()
         )
     except Exception as e:
         logger.error(f"Error in convert start: {e}")
@@ -1250,15 +1576,14 @@ async def process_convert_amount(message: Message, state: FSMContext):
             await message.answer(get_text(lang, "invalid_format"))
             return
         
-        await get_exchange_rates()
-        
         data = await state.get_data()
         from_currency = data.get("convert_from")
         
-        result = amount * EXCHANGE_RATES.get(from_currency, 1)
+        result = amount * rates_service.rates.get(from_currency, 1)
         
         await message.answer(
-            get_text(lang, "convert_result").format(
+            format_text(
+                lang, "convert_result",
                 amount=format_number(amount),
                 from_curr=from_currency,
                 result=format_number(result)
@@ -1279,20 +1604,9 @@ async def process_main_currency_menu(callback: CallbackQuery, state: FSMContext)
         await callback.answer()
         lang = await get_lang(state, callback.from_user.id)
         
-        keyboard = InlineKeyboardMarkup(inline_keyboard=[
-            [
-                InlineKeyboardButton(text="🇺🇿 UZS", callback_data="setcurr_UZS"),
-                InlineKeyboardButton(text="🇺🇸 USD", callback_data="setcurr_USD")
-            ],
-            [
-                InlineKeyboardButton(text="🇷🇺 RUB", callback_data="setcurr_RUB"),
-                InlineKeyboardButton(text="🇨🇳 CNY", callback_data="setcurr_CNY")
-            ]
-        ])
-        
         await callback.message.edit_text(
             get_text(lang, "select_main_currency"),
-            reply_markup=keyboard
+            reply_markup=get_currency_keyboard("setcurr")
         )
     except Exception as e:
         logger.error(f"Error in main currency menu: {e}")
@@ -1309,20 +1623,87 @@ async def process_set_main_currency(callback: CallbackQuery, state: FSMContext):
         await db.update_main_currency(callback.from_user.id, currency)
         
         await callback.message.edit_text(
-            get_text(lang, "main_currency_set").format(currency=currency)
+            format_text(lang, "main_currency_set", currency=currency)
         )
     except Exception as e:
         logger.error(f"Error in set main currency: {e}")
 
 
+MENU_HANDLERS = {
+    "btn_expenses": process_transaction_button,
+    "btn_income": process_transaction_button,
+    "btn_statistics": process_statistics,
+    "btn_monthly_report": process_monthly_report,
+    "btn_daily_report": process_daily_report,
+    "btn_debts": process_debts_menu,
+    "btn_utilities": process_utilities_menu,
+    "btn_converter": process_converter_menu,
+}
+
+
 # ===================== MAIN =====================
 
 async def handle(request):
     return web.Response(text="Bot is running!")
 
-async def start_server():
+async def scrape_worker_metrics() -> Dict[str, str]:
+    """The /metrics output of every shard worker that answers, by shard index."""
+    timeout = aiohttp.ClientTimeout(total=WORKER_METRICS_TIMEOUT)
+
+    async def scrape(index: int) -> Optional[str]:
+        url = f"http://127.0.0.1:{WORKER_METRICS_PORT + index}/metrics"
+        try:
+            async with http_session.get(url, timeout=timeout) as response:
+                return await response.text()
+        except Exception as e:
+            logger.error(f"Error scraping metrics of shard {index}: {e}")
+            return None
+
+    texts = await asyncio.gather(*(scrape(index) for index in range(WORKERS)))
+    return {str(index): text for index, text in enumerate(texts) if text is not None}
+
+async def handle_metrics(request):
+    text = metrics.registry.render()
+    if shard_router is not None:
+        text = metrics.merge_expositions({"front": text, **await scrape_worker_metrics()}, "shard")
+    return web.Response(
+        body=text.encode(),
+        headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+    )
+
+async def handle_sharded_update(request):
+    """Webhook endpoint of the front process: hand the raw update to its shard."""
+    if request.headers.get("X-Telegram-Bot-Api-Secret-Token") != WEBHOOK_SECRET:
+        return web.Response(status=401)
+    shard_router.route(await request.json())
+    return web.Response()
+
+
+def check_webhook_config():
+    """Refuse to serve a webhook that anyone could post updates to."""
+    if not WEBHOOK_URL:
+        raise RuntimeError("WEBHOOK_URL must be set when BOT_MODE=webhook")
+    if not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET must be set when BOT_MODE=webhook")
+
+
+async def start_server() -> web.AppRunner:
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        raise RuntimeError("WEBHOOK_SECRET must be set when BOT_MODE=webhook")
     app = web.Application()
     app.router.add_get("/", handle)
+    app.router.add_get("/metrics", handle_metrics)
+    if BOT_MODE == "webhook" and shard_router is not None:
+        app.router.add_post(WEBHOOK_PATH, handle_sharded_update)
+    elif BOT_MODE == "webhook":
+        # Answers 200 at once and feeds the update to the dispatcher in a background task;
+        # requests without the right X-Telegram-Bot-Api-Secret-Token get 401
+        SimpleRequestHandler(
+            dispatcher=dp,
+            bot=bot,
+            secret_token=WEBHOOK_SECRET,
+            handle_in_background=True
+        ).register(app, path=WEBHOOK_PATH)
     runner = web.AppRunner(app)
     await runner.setup()
     # Render томонидан бериладиган портни оламиз
@@ -1330,23 +1711,151 @@ async def start_server():
     site = web.TCPSite(runner, "0.0.0.0", port)
     await site.start()
     logger.info(f"Web server started on port {port}")
+    return runner
+
+
+async def start_metrics_server(port: int) -> web.AppRunner:
+    """Serve /metrics on localhost only, for a shard worker."""
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", port).start()
+    return runner
+
+
+async def set_webhook():
+    await bot.set_webhook(
+        WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+        secret_token=WEBHOOK_SECRET,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logger.info("Webhook registered")
+
+
+async def run_webhook():
+    """Register the webhook and serve updates until cancelled."""
+    runner = await start_server()
+    await dp.emit_startup(bot=bot)
+    try:
+        await set_webhook()
+        await asyncio.Event().wait()
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await runner.cleanup()
+        await bot.session.close()
+
+
+async def feed_update(update: Dict[str, Any]):
+    try:
+        await dp.feed_raw_update(bot, update)
+    except Exception:
+        pass  # already logged by the dispatcher
+
+
+async def run_worker_loop(index: int, queue):
+    """Process the updates of one shard with this process's own pool and caches."""
+    global http_session
+    await db.init_db(settings=db.DatabaseSettings.from_env())
+    await rates_service.load_history()
+    warm_keyboards()
+    http_session = create_http_session()
+    rates_service.start(http_session)
+    tracer.start(create_span_exporter(http_session))
+    metrics_runner = await start_metrics_server(WORKER_METRICS_PORT + index)
+    await dp.emit_startup(bot=bot)
+    tasks = set()
+    try:
+        async for update in iter_queue(queue):
+            task = asyncio.create_task(feed_update(update))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        # Stop requested: let updates already started finish
+        if tasks:
+            await asyncio.gather(*tasks)
+    finally:
+        await dp.emit_shutdown(bot=bot)
+        await metrics_runner.cleanup()
+        await bot.session.close()
+        await rates_service.stop()
+        await tracer.stop()
+        await http_session.close()
+        await db.close_db()
+        logger.info(f"Shard worker {index} stopped")
+
+
+def run_worker(index: int, queue):
+    """Entry point of a shard worker process."""
+    logger.info(f"Shard worker {index} starting")
+    asyncio.run(run_worker_loop(index, queue))
+
+
+async def run_sharded():
+    """Receive updates here and route them to WORKERS shard processes."""
+    global shard_router, http_session
+    # Apply migrations once, before the workers open their own pools
+    await db.init_db(settings=db.DatabaseSettings.from_env())
+    await db.close_db()
+
+    # Used here only to scrape the workers' metrics
+    http_session = create_http_session()
+    shard_router = ShardRouter(WORKERS, run_worker)
+    shard_router.start()
+    watchdog = asyncio.create_task(shard_router.watch())
+    runner = await start_server()
+    try:
+        if BOT_MODE == "webhook":
+            await set_webhook()
+            await asyncio.Event().wait()
+        else:
+            await poll_updates(bot, shard_router.route, dp.resolve_used_update_types())
+    finally:
+        watchdog.cancel()
+        await runner.cleanup()
+        await bot.session.close()
+        await http_session.close()
+        # Blocks until the workers have drained their queues
+        shard_router.stop()
+
 
-    
 async def main():
     """Main function to start the bot."""
+    global http_session
     logger.info("Starting bot...")
+    check_catalog()
+    if BOT_MODE == "webhook":
+        check_webhook_config()
+
+    if WORKERS > 1:
+        await run_sharded()
+        return
     
     # Initialize database
-    await db.init_db()
+    await db.init_db(settings=db.DatabaseSettings.from_env())
+    await rates_service.load_history()
+    warm_keyboards()
     
-    # Fetch exchange rates
-    await get_exchange_rates()
-
-    # Вэб-серверни алоҳида вазифа сифатида ишга туширамиз
-    asyncio.create_task(start_server()) # <--- Шу қаторни қўшинг
+    # One pooled HTTP session for every outbound call
+    http_session = create_http_session()
     
-    # Start polling
-    await dp.start_polling(bot)
+    # Keep exchange rates fresh in the background
+    rates_service.start(http_session)
+    tracer.start(create_span_exporter(http_session))
+
+    try:
+        if BOT_MODE == "webhook":
+            await run_webhook()
+        else:
+            # Вэб-серверни алоҳида вазифа сифатида ишга туширамиз
+            asyncio.create_task(start_server()) # <--- Шу қаторни қўшинг
+            
+            # Start polling
+            await dp.start_polling(bot)
+    finally:
+        await rates_service.stop()
+        await tracer.stop()
+        await http_session.close()
+        await db.close_db()
 
 
 if __name__ == "__main__":
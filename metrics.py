@@ -0,0 +1,284 @@
+# metrics.py - Prometheus text-format metrics without extra dependencies
+
+import functools
+import inspect
+import logging
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+
+import aiohttp
+from aiogram import BaseMiddleware
+from aiogram.types import TelegramObject
+
+DEFAULT_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+LabelValues = Tuple[str, ...]
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(names: Iterable[str], values: Iterable[Any]) -> str:
+    pairs = ",".join(f'{name}="{_escape(value)}"' for name, value in zip(names, values))
+    return "{" + pairs + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic count per label combination."""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self._values: Dict[LabelValues, float] = {}
+
+    def inc(self, *label_values: str, amount: float = 1):
+        self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        for values, value in sorted(self._values.items()):
+            lines.append(f"{self.name}{_format_labels(self.labels, values)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative bucket counts, sum and count per label combination."""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...] = (),
+                 buckets: Tuple[float, ...] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.buckets = tuple(sorted(buckets))
+        # label values -> [per-bucket counts (last one is +Inf), sum]
+        self._series: Dict[LabelValues, list] = {}
+
+    def observe(self, value: float, *label_values: str):
+        series = self._series.get(label_values)
+        if series is None:
+            series = self._series[label_values] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        bounds = [str(bound) for bound in self.buckets] + ["+Inf"]
+        for values, (counts, total) in sorted(self._series.items()):
+            cumulative = 0
+            for bound, count in zip(bounds, counts):
+                cumulative += count
+                labels = _format_labels(self.labels + ("le",), values + (bound,))
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, values)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """Values read from a callback at scrape time; it returns {label values: value}."""
+
+    def __init__(self, name: str, documentation: str, labels: Tuple[str, ...],
+                 callback: Callable[[], Dict[LabelValues, float]]):
+        self.name = name
+        self.documentation = documentation
+        self.labels = labels
+        self.callback = callback
+
+    def collect(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} gauge"]
+        for values, value in sorted(self.callback().items()):
+            if value is not None:
+                lines.append(f"{self.name}{_format_labels(self.labels, values)} {value}")
+        return lines
+
+
+class Registry:
+    """Named metrics rendered together in the Prometheus text format."""
+
+    def __init__(self):
+        self._metrics: List[Any] = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            try:
+                lines.extend(metric.collect())
+            except Exception as e:
+                logging.getLogger(__name__).error(f"Error collecting {metric.name}: {e}")
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+
+def _add_label(sample: str, label: str, value: str) -> str:
+    pair = f'{label}="{_escape(value)}"'
+    brace, space = sample.find("{"), sample.find(" ")
+    if brace != -1 and brace < space:
+        separator = "" if sample[brace + 1] == "}" else ","
+        return f"{sample[:brace + 1]}{pair}{separator}{sample[brace + 1:]}"
+    return f"{sample[:space]}{{{pair}}}{sample[space:]}"
+
+
+def merge_expositions(expositions: Dict[str, str], label: str) -> str:
+    """Combine the text-format output of several processes into one.
+
+    Every sample gets `label` set to the key of the output it came from;
+    HELP and TYPE lines are kept once per metric, with its samples from all
+    processes grouped under them.
+    """
+    # metric name -> [HELP/TYPE lines, samples]
+    families: Dict[str, Tuple[List[str], List[str]]] = {}
+    for key, text in expositions.items():
+        family = None
+        for line in text.splitlines():
+            if not line:
+                continue
+            if line.startswith("#"):
+                parts = line.split(" ", 3)
+                if len(parts) < 3:
+                    continue
+                family = families.setdefault(parts[2], ([], []))
+                if not any(header.split(" ", 2)[1] == parts[1] for header in family[0]):
+                    family[0].append(line)
+            elif family is not None:
+                family[1].append(_add_label(line, label, key))
+    lines = []
+    for headers, samples in families.values():
+        lines.extend(headers)
+        lines.extend(samples)
+    return "\n".join(lines) + "\n"
+
+updates_total = registry.register(Counter(
+    "smartbalance_updates_total", "Updates handled, per handler.", ("handler",)))
+update_errors_total = registry.register(Counter(
+    "smartbalance_update_errors_total", "Handler calls that raised or logged an error.", ("handler",)))
+update_seconds = registry.register(Histogram(
+    "smartbalance_update_seconds", "Handler latency in seconds.", ("handler",)))
+db_seconds = registry.register(Histogram(
+    "smartbalance_db_seconds", "Time spent in database.py functions.", ("function",)))
+fsm_seconds = registry.register(Histogram(
+    "smartbalance_fsm_seconds", "FSM storage operation time.", ("op",)))
+http_seconds = registry.register(Histogram(
+    "smartbalance_http_request_seconds", "Outbound HTTP request time (exchange rates).", ("host", "status")))
+
+
+# ===================== INSTRUMENTATION =====================
+
+class HandlerCall:
+    """The handler call running in the current context, for ErrorLogCounter."""
+
+    __slots__ = ("name", "failed")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.failed = False
+
+    def fail(self):
+        """Count the call as failed, once however many errors it has."""
+        if not self.failed:
+            self.failed = True
+            update_errors_total.inc(self.name)
+
+
+current_handler: ContextVar[Optional[HandlerCall]] = ContextVar("current_handler", default=None)
+
+
+class HandlerMetricsMiddleware(BaseMiddleware):
+    """Inner middleware that times each handler call and counts its failures.
+
+    Series are labelled with the handler's function name, or with what
+    `resolve_name(data)` returns for handlers that dispatch further. The
+    call is published in `current_handler` while it runs.
+    """
+
+    def __init__(self, resolve_name: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None):
+        self.resolve_name = resolve_name
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        name = (self.resolve_name and self.resolve_name(data)) or data["handler"].callback.__name__
+        call = HandlerCall(name)
+        token = current_handler.set(call)
+        start = time.perf_counter()
+        try:
+            return await handler(event, data)
+        except Exception:
+            call.fail()
+            raise
+        finally:
+            current_handler.reset(token)
+            update_seconds.observe(time.perf_counter() - start, name)
+            updates_total.inc(name)
+
+
+class ErrorLogCounter(logging.Handler):
+    """Counts ERROR log records against the handler call they were logged in.
+
+    Handlers and the database functions they call log the errors they
+    catch; records logged outside a handler call are not update errors.
+    """
+
+    def __init__(self):
+        super().__init__(level=logging.ERROR)
+
+    def emit(self, record: logging.LogRecord):
+        call = current_handler.get()
+        if call is not None:
+            call.fail()
+
+
+def _timed(function: Callable[..., Awaitable[Any]], histogram: Histogram, label: str):
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return await function(*args, **kwargs)
+        finally:
+            histogram.observe(time.perf_counter() - start, label)
+    return wrapper
+
+
+def instrument(target: Any, histogram: Histogram, names: Optional[Iterable[str]] = None):
+    """Replace coroutine functions of a module or object with timed wrappers.
+
+    Without `names`, every public coroutine function defined in the module
+    is wrapped. Callers must look the functions up through the target
+    (`db.get_user(...)`), which is how the bot uses database.py.
+    """
+    if names is None:
+        names = [
+            name for name, value in vars(target).items()
+            if not name.startswith("_") and inspect.iscoroutinefunction(value)
+            and value.__module__ == target.__name__
+        ]
+    for name in names:
+        setattr(target, name, _timed(getattr(target, name), histogram, name))
+
+
+def http_trace_config() -> aiohttp.TraceConfig:
+    """aiohttp trace hooks that time every request of a client session."""
+
+    async def on_request_start(session, context, params):
+        context.start = time.perf_counter()
+
+    async def on_request_end(session, context, params):
+        http_seconds.observe(time.perf_counter() - context.start, params.url.host, str(params.response.status))
+
+    async def on_request_exception(session, context, params):
+        http_seconds.observe(time.perf_counter() - context.start, params.url.host, "error")
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config
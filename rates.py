@@ -0,0 +1,213 @@
+# rates.py - Exchange rates snapshot refreshed in the background
+
+import argparse
+import asyncio
+import logging
+import time
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
+from typing import Dict, List, Optional
+
+import aiohttp
+
+import database as db
+
+CBU_URL = "https://cbu.uz/ru/arkhiv-kursov-valyut/json/"
+TRACKED_CURRENCIES = ("USD", "RUB", "CNY")
+BACKFILL_CONCURRENCY = 4
+
+# Fallback values, served until the first successful fetch
+DEFAULT_RATES = {
+    "UZS": 1,
+    "USD": 12500,
+    "RUB": 135,
+    "CNY": 1750
+}
+
+logger = logging.getLogger(__name__)
+
+
+def parse_rates(data: list) -> List[tuple]:
+    """Turn a CBU JSON payload into (date, currency, rate) rows with ISO dates."""
+    rows = []
+    for item in data:
+        if item["Ccy"] in TRACKED_CURRENCIES:
+            day = datetime.strptime(item["Date"], "%d.%m.%Y").strftime("%Y-%m-%d")
+            rows.append((day, item["Ccy"], float(item["Rate"])))
+    return rows
+
+
+class RateHistory:
+    """Sorted per-currency rate history with bisect lookups by date."""
+
+    def __init__(self):
+        self._dates: Dict[str, List[str]] = {}
+        self._rates: Dict[str, List[float]] = {}
+
+    def add(self, day: str, currency: str, rate: float):
+        """Insert or replace the rate of `currency` effective from `day` (YYYY-MM-DD)."""
+        dates = self._dates.setdefault(currency, [])
+        rates = self._rates.setdefault(currency, [])
+        i = bisect_left(dates, day)
+        if i < len(dates) and dates[i] == day:
+            rates[i] = rate
+        else:
+            dates.insert(i, day)
+            rates.insert(i, rate)
+
+    def rate_on(self, currency: str, day: str) -> Optional[float]:
+        """Rate in effect on `day`: the latest one published on or before it.
+
+        Dates before the first known rate use the earliest one; None if the
+        currency has no history at all.
+        """
+        dates = self._dates.get(currency)
+        if not dates:
+            return None
+        i = bisect_right(dates, day[:10]) - 1
+        return self._rates[currency][max(i, 0)]
+
+    def __len__(self) -> int:
+        return sum(len(dates) for dates in self._dates.values())
+
+
+class RatesService:
+    """In-memory exchange rates (UZS per unit) kept fresh by a background task.
+
+    Handlers read `rates` without awaiting anything. The task refetches the
+    rates every `ttl` seconds; when the API is unreachable the last known
+    snapshot keeps being served and the fetch is retried after `retry_interval`.
+    Every fetched rate is also persisted and indexed in `history`, so amounts
+    can be converted with the rate of the day they were recorded.
+    `version` grows whenever converted amounts may change, for caches of them.
+    """
+
+    def __init__(self, url: str = CBU_URL, ttl: float = 3600, retry_interval: float = 60,
+                 session: Optional[aiohttp.ClientSession] = None):
+        self.url = url
+        self.ttl = ttl
+        self.retry_interval = min(retry_interval, ttl)
+        self.rates: Dict[str, float] = dict(DEFAULT_RATES)
+        self.history = RateHistory()
+        self.updated_at: Optional[float] = None
+        self.version = 0
+        self._session = session
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def is_stale(self) -> bool:
+        """True until a fetch succeeds and again once the snapshot outlives the TTL."""
+        return self.updated_at is None or time.monotonic() - self.updated_at > self.ttl
+
+    def rate(self, currency: str, day: Optional[str] = None) -> float:
+        """UZS per unit of `currency`, as of `day` when given and known."""
+        if currency == "UZS":
+            return 1
+        if day is not None:
+            historical = self.history.rate_on(currency, day)
+            if historical is not None:
+                return historical
+        return self.rates.get(currency, 1)
+
+    async def load_history(self):
+        """Load the persisted rate history into memory."""
+        for row in await db.get_all_rates():
+            self.history.add(row["date"], row["currency"], row["rate"])
+        self.version += 1
+        logger.info(f"Loaded {len(self.history)} historical exchange rates")
+
+    async def _fetch(self, url: str) -> Optional[List[tuple]]:
+        async with self._session.get(url) as response:
+            if response.status != 200:
+                logger.error(f"Exchange rates request failed with status {response.status}")
+                return None
+            return parse_rates(await response.json(content_type=None))
+
+    async def refresh(self) -> bool:
+        """Fetch rates once; returns False and keeps the old snapshot on failure."""
+        try:
+            rows = await self._fetch(self.url)
+            if rows is None:
+                return False
+            rates = dict(self.rates)
+            for day, currency, rate in rows:
+                rates[currency] = rate
+                self.history.add(day, currency, rate)
+            # Swap the whole dict so readers never see a half-updated snapshot
+            if rates != self.rates:
+                self.version += 1
+            self.rates = rates
+            self.updated_at = time.monotonic()
+            await db.save_rates(rows)
+            logger.info(f"Exchange rates updated: {rates}")
+            return True
+        except Exception as e:
+            logger.error(f"Error fetching exchange rates: {e}")
+            return False
+
+    async def backfill(self, start: date, end: date, concurrency: int = BACKFILL_CONCURRENCY) -> int:
+        """Load archived CBU rates for every day in [start, end] and store them in bulk."""
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def fetch_day(day: date) -> List[tuple]:
+            async with semaphore:
+                try:
+                    return await self._fetch(f"{self.url}all/{day.isoformat()}/") or []
+                except Exception as e:
+                    logger.error(f"Error fetching archived rates for {day}: {e}")
+                    return []
+
+        days = [start + timedelta(days=i) for i in range((end - start).days + 1)]
+        rows = {}
+        for result in await asyncio.gather(*(fetch_day(day) for day in days)):
+            for day, currency, rate in result:
+                rows[(day, currency)] = (day, currency, rate)
+        await db.save_rates(list(rows.values()))
+        for day, currency, rate in rows.values():
+            self.history.add(day, currency, rate)
+        self.version += 1
+        logger.info(f"Backfilled {len(rows)} exchange rates from {start} to {end}")
+        return len(rows)
+
+    async def _run(self):
+        while True:
+            ok = await self.refresh()
+            await asyncio.sleep(self.ttl if ok else self.retry_interval)
+
+    def start(self, session: aiohttp.ClientSession):
+        """Start the background refresh task (the first fetch happens immediately)."""
+        self._session = session
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Cancel the background refresh task."""
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+async def _backfill_command(start: date, end: date):
+    await db.init_db()
+    try:
+        async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=30)) as session:
+            service = RatesService(session=session)
+            await service.backfill(start, end)
+    finally:
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    # python rates.py backfill 2024-01-01 2024-12-31
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description="Exchange rate maintenance")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    backfill_parser = subparsers.add_parser("backfill", help="load archived CBU rates into the rates table")
+    backfill_parser.add_argument("start", type=date.fromisoformat)
+    backfill_parser.add_argument("end", type=date.fromisoformat)
+    args = parser.parse_args()
+    asyncio.run(_backfill_command(args.start, args.end))
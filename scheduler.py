@@ -0,0 +1,86 @@
+# scheduler.py - Bounded concurrent update processing with per-user ordering
+
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from typing import Any, AsyncGenerator, Dict
+
+from aiogram.fsm.storage.base import BaseEventIsolation, StorageKey
+
+DEFAULT_CONCURRENCY = 64
+DEFAULT_USER_QUEUE_LIMIT = 10
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateDropped(Exception):
+    """Raised when a user already has too many updates waiting."""
+
+
+class UpdateScheduler(BaseEventIsolation):
+    """Event isolation that schedules updates in front of the router.
+
+    The dispatcher's FSM middleware enters `lock()` for every update before
+    loading the user's state. Updates of one user (one FSM key) run strictly
+    in arrival order, updates of different users run in parallel up to
+    `max_concurrency` at a time, and a user with `max_pending_per_user`
+    updates already queued or running gets further ones rejected with
+    UpdateDropped.
+    """
+
+    def __init__(self, max_concurrency: int = DEFAULT_CONCURRENCY,
+                 max_pending_per_user: int = DEFAULT_USER_QUEUE_LIMIT):
+        self.max_concurrency = max_concurrency
+        self.max_pending_per_user = max_pending_per_user
+        self.active = 0
+        self.dropped = 0
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._locks: Dict[StorageKey, asyncio.Lock] = {}
+        self._pending: Dict[StorageKey, int] = {}
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        pending = self._pending.get(key, 0)
+        if pending >= self.max_pending_per_user:
+            self.dropped += 1
+            raise UpdateDropped(f"user {key.user_id} has {pending} pending updates")
+        self._pending[key] = pending + 1
+        lock = self._locks.get(key)
+        if lock is None:
+            lock = self._locks[key] = asyncio.Lock()
+        try:
+            # asyncio.Lock wakes waiters in FIFO order, which keeps each user's updates ordered
+            async with lock:
+                async with self._semaphore:
+                    self.active += 1
+                    try:
+                        yield
+                    finally:
+                        self.active -= 1
+        finally:
+            remaining = self._pending[key] - 1
+            if remaining:
+                self._pending[key] = remaining
+            else:
+                del self._pending[key]
+                del self._locks[key]
+
+    def queue_depth(self, key: StorageKey) -> int:
+        """Updates of one user that are queued or running."""
+        return self._pending.get(key, 0)
+
+    def stats(self) -> Dict[str, Any]:
+        """Queue-depth metrics across all users."""
+        pending = sum(self._pending.values())
+        return {
+            "active": self.active,
+            "waiting": pending - self.active,
+            "users": len(self._pending),
+            "max_user_depth": max(self._pending.values(), default=0),
+            "dropped": self.dropped,
+        }
+
+    async def close(self) -> None:
+        logger.info(f"Update scheduler stats: {self.stats()}")
+        self._locks.clear()
+        self._pending.clear()
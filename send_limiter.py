@@ -0,0 +1,163 @@
+# send_limiter.py - Outbound Telegram API rate limiting
+
+import asyncio
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Dict, Iterator
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+
+from cache import LRUCache
+
+GLOBAL_RATE = 30.0  # messages per second across all chats
+CHAT_RATE = 1.0  # messages per second to one chat
+CHAT_BURST = 3  # messages one chat may receive back to back
+MAX_RETRIES = 3
+CHAT_BUCKETS = 10000
+
+# Send priorities: interactive replies go before bulk messages
+INTERACTIVE = 0
+BULK = 1
+
+send_priority: ContextVar[int] = ContextVar("send_priority", default=INTERACTIVE)
+
+logger = logging.getLogger(__name__)
+
+
+@contextmanager
+def bulk_sends() -> Iterator[None]:
+    """Mark requests made inside the block as bulk (e.g. broadcasts)."""
+    token = send_priority.set(BULK)
+    try:
+        yield
+    finally:
+        send_priority.reset(token)
+
+
+class TokenBucket:
+    """`rate` tokens per second, holding at most `capacity`."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self._updated) * self.rate)
+        self._updated = now
+
+    def delay(self) -> float:
+        """Seconds until a token can be taken (0 if one is available now)."""
+        now = time.monotonic()
+        self._refill(now)
+        wait = max(0.0, self.blocked_until - now)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Hold the bucket empty for `seconds`, e.g. after a flood-control error."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+
+class SendLimiter(BaseRequestMiddleware):
+    """Bot session middleware that paces requests addressed to a chat.
+
+    Each request with a chat_id takes a token from that chat's bucket and
+    from the global bucket, waiting until both have one. While interactive
+    requests are waiting for the global bucket, bulk ones (see bulk_sends)
+    hold back; an interactive request held only by its own chat's bucket
+    does not delay bulk sends to other chats. A 429 reply blocks the chat
+    for `retry_after` seconds and the request is retried up to
+    `max_retries` times. Requests without a chat_id (getUpdates, getFile,
+    ...) pass through untouched.
+    """
+
+    def __init__(self, global_rate: float = GLOBAL_RATE, chat_rate: float = CHAT_RATE,
+                 chat_burst: int = CHAT_BURST, max_retries: int = MAX_RETRIES):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        # No burst: a full bucket of `global_rate` plus its refill would allow
+        # twice the rate within one second
+        self.global_bucket = TokenBucket(global_rate, 1)
+        self._chats = LRUCache(CHAT_BUCKETS)
+        self._waiting = {INTERACTIVE: 0, BULK: 0}
+        self._waiting_global = 0  # interactive requests held by the global bucket
+        self.throttled = 0
+        self.retries = 0
+
+    def _chat_bucket(self, chat_id: Any) -> TokenBucket:
+        bucket = self._chats.peek(chat_id)
+        if bucket is None:
+            bucket = TokenBucket(self.chat_rate, self.chat_burst)
+        # Evicting the least recently used bucket only forgets an idle chat
+        self._chats.set(chat_id, bucket)
+        return bucket
+
+    async def acquire(self, chat_id: Any, priority: int = INTERACTIVE):
+        """Wait for a send slot to `chat_id`."""
+        bucket = self._chat_bucket(chat_id)
+        self._waiting[priority] += 1
+        throttled = False
+        on_global = False
+        try:
+            while True:
+                if priority == BULK and self._waiting_global:
+                    delay = 1 / self.global_bucket.rate
+                else:
+                    chat_delay = bucket.delay()
+                    global_delay = self.global_bucket.delay()
+                    delay = max(chat_delay, global_delay)
+                    if delay <= 0:
+                        bucket.take()
+                        self.global_bucket.take()
+                        return
+                    if priority == INTERACTIVE and on_global != (global_delay >= chat_delay):
+                        on_global = not on_global
+                        self._waiting_global += 1 if on_global else -1
+                if not throttled:
+                    throttled = True
+                    self.throttled += 1
+                await asyncio.sleep(delay)
+        finally:
+            self._waiting[priority] -= 1
+            if on_global:
+                self._waiting_global -= 1
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        chat_id = getattr(method, "chat_id", None)
+        if chat_id is None:
+            return await make_request(bot, method)
+        priority = send_priority.get()
+        for attempt in range(self.max_retries + 1):
+            await self.acquire(chat_id, priority)
+            try:
+                return await make_request(bot, method)
+            except TelegramRetryAfter as e:
+                if attempt == self.max_retries:
+                    raise
+                self.retries += 1
+                logger.warning(f"Flood control on {type(method).__name__} to {chat_id}, retrying in {e.retry_after}s")
+                self._chat_bucket(chat_id).block(e.retry_after)
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "throttled": self.throttled,
+            "retries": self.retries,
+            "waiting_interactive": self._waiting[INTERACTIVE],
+            "waiting_bulk": self._waiting[BULK],
+            "chats": len(self._chats),
+        }
@@ -0,0 +1,137 @@
+# sharding.py - Route updates to worker processes that each own a shard of users
+
+import asyncio
+import logging
+import multiprocessing
+from typing import Any, AsyncIterator, Callable, Dict, List, Optional
+
+from aiogram import Bot
+
+STOP_TIMEOUT = 30  # seconds a worker gets to drain its queue on shutdown
+WATCH_INTERVAL = 5  # seconds between worker liveness checks
+
+logger = logging.getLogger(__name__)
+
+# Worker processes are spawned, never forked, so they don't inherit the
+# front process's event loop, sockets or database connections
+_mp = multiprocessing.get_context("spawn")
+
+
+def update_user_id(update: Dict[str, Any]) -> Optional[int]:
+    """The id of the user (or chat) a raw Telegram update belongs to."""
+    for value in update.values():
+        if isinstance(value, dict):
+            owner = value.get("from") or value.get("user") or value.get("chat")
+            if isinstance(owner, dict) and "id" in owner:
+                return owner["id"]
+    return None
+
+
+class ShardRouter:
+    """Runs `workers` processes and sends each update to the one owning its user.
+
+    Every user id maps to a fixed worker, so a user's updates always reach the
+    same process and keep their order, and per-user caches stay valid there.
+    Updates without a user go to worker 0.
+
+    A worker that died is restarted with a fresh queue, when an update is
+    routed to it or by `watch()`; updates still queued for the dead worker
+    are lost.
+    """
+
+    def __init__(self, workers: int, target: Callable[[int, Any], None]):
+        self.workers = workers
+        self.target = target
+        self.routed: List[int] = [0] * workers
+        self.restarts: List[int] = [0] * workers
+        self._queues: List[Any] = []
+        self._processes: List[Any] = []
+
+    def shard_for(self, user_id: Optional[int]) -> int:
+        return user_id % self.workers if user_id is not None else 0
+
+    def _spawn(self, index: int):
+        # A worker killed inside queue.get() leaves the queue's read lock taken,
+        # so a replacement never reuses the old queue
+        queue = _mp.Queue()
+        process = _mp.Process(target=self.target, args=(index, queue), name=f"shard-{index}")
+        process.start()
+        if index < len(self._processes):
+            self._queues[index] = queue
+            self._processes[index] = process
+        else:
+            self._queues.append(queue)
+            self._processes.append(process)
+
+    def start(self):
+        for index in range(self.workers):
+            self._spawn(index)
+        logger.info(f"Started {self.workers} shard workers")
+
+    def _ensure_alive(self, index: int):
+        process = self._processes[index]
+        if process.is_alive():
+            return
+        logger.error(f"{process.name} exited with code {process.exitcode}, restarting it")
+        # Nobody reads the old queue any more; don't block exit on flushing it
+        self._queues[index].cancel_join_thread()
+        self._queues[index].close()
+        self.restarts[index] += 1
+        self._spawn(index)
+
+    def check_workers(self):
+        """Restart every worker process that has died."""
+        for index in range(len(self._processes)):
+            self._ensure_alive(index)
+
+    async def watch(self, interval: float = WATCH_INTERVAL):
+        """Check the workers every `interval` seconds, so idle shards get restarted too."""
+        while True:
+            await asyncio.sleep(interval)
+            self.check_workers()
+
+    def route(self, update: Dict[str, Any]):
+        """Queue a raw update (as received from Telegram) for its shard."""
+        shard = self.shard_for(update_user_id(update))
+        self._ensure_alive(shard)
+        self.routed[shard] += 1
+        self._queues[shard].put_nowait(update)
+
+    def stop(self):
+        """Ask every worker to finish its queue and exit."""
+        for queue in self._queues:
+            queue.put_nowait(None)
+        for process in self._processes:
+            process.join(STOP_TIMEOUT)
+            if process.is_alive():
+                logger.warning(f"{process.name} did not stop in time, terminating")
+                process.terminate()
+        logger.info(f"Shard workers stopped, updates routed: {self.routed}, restarts: {self.restarts}")
+        self._queues.clear()
+        self._processes.clear()
+
+
+async def iter_queue(queue: Any) -> AsyncIterator[Dict[str, Any]]:
+    """Yield updates from a worker's queue until the stop sentinel arrives."""
+    loop = asyncio.get_running_loop()
+    while True:
+        update = await loop.run_in_executor(None, queue.get)
+        if update is None:
+            return
+        yield update
+
+
+async def poll_updates(bot: Bot, on_update: Callable[[Dict[str, Any]], None],
+                       allowed_updates: Optional[List[str]] = None, timeout: int = 30):
+    """Long-poll getUpdates and pass every update on as a raw dict."""
+    offset = None
+    while True:
+        try:
+            updates = await bot.get_updates(offset=offset, timeout=timeout, allowed_updates=allowed_updates)
+        except Exception as e:
+            logger.error(f"Error getting updates: {e}")
+            await asyncio.sleep(1)
+            continue
+        for update in updates:
+            offset = update.update_id + 1
+            on_update(update.model_dump(mode="json", by_alias=True, exclude_none=True))
@@ -0,0 +1,314 @@
+# storage.py - Persistent FSM storage backends for the dispatcher
+
+import asyncio
+import copy
+import json
+import logging
+import time
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple
+from urllib.parse import urlparse
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseStorage, DefaultKeyBuilder, KeyBuilder, StateType, StorageKey
+from aiogram.fsm.storage.memory import MemoryStorage
+
+import database as db
+from cache import LRUCache
+
+DEFAULT_TTL = 7 * 24 * 3600  # seconds a user's state survives without activity
+FLUSH_INTERVAL = 0.5  # seconds
+FLUSH_BATCH_SIZE = 500
+PURGE_INTERVAL = 3600  # seconds between expired-row sweeps
+RECORD_CACHE_SIZE = 10000
+DEFAULT_POOL_SIZE = 8  # RESP connections per client
+
+logger = logging.getLogger(__name__)
+
+# (state, data, updated_at) of one storage key
+Record = Tuple[Optional[str], Dict[str, Any], float]
+# (reader, writer) of one RESP connection
+Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+class SQLiteStorage(BaseStorage):
+    """FSM storage kept in the fsm_states table of the bot database.
+
+    Writes land in an in-memory record cache and are flushed to SQLite in a
+    single transaction every `flush_interval` seconds (or as soon as
+    `batch_size` keys are dirty), so the several state/data updates a handler
+    makes cost one batched write. A failed flush keeps its records dirty and
+    is retried on the next interval. Records untouched for `ttl` seconds are
+    treated as empty and periodically deleted.
+    """
+
+    def __init__(self, ttl: int = DEFAULT_TTL, flush_interval: float = FLUSH_INTERVAL,
+                 batch_size: int = FLUSH_BATCH_SIZE, key_builder: Optional[KeyBuilder] = None):
+        self.ttl = ttl
+        self.flush_interval = flush_interval
+        self.batch_size = batch_size
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+        self._records = LRUCache(RECORD_CACHE_SIZE)
+        self._dirty: Dict[str, Record] = {}
+        self._flush_task: Optional[asyncio.Task] = None
+        self._full = asyncio.Event()
+        self._last_purge = time.time()
+
+    def _is_expired(self, record: Record) -> bool:
+        return bool(self.ttl) and time.time() - record[2] > self.ttl
+
+    async def _load(self, key: str) -> Record:
+        record = self._dirty.get(key) or self._records.get(key)
+        if record is None:
+            row = await db.get_fsm_record(key)
+            if row is None:
+                record = (None, {}, time.time())
+            else:
+                record = (row["state"], json.loads(row["data"]), row["updated_at"])
+            self._records.set(key, record)
+        if self._is_expired(record):
+            return None, {}, time.time()
+        return record
+
+    def _store(self, key: str, state: Optional[str], data: Dict[str, Any]):
+        record = (state, data, time.time())
+        self._records.set(key, record)
+        self._dirty[key] = record
+        if len(self._dirty) >= self.batch_size:
+            self._full.set()
+        if self._flush_task is None or self._flush_task.done():
+            self._flush_task = asyncio.create_task(self._flush_later())
+
+    async def _flush_later(self):
+        """Flush every flush_interval, or once a batch is full, while records are dirty."""
+        while self._dirty:
+            try:
+                await asyncio.wait_for(self._full.wait(), self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._full.clear()
+            await self.flush()
+
+    async def flush(self):
+        """Write every dirty record to SQLite in one transaction."""
+        dirty, self._dirty = self._dirty, {}
+        if dirty:
+            records = []
+            deleted = []
+            for key, (state, data, updated_at) in dirty.items():
+                if state is None and not data:
+                    deleted.append(key)
+                else:
+                    records.append((key, state, json.dumps(data, ensure_ascii=False), int(updated_at)))
+            try:
+                await db.save_fsm_records(records, deleted)
+            except asyncio.CancelledError:
+                self._dirty = {**dirty, **self._dirty}
+                raise
+            except Exception as e:
+                logger.error(f"Error flushing FSM records: {e}")
+                # Keep the failed batch unless a newer write replaced it
+                self._dirty = {**dirty, **self._dirty}
+                return
+        if self.ttl and time.time() - self._last_purge > PURGE_INTERVAL:
+            self._last_purge = time.time()
+            purged = await db.delete_fsm_records_before(int(time.time() - self.ttl))
+            if purged:
+                logger.info(f"Deleted {purged} expired FSM records")
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        storage_key = self.key_builder.build(key)
+        _, data, _ = await self._load(storage_key)
+        self._store(storage_key, _state_name(state), data)
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        state, _, _ = await self._load(self.key_builder.build(key))
+        return state
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        storage_key = self.key_builder.build(key)
+        state, _, _ = await self._load(storage_key)
+        self._store(storage_key, state, copy.deepcopy(dict(data)))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        _, data, _ = await self._load(self.key_builder.build(key))
+        return copy.deepcopy(data)
+
+    async def close(self) -> None:
+        if self._flush_task is not None:
+            self._flush_task.cancel()
+            try:
+                await self._flush_task
+            except asyncio.CancelledError:
+                pass
+            self._flush_task = None
+        await self.flush()
+
+
+class RespClient:
+    """Minimal client for the Redis serialization protocol (RESP2).
+
+    Commands run on a pool of up to `pool_size` connections, one command at
+    a time on each. A connection whose command did not finish, whether on an
+    error or because the caller was cancelled, is closed rather than reused,
+    since its reply may still be on the way; the pool reconnects on demand.
+    """
+
+    def __init__(self, host: str = "localhost", port: int = 6379, db: int = 0,
+                 password: Optional[str] = None, pool_size: int = DEFAULT_POOL_SIZE):
+        self.host = host
+        self.port = port
+        self.db = db
+        self.password = password
+        self._idle: List[Connection] = []
+        self._open: Set[asyncio.StreamWriter] = set()
+        self._slots = asyncio.Semaphore(pool_size)
+
+    @classmethod
+    def from_url(cls, url: str, pool_size: int = DEFAULT_POOL_SIZE) -> "RespClient":
+        """Create a client from a redis://[:password@]host[:port][/db] URL."""
+        parsed = urlparse(url)
+        database = parsed.path.lstrip("/")
+        return cls(
+            host=parsed.hostname or "localhost",
+            port=parsed.port or 6379,
+            db=int(database) if database else 0,
+            password=parsed.password,
+            pool_size=pool_size
+        )
+
+    @staticmethod
+    def _encode(args: Tuple[Any, ...]) -> bytes:
+        parts = [b"*%d\r\n" % len(args)]
+        for arg in args:
+            value = arg if isinstance(arg, bytes) else str(arg).encode()
+            parts.append(b"$%d\r\n%s\r\n" % (len(value), value))
+        return b"".join(parts)
+
+    async def _read_reply(self, reader: asyncio.StreamReader) -> Any:
+        line = await reader.readline()
+        if not line:
+            raise ConnectionError("Connection closed by server")
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            raise RuntimeError(payload.decode())
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            value = await reader.readexactly(length + 2)
+            return value[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [await self._read_reply(reader) for _ in range(length)]
+        raise RuntimeError(f"Unexpected RESP reply: {line!r}")
+
+    async def _call(self, connection: Connection, *args: Any) -> Any:
+        reader, writer = connection
+        writer.write(self._encode(args))
+        await writer.drain()
+        return await self._read_reply(reader)
+
+    async def _connect(self) -> Connection:
+        connection = await asyncio.open_connection(self.host, self.port)
+        self._open.add(connection[1])
+        try:
+            if self.password:
+                await self._call(connection, "AUTH", self.password)
+            if self.db:
+                await self._call(connection, "SELECT", self.db)
+        except BaseException:
+            self._discard(connection)
+            raise
+        return connection
+
+    def _discard(self, connection: Connection):
+        writer = connection[1]
+        self._open.discard(writer)
+        writer.close()
+
+    async def execute(self, *args: Any) -> Any:
+        """Send one command and return its decoded reply."""
+        async with self._slots:
+            connection = self._idle.pop() if self._idle else await self._connect()
+            try:
+                reply = await self._call(connection, *args)
+            except BaseException:
+                # Includes CancelledError: an unread reply would answer the next command
+                self._discard(connection)
+                raise
+            self._idle.append(connection)
+            return reply
+
+    async def close(self):
+        writers = list(self._open)
+        self._open.clear()
+        self._idle.clear()
+        for writer in writers:
+            writer.close()
+        for writer in writers:
+            try:
+                await writer.wait_closed()
+            except Exception:
+                pass
+
+
+class RespStorage(BaseStorage):
+    """FSM storage on any server speaking the Redis protocol.
+
+    State and data live under separate keys and expire after `ttl` seconds
+    without writes, so several bot processes can share one server.
+    """
+
+    def __init__(self, client: RespClient, ttl: int = DEFAULT_TTL,
+                 key_builder: Optional[KeyBuilder] = None):
+        self.client = client
+        self.ttl = ttl
+        self.key_builder = key_builder or DefaultKeyBuilder(with_destiny=True)
+
+    async def _set(self, key: str, value: Optional[str]):
+        if value is None:
+            await self.client.execute("DEL", key)
+        elif self.ttl:
+            await self.client.execute("SET", key, value, "EX", self.ttl)
+        else:
+            await self.client.execute("SET", key, value)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._set(self.key_builder.build(key, "state"), _state_name(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        value = await self.client.execute("GET", self.key_builder.build(key, "state"))
+        return value.decode() if value is not None else None
+
+    async def set_data(self, key: StorageKey, data: Mapping[str, Any]) -> None:
+        value = json.dumps(dict(data), ensure_ascii=False) if data else None
+        await self._set(self.key_builder.build(key, "data"), value)
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        value = await self.client.execute("GET", self.key_builder.build(key, "data"))
+        return json.loads(value) if value is not None else {}
+
+    async def close(self) -> None:
+        await self.client.close()
+
+
+def create_storage(kind: str, ttl: int = DEFAULT_TTL, redis_url: Optional[str] = None,
+                   redis_pool_size: int = DEFAULT_POOL_SIZE) -> BaseStorage:
+    """Build the FSM storage selected by name: memory, sqlite or redis."""
+    if kind == "memory":
+        return MemoryStorage()
+    if kind == "sqlite":
+        return SQLiteStorage(ttl=ttl)
+    if kind == "redis":
+        return RespStorage(RespClient.from_url(redis_url or "redis://localhost:6379/0", redis_pool_size), ttl=ttl)
+    raise ValueError(f"Unknown FSM storage: {kind}")
@@ -1,5 +1,10 @@
 # strings.py - Multi-language support for the Telegram bot
 
+from string import Formatter
+from typing import Callable, Dict
+
+DEFAULT_LANGUAGE = "en"
+
 STRINGS = {
     "uz": {
         # Language selection
@@ -86,6 +91,12 @@ STRINGS = {
         "select_main_currency": "⚙️ Asosiy valyutani tanlang:\n\nBarcha statistikalar tanlangan valyutada ko'rsatiladi.",
         "main_currency_set": "✅ Asosiy valyuta {currency} qilib o'rnatildi!",
         
+        # Export/Import
+        "export_caption": "📤 Barcha yozuvlaringiz CSV faylda.",
+        "import_prompt": "📥 CSV faylni yuboring. Ustunlar: kind, type, name, amount, currency, date.\n\nkind: transaction, debt yoki utility; date: YYYY-MM-DD HH:MM.",
+        "import_done": "✅ {imported} ta yozuv import qilindi, {skipped} ta noto'g'ri qator o'tkazib yuborildi.",
+        "import_failed": "😔 Import {imported} ta yozuvdan keyin to'xtadi. Faylni tekshirib, qaytadan urinib ko'ring.",
+        
         # General
         "btn_back": "🔙 Orqaga",
         "btn_main_menu": "🏠 Asosiy menyu",
@@ -178,6 +189,12 @@ STRINGS = {
         "select_main_currency": "⚙️ Выберите основную валюту:\n\nВся статистика будет отображаться в выбранной валюте.",
         "main_currency_set": "✅ Основная валюта установлена: {currency}!",
         
+        # Export/Import
+        "export_caption": "📤 Все ваши записи в CSV файле.",
+        "import_prompt": "📥 Отправьте CSV файл. Колонки: kind, type, name, amount, currency, date.\n\nkind: transaction, debt или utility; date: YYYY-MM-DD HH:MM.",
+        "import_done": "✅ Импортировано записей: {imported}, пропущено неверных строк: {skipped}.",
+        "import_failed": "😔 Импорт остановлен после {imported} записей. Проверьте файл и попробуйте снова.",
+        
         # General
         "btn_back": "🔙 Назад",
         "btn_main_menu": "🏠 Главное меню",
@@ -270,6 +287,12 @@ STRINGS = {
         "select_main_currency": "⚙️ Select main currency:\n\nAll statistics will be displayed in the selected currency.",
         "main_currency_set": "✅ Main currency set to {currency}!",
         
+        # Export/Import
+        "export_caption": "📤 All your records as a CSV file.",
+        "import_prompt": "📥 Send a CSV file with the columns: kind, type, name, amount, currency, date.\n\nkind is transaction, debt or utility; date is YYYY-MM-DD HH:MM.",
+        "import_done": "✅ Imported {imported} records, skipped {skipped} invalid rows.",
+        "import_failed": "😔 Import stopped after {imported} records. Please check the file and try again.",
+        
         # General
         "btn_back": "🔙 Back",
         "btn_main_menu": "🏠 Main Menu",
@@ -288,9 +311,64 @@ UTILITY_TYPES = {
     "tax": {"uz": "🏛️ Soliq/Uy to'lovi", "ru": "🏛️ Налог/Квартплата", "en": "🏛️ Tax/House Bill"},
 }
 
+# ===================== COMPILED CATALOG =====================
+
+def _placeholders(text: str) -> set:
+    return {field for _, field, _, _ in Formatter().parse(text) if field is not None}
+
+
+def check_catalog() -> None:
+    """Raise ValueError unless every language has every key with the same placeholders."""
+    keys = set().union(*STRINGS.values())
+    problems = []
+    for lang, texts in STRINGS.items():
+        missing = sorted(keys - set(texts))
+        if missing:
+            problems.append(f"{lang}: missing {', '.join(missing)}")
+    reference = STRINGS[DEFAULT_LANGUAGE]
+    for lang, texts in STRINGS.items():
+        for key, text in texts.items():
+            if key in reference and _placeholders(text) != _placeholders(reference[key]):
+                problems.append(f"{lang}.{key}: placeholders differ from {DEFAULT_LANGUAGE}")
+    if problems:
+        raise ValueError("Invalid string catalog: " + "; ".join(problems))
+
+
+def _compile() -> Dict[str, Dict[str, str]]:
+    """One flat table per language with missing keys already filled from the default."""
+    fallback = STRINGS[DEFAULT_LANGUAGE]
+    return {lang: {**fallback, **texts} for lang, texts in STRINGS.items()}
+
+
+_CATALOG = _compile()
+_DEFAULT_TABLE = _CATALOG[DEFAULT_LANGUAGE]
+# Bound str.format of every text, looked up once per language and key
+_TEMPLATES: Dict[str, Dict[str, Callable[..., str]]] = {
+    lang: {key: text.format for key, text in table.items()} for lang, table in _CATALOG.items()
+}
+
+
+def build_label_index(keys) -> Dict[str, str]:
+    """Map the text of `keys` in every language back to the key."""
+    index = {}
+    for key in keys:
+        for table in _CATALOG.values():
+            label = table[key]
+            if index.setdefault(label, key) != key:
+                raise ValueError(f"Label {label!r} is used by both {index[label]} and {key}")
+    return index
+
+
 def get_text(lang: str, key: str) -> str:
     """Get text in the specified language."""
-    return STRINGS.get(lang, STRINGS["en"]).get(key, STRINGS["en"].get(key, key))
+    return _CATALOG.get(lang, _DEFAULT_TABLE).get(key, key)
+
+
+def format_text(lang: str, key: str, **values) -> str:
+    """Get text in the specified language with its placeholders filled in."""
+    template = _TEMPLATES.get(lang, _TEMPLATES[DEFAULT_LANGUAGE]).get(key)
+    return template(**values) if template is not None else key
+
 
 def get_utility_name(lang: str, utility_type: str) -> str:
     """Get utility type name in the specified language."""
@@ -0,0 +1,117 @@
+# resp_server.py - In-process stand-in for a Redis server (RESP2, a handful of commands)
+
+import asyncio
+import time
+from typing import Dict, List, Optional, Set, Tuple
+
+
+class RespServer:
+    """Serves GET, SET (with EX), DEL, TTL, SELECT, AUTH and PING from a dict.
+
+    Good enough for RespStorage and RespClient; `drop_connections()`
+    closes every client connection to exercise reconnects, and `delay`
+    holds back every reply to keep commands in flight.
+    """
+
+    def __init__(self, password: Optional[str] = None):
+        self.password = password
+        self.data: Dict[bytes, Tuple[bytes, Optional[float]]] = {}
+        self.commands: List[List[bytes]] = []
+        self.connections = 0  # accepted so far
+        self.delay = 0.0  # seconds before each reply
+        self.port = 0
+        self._server: Optional[asyncio.AbstractServer] = None
+        self._writers: List[asyncio.StreamWriter] = []
+        self._handlers: Set[asyncio.Task] = set()
+
+    async def start(self) -> "RespServer":
+        self._server = await asyncio.start_server(self._serve, "127.0.0.1", 0)
+        self.port = self._server.sockets[0].getsockname()[1]
+        return self
+
+    @property
+    def url(self) -> str:
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}127.0.0.1:{self.port}/0"
+
+    async def stop(self):
+        self.drop_connections()
+        self._server.close()
+        # Closed transports end the handlers; wait for them before returning
+        await asyncio.gather(*self._handlers, return_exceptions=True)
+        await self._server.wait_closed()
+
+    def drop_connections(self):
+        for writer in self._writers:
+            writer.close()
+        self._writers.clear()
+
+    def _get(self, key: bytes) -> Optional[bytes]:
+        entry = self.data.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at is not None and time.monotonic() >= expires_at:
+            del self.data[key]
+            return None
+        return value
+
+    async def _read_command(self, reader: asyncio.StreamReader) -> Optional[List[bytes]]:
+        line = await reader.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int((await reader.readline())[1:-2])
+            args.append((await reader.readexactly(length + 2))[:-2])
+        return args
+
+    def _execute(self, args: List[bytes], state: dict) -> bytes:
+        command = args[0].upper()
+        if command == b"AUTH":
+            state["authed"] = args[1].decode() == self.password
+            return b"+OK\r\n" if state["authed"] else b"-WRONGPASS invalid password\r\n"
+        if self.password and not state["authed"]:
+            return b"-NOAUTH Authentication required.\r\n"
+        if command in (b"PING", b"SELECT"):
+            return b"+PONG\r\n" if command == b"PING" else b"+OK\r\n"
+        if command == b"GET":
+            value = self._get(args[1])
+            return b"$-1\r\n" if value is None else b"$%d\r\n%s\r\n" % (len(value), value)
+        if command == b"SET":
+            expires_at = None
+            if len(args) == 5 and args[3].upper() == b"EX":
+                expires_at = time.monotonic() + int(args[4])
+            self.data[args[1]] = (args[2], expires_at)
+            return b"+OK\r\n"
+        if command == b"DEL":
+            removed = sum(self.data.pop(key, None) is not None for key in args[1:])
+            return b":%d\r\n" % removed
+        if command == b"TTL":
+            if self._get(args[1]) is None:
+                return b":-2\r\n"
+            expires_at = self.data[args[1]][1]
+            return b":-1\r\n" if expires_at is None else b":%d\r\n" % round(expires_at - time.monotonic())
+        return b"-ERR unknown command '%s'\r\n" % args[0]
+
+    async def _serve(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        self._writers.append(writer)
+        self.connections += 1
+        self._handlers.add(asyncio.current_task())
+        state = {"authed": False}
+        try:
+            while True:
+                args = await self._read_command(reader)
+                if args is None:
+                    break
+                self.commands.append(args)
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                writer.write(self._execute(args, state))
+                await writer.drain()
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            self._handlers.discard(asyncio.current_task())
+            writer.close()
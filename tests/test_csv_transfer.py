@@ -0,0 +1,50 @@
+# test_csv_transfer.py - CSV import validation and export round trip
+
+import asyncio
+
+import database as db
+from csv_transfer import CsvExportFile, import_csv, parse_record
+
+USER_ID = 7
+
+
+async def as_chunks(text: str, size: int = 64):
+    data = text.encode()
+    for start in range(0, len(data), size):
+        yield data[start:start + size]
+
+
+def test_parse_record_rejects_non_finite_amounts():
+    for amount in ("nan", "NaN", "inf", "-inf", "Infinity", "1e999"):
+        assert parse_record(["transaction", "expense", "food", amount, "UZS", "2024-05-01"]) is None
+    assert parse_record(["transaction", "expense", "food", "1 500,5", "uzs", "2024-05-01 10:30"])[3] == 1500.5
+
+
+def test_import_skips_bad_rows_and_exports_the_rest(tmp_path):
+    csv_text = "\n".join([
+        "kind,type,name,amount,currency,date",
+        "transaction,income,salary,1000,UZS,2024-05-01 09:00",
+        "transaction,expense,food,nan,UZS,2024-05-02",
+        "transaction,expense,food,inf,UZS,2024-05-02",
+        "transaction,expense,\"two\nlines\",250,USD,2024-05-03",
+        "utility,electricity,,50000,UZS,2024-05-04",
+        "debt,i_owe,Ali,20,USD,2024-05-05",
+    ])
+
+    async def scenario():
+        await db.init_db(str(tmp_path / "csv.db"))
+        try:
+            # A batch of 2 puts the nan row between committed batches
+            assert await import_csv(USER_ID, as_chunks(csv_text), batch_size=2) == (4, 2)
+            totals = await db.get_transaction_totals(USER_ID)
+            assert sorted(row["total"] for row in totals) == [250, 1000]
+
+            exported = b"".join([chunk async for chunk in CsvExportFile(USER_ID, chunk_size=32).read(None)])
+            lines = exported.decode()
+            assert lines.startswith("kind,type,name,amount,currency,date\n")
+            assert '"two\nlines"' in lines
+            assert "nan" not in lines and "inf" not in lines
+        finally:
+            await db.close_db()
+
+    asyncio.run(scenario())
@@ -0,0 +1,186 @@
+# test_database.py - Data versions and their shared epoch, the month index and the query plans of paged reads
+
+import asyncio
+import os
+import sqlite3
+import subprocess
+import sys
+from contextlib import asynccontextmanager
+from datetime import datetime
+
+import database as db
+from conftest import ROOT
+
+
+def test_versions_grow_and_survive_eviction(tmp_path):
+    async def scenario():
+        await db.init_db(str(tmp_path / "versions.db"), db.DatabaseSettings(data_version_size=2))
+        try:
+            seen = {user_id: await db.get_data_version(user_id) for user_id in (1, 2, 3)}
+            for user_id in (1, 2, 3):
+                await db.add_transaction(user_id, "expense", "food", 100, "UZS")
+                version = await db.get_data_version(user_id)
+                assert version > seen[user_id]
+                seen[user_id] = version
+            # User 1 was evicted by user 3; its version must not go back
+            assert len(db._data_versions) == 2
+            assert await db.get_data_version(1) >= seen[1]
+            assert await db.get_data_version(2) == seen[2]
+        finally:
+            await db.close_db()
+
+    asyncio.run(scenario())
+
+
+def test_rebuild_in_another_process_reaches_running_bot(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DATA_EPOCH_CHECK_INTERVAL", 0)
+
+    async def scenario():
+        await db.init_db(str(tmp_path / db.DATABASE_NAME))
+        try:
+            await db.add_transaction(1, "income", "salary", 1000, "UZS")
+            assert await db.get_months(1, "transaction")
+            before = await db.get_data_version(1)
+            untouched = await db.get_data_version(2)
+
+            subprocess.run(
+                [sys.executable, os.path.join(ROOT, "database.py"), "rebuild-totals"],
+                cwd=tmp_path, check=True, capture_output=True
+            )
+            assert await db.get_data_version(1) > before
+            assert await db.get_data_version(2) > untouched
+            assert len(db._month_index) == 0
+            # Unchanged epoch: versions stay put
+            assert await db.get_data_version(1) == await db.get_data_version(1)
+        finally:
+            await db.close_db()
+
+    asyncio.run(scenario())
+
+
+def test_day_pages_stay_on_ts_index(tmp_path):
+    async def scenario():
+        await db.init_db(str(tmp_path / "pages.db"))
+        try:
+            for amount in range(5):
+                await db.add_transaction(1, "expense", "food", amount, "UZS")
+                await db.add_utility(1, "electricity", amount, "UZS")
+            now = datetime.now()
+            month, day = now.strftime("%Y-%m"), now.day
+            first = await db.get_transactions_page_by_date(1, month, day, limit=2)
+            second = await db.get_transactions_page_by_date(1, month, day, after_id=first[-1]["id"], limit=2)
+            back = await db.get_transactions_page_by_date(1, month, day, before_id=second[0]["id"], limit=2)
+            ids = [row["id"] for row in first + second]
+            assert ids == sorted(ids, reverse=True) and len(set(ids)) == 4
+            assert back == first
+
+            async with db._get_pool().read() as conn:
+                for table in ("transactions", "utilities"):
+                    where = "user_id = ? AND ts BETWEEN ? AND ?"
+                    for cursor in ({}, {"after_id": 3}, {"before_id": 3}):
+                        sql, params = db._page_query(table, where, (1, 0, 1), **cursor, seek_by_id=False)
+                        async with conn.execute("EXPLAIN QUERY PLAN " + sql, params) as rows:
+                            plan = " ".join(row[3] for row in await rows.fetchall())
+                        assert f"idx_{table}_user_ts" in plan, (cursor, plan)
+                    # Whole-history pages seek on the id index
+                    sql, params = db._page_query(table, "user_id = ?", (1,), after_id=3)
+                    async with conn.execute("EXPLAIN QUERY PLAN " + sql, params) as rows:
+                        assert f"idx_{table}_user_id" in " ".join(row[3] for row in await rows.fetchall())
+        finally:
+            await db.close_db()
+
+    asyncio.run(scenario())
+
+
+def at(moment: datetime):
+    """A datetime class whose now() is `moment`, for database.datetime."""
+    class FixedDatetime(datetime):
+        @classmethod
+        def now(cls, tz=None):
+            return moment
+    return FixedDatetime
+
+
+async def distinct_months(user_id: int, kind: str):
+    async with db._get_pool().read() as conn:
+        async with conn.execute(
+            "SELECT DISTINCT month FROM monthly_totals WHERE user_id = ? AND kind = ? ORDER BY month DESC",
+            (user_id, kind)
+        ) as cursor:
+            return [row[0] for row in await cursor.fetchall()]
+
+
+def test_month_index_matches_monthly_totals(tmp_path, monkeypatch):
+    monkeypatch.setattr(db, "DATA_EPOCH_CHECK_INTERVAL", 0)
+    path = str(tmp_path / "months.db")
+
+    async def check(kind: str):
+        assert await db.get_months(1, kind) == await distinct_months(1, kind)
+        # Served from the index, which the inserts kept current
+        assert db._month_index.peek((1, kind)) is not None
+
+    async def scenario():
+        await db.init_db(path)
+        try:
+            assert await db.get_months(1, "transaction") == []
+            assert await db.get_months(1, "utility") == []
+            # Single inserts, out of order, into new and known months
+            for month in (3, 1, 3, 12, 7):
+                monkeypatch.setattr(db, "datetime", at(datetime(2024, month, 5, 10, 0)))
+                await db.add_transaction(1, "expense", "food", 10, "UZS")
+                await check("transaction")
+            await db.add_utility(1, "electricity", 20, "UZS")
+            await check("utility")
+            monkeypatch.setattr(db, "datetime", datetime)
+
+            await db.import_records(1, [
+                ("transaction", "income", "salary", 100, "UZS", datetime(2023, 6, 1, 9, 0)),
+                ("transaction", "expense", "rent", 50, "UZS", datetime(2024, 3, 2, 9, 0)),
+                ("utility", "gas", "", 30, "UZS", datetime(2022, 2, 1, 9, 0)),
+                ("debt", "i_owe", "Friend", 5, "UZS", datetime(2021, 1, 1, 9, 0)),
+            ])
+            await check("transaction")
+            await check("utility")
+            assert await db.get_months(1, "transaction") == [
+                "2024-12", "2024-07", "2024-03", "2024-01", "2023-06"
+            ]
+
+            # Another process drops a month's rows and rebuilds the totals
+            with sqlite3.connect(path) as conn:
+                conn.execute("DELETE FROM transactions WHERE month = '2024-07'")
+                conn.execute("DELETE FROM monthly_totals")
+                conn.execute("INSERT INTO monthly_totals " + db._MONTHLY_TOTALS_SOURCE)
+                conn.execute("UPDATE meta SET value = value + 1 WHERE key = 'data_epoch'")
+            await db.get_data_version(1)
+            assert "2024-07" not in await db.get_months(1, "transaction")
+            await check("transaction")
+            await check("utility")
+        finally:
+            await db.close_db()
+
+    asyncio.run(scenario())
+
+
+def test_month_list_loaded_during_insert_is_not_cached(tmp_path, monkeypatch):
+    async def scenario():
+        await db.init_db(str(tmp_path / "race.db"))
+        try:
+            pool = db._get_pool()
+            read = pool.read
+
+            @asynccontextmanager
+            async def read_then_insert():
+                # The insert commits after the month list was read, before it is cached
+                async with read() as conn:
+                    yield conn
+                monkeypatch.setattr(pool, "read", read)
+                await db.add_transaction(1, "expense", "food", 10, "UZS")
+
+            monkeypatch.setattr(pool, "read", read_then_insert)
+            assert await db.get_months(1, "transaction") == []
+            assert db._month_index.peek((1, "transaction")) is None
+            assert await db.get_months(1, "transaction") == await distinct_months(1, "transaction") != []
+        finally:
+            await db.close_db()
+
+    asyncio.run(scenario())
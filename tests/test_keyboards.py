@@ -0,0 +1,51 @@
+# test_keyboards.py - Paging of the month selection keyboard
+
+import os
+from typing import List, Tuple
+
+# main builds its Bot at import; nothing here talks to Telegram
+os.environ.setdefault("BOT_TOKEN", "123456:TEST")
+os.environ.setdefault("FSM_STORAGE", "memory")
+
+from main import MONTHS_PAGE_SIZE, get_months_keyboard
+
+
+def months(count: int) -> List[str]:
+    """`count` months, newest first, as get_months returns them."""
+    return [f"{2030 - index // 12}-{12 - index % 12:02d}" for index in range(count)]
+
+
+def page(month_list: List[str], number: int) -> Tuple[List[str], List[str]]:
+    """Months shown and navigation callbacks of one keyboard page."""
+    buttons = [button for row in get_months_keyboard(month_list, "monthly", number).inline_keyboard
+               for button in row]
+    shown = [button.text for button in buttons if button.callback_data.startswith("monthly_")]
+    nav = [button.callback_data for button in buttons if button.callback_data.startswith("mpage_")]
+    return shown, nav
+
+
+def test_months_keyboard_pages_at_the_edges():
+    assert MONTHS_PAGE_SIZE > 1
+    assert get_months_keyboard([], "monthly").inline_keyboard == []
+    assert page([], 3) == ([], [])
+
+    # Exactly one page: no navigation
+    full = months(MONTHS_PAGE_SIZE)
+    assert page(full, 0) == (full, [])
+    assert page(full, 1) == (full, [])
+
+    # One month more: the last page holds it alone
+    longer = months(MONTHS_PAGE_SIZE + 1)
+    assert page(longer, 0) == (longer[:MONTHS_PAGE_SIZE], ["mpage_monthly_1"])
+    assert page(longer, 1) == (longer[-1:], ["mpage_monthly_0"])
+    # Out-of-range pages (from an old keyboard) are clamped
+    assert page(longer, 5) == page(longer, 1)
+    assert page(longer, -1) == page(longer, 0)
+
+    three_pages = months(2 * MONTHS_PAGE_SIZE + 3)
+    assert page(three_pages, 1) == (three_pages[MONTHS_PAGE_SIZE:2 * MONTHS_PAGE_SIZE],
+                                    ["mpage_monthly_0", "mpage_monthly_2"])
+    assert page(three_pages, 2) == (three_pages[-3:], ["mpage_monthly_1"])
+    # Two months per row
+    rows = get_months_keyboard(three_pages, "monthly", 2).inline_keyboard
+    assert [len(row) for row in rows] == [2, 1, 1]
@@ -0,0 +1,72 @@
+# test_metrics.py - Prometheus rendering, the merge of per-shard outputs and handler error counting
+
+import asyncio
+import logging
+from types import SimpleNamespace
+
+import pytest
+
+import metrics
+from metrics import Counter, Gauge, Histogram, Registry, merge_expositions
+
+
+def test_merge_labels_samples_and_keeps_headers_once():
+    registry = Registry()
+    counter = registry.register(Counter("jobs_total", "Jobs.", ("handler",)))
+    histogram = registry.register(Histogram("job_seconds", "Job time.", ("handler",), buckets=(0.1,)))
+    registry.register(Gauge("queue", "Queued.", (), lambda: {(): 3}))
+    counter.inc("cmd_start")
+    histogram.observe(0.05, "cmd_start")
+
+    merged = merge_expositions({"front": registry.render(), "0": registry.render()}, "shard").splitlines()
+
+    assert merged.count("# HELP jobs_total Jobs.") == 1
+    assert merged.count("# TYPE job_seconds histogram") == 1
+    assert 'jobs_total{shard="front",handler="cmd_start"} 1' in merged
+    assert 'jobs_total{shard="0",handler="cmd_start"} 1' in merged
+    assert 'job_seconds_bucket{shard="0",handler="cmd_start",le="+Inf"} 1' in merged
+    assert 'queue{shard="front"} 3' in merged
+    # Samples stay under their own metric's header
+    header = merged.index("# TYPE queue gauge")
+    assert merged[header + 1:] == ['queue{shard="front"} 3', 'queue{shard="0"} 3']
+
+
+def test_errors_count_once_per_handler_call():
+    logger = logging.getLogger("test_metrics")
+    counter = metrics.ErrorLogCounter()
+    logger.addHandler(counter)
+    middleware = metrics.HandlerMetricsMiddleware()
+
+    def helper():
+        logger.error("Error in helper")
+
+    async def logs_and_reraises(event, data):
+        helper()
+        logger.error("Error in handler")
+        raise RuntimeError("failed")
+
+    async def logs_in_task(event, data):
+        async def background():
+            helper()
+
+        # Tasks started by a handler inherit its context
+        await asyncio.create_task(background())
+
+    async def call(handler):
+        await middleware(handler, None, {"handler": SimpleNamespace(callback=handler)})
+
+    async def scenario():
+        with pytest.raises(RuntimeError):
+            await call(logs_and_reraises)
+        await call(logs_in_task)
+        helper()  # outside any handler call
+
+    errors = metrics.update_errors_total._values
+    try:
+        asyncio.run(scenario())
+    finally:
+        logger.removeHandler(counter)
+    assert errors.get(("logs_and_reraises",)) == 1
+    assert errors.get(("logs_in_task",)) == 1
+    assert ("helper",) not in errors
+    assert metrics.current_handler.get() is None
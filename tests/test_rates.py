@@ -0,0 +1,134 @@
+# test_rates.py - RatesService against a local stand-in for the CBU API
+
+import asyncio
+from contextlib import asynccontextmanager
+
+import aiohttp
+from aiohttp import web
+
+import database as db
+from rates import DEFAULT_RATES, RatesService
+
+
+def cbu_payload(usd: float = 12650.5, day: str = "15.05.2024") -> list:
+    return [
+        {"id": 69, "Code": "840", "Ccy": "USD", "Rate": str(usd), "Date": day},
+        {"id": 57, "Code": "643", "Ccy": "RUB", "Rate": "138.22", "Date": day},
+        {"id": 15, "Code": "156", "Ccy": "CNY", "Rate": "1748.9", "Date": day},
+        {"id": 21, "Code": "978", "Ccy": "EUR", "Rate": "13700", "Date": day},
+    ]
+
+
+class StandIn:
+    """CBU-shaped JSON server whose responses the test can switch."""
+
+    def __init__(self):
+        self.status = 200
+        self.payload = cbu_payload()
+        self.requests = 0
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.requests += 1
+        if self.status != 200:
+            return web.Response(status=self.status)
+        return web.json_response(self.payload)
+
+
+@asynccontextmanager
+async def serve(stand_in: StandIn):
+    app = web.Application()
+    app.router.add_get("/json/", stand_in.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        yield f"http://{host}:{port}/json/", runner
+    finally:
+        await runner.cleanup()
+
+
+@asynccontextmanager
+async def rates_service(tmp_path, url: str, **kwargs):
+    await db.init_db(str(tmp_path / "rates.db"))
+    session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=2))
+    service = RatesService(url, session=session, **kwargs)
+    try:
+        yield service
+    finally:
+        await service.stop()
+        await session.close()
+        await db.close_db()
+
+
+def test_refresh_updates_snapshot_and_history(tmp_path):
+    async def scenario():
+        stand_in = StandIn()
+        async with serve(stand_in) as (url, _), rates_service(tmp_path, url) as service:
+            assert service.is_stale
+            assert await service.refresh()
+            assert service.rates["USD"] == 12650.5
+            assert service.rates["UZS"] == 1
+            assert "EUR" not in service.rates
+            assert not service.is_stale
+            assert service.rate("RUB", "2024-05-20") == 138.22
+            stored = {(row["date"], row["currency"]) for row in await db.get_all_rates()}
+            assert stored == {("2024-05-15", "USD"), ("2024-05-15", "RUB"), ("2024-05-15", "CNY")}
+
+    asyncio.run(scenario())
+
+
+def test_server_error_keeps_last_known_rates(tmp_path):
+    async def scenario():
+        stand_in = StandIn()
+        async with serve(stand_in) as (url, _), rates_service(tmp_path, url) as service:
+            assert service.rates == DEFAULT_RATES
+            stand_in.status = 500
+            assert not await service.refresh()
+            assert service.rates == DEFAULT_RATES
+
+            stand_in.status = 200
+            assert await service.refresh()
+            stand_in.status = 500
+            stand_in.payload = cbu_payload(usd=1.0)
+            assert not await service.refresh()
+            assert service.rates["USD"] == 12650.5
+
+    asyncio.run(scenario())
+
+
+def test_server_down_keeps_last_known_rates(tmp_path):
+    async def scenario():
+        stand_in = StandIn()
+        async with serve(stand_in) as (url, runner), rates_service(tmp_path, url) as service:
+            assert await service.refresh()
+            await runner.cleanup()
+            assert not await service.refresh()
+            assert service.rates["USD"] == 12650.5
+            assert service.rate("CNY") == 1748.9
+
+    asyncio.run(scenario())
+
+
+def test_failed_fetch_is_retried_after_retry_interval(tmp_path):
+    async def scenario():
+        stand_in = StandIn()
+        stand_in.status = 500
+        async with serve(stand_in) as (url, _), \
+                rates_service(tmp_path, url, ttl=60, retry_interval=0.05) as service:
+            service.start(service._session)
+            await asyncio.sleep(0.2)
+            # Failing fetches are retried every retry_interval, not every ttl
+            assert stand_in.requests >= 3
+            assert service.rates == DEFAULT_RATES
+
+            stand_in.status = 200
+            await asyncio.sleep(0.2)
+            assert service.rates["USD"] == 12650.5
+            # After a success the next fetch waits for the ttl
+            requests = stand_in.requests
+            await asyncio.sleep(0.2)
+            assert stand_in.requests == requests
+
+    asyncio.run(scenario())
@@ -0,0 +1,110 @@
+# test_scheduler.py - UpdateScheduler: per-user ordering, the concurrency bound and dropped updates
+
+import asyncio
+from typing import List, Tuple
+
+import pytest
+from aiogram.fsm.storage.base import StorageKey
+
+from scheduler import UpdateDropped, UpdateScheduler
+
+
+def key(user_id: int) -> StorageKey:
+    return StorageKey(bot_id=1, chat_id=user_id, user_id=user_id)
+
+
+def test_orders_one_user_and_runs_users_in_parallel():
+    async def scenario():
+        scheduler = UpdateScheduler(max_concurrency=10, max_pending_per_user=10)
+        log: List[Tuple[str, int, int]] = []
+
+        async def update(user_id: int, index: int, duration: float):
+            async with scheduler.lock(key(user_id)):
+                log.append(("start", user_id, index))
+                await asyncio.sleep(duration)
+                log.append(("end", user_id, index))
+
+        # User 1's first update is the slowest; its later ones must still wait for it
+        await asyncio.gather(*(update(1, index, 0.05 if index == 0 else 0.01) for index in range(4)),
+                             update(2, 0, 0.01))
+        user_1 = [(event, index) for event, user_id, index in log if user_id == 1]
+        assert user_1 == [(event, index) for index in range(4) for event in ("start", "end")]
+        # User 2 ran while user 1's first update was still going
+        assert log.index(("end", 2, 0)) < log.index(("end", 1, 0))
+
+    asyncio.run(scenario())
+
+
+def test_enforces_max_concurrency():
+    async def scenario():
+        scheduler = UpdateScheduler(max_concurrency=3, max_pending_per_user=10)
+        peak = 0
+
+        async def update(user_id: int):
+            nonlocal peak
+            async with scheduler.lock(key(user_id)):
+                peak = max(peak, scheduler.active)
+                await asyncio.sleep(0.01)
+
+        await asyncio.gather(*(update(user_id) for user_id in range(12)))
+        assert peak == 3
+        assert scheduler.active == 0
+
+    asyncio.run(scenario())
+
+
+def test_drops_updates_over_user_limit_and_cleans_up():
+    async def scenario():
+        scheduler = UpdateScheduler(max_concurrency=10, max_pending_per_user=2)
+        release = asyncio.Event()
+
+        async def update():
+            async with scheduler.lock(key(1)):
+                await release.wait()
+
+        running = [asyncio.create_task(update()) for _ in range(2)]
+        await asyncio.sleep(0)
+        assert scheduler.queue_depth(key(1)) == 2
+        with pytest.raises(UpdateDropped):
+            async with scheduler.lock(key(1)):
+                pass
+        # Other users are not affected by user 1's backlog
+        async with scheduler.lock(key(2)):
+            pass
+        assert scheduler.dropped == 1
+
+        release.set()
+        await asyncio.gather(*running)
+        assert scheduler._pending == {}
+        assert scheduler._locks == {}
+        # Once the backlog has drained, the user's updates are accepted again
+        async with scheduler.lock(key(1)):
+            pass
+
+    asyncio.run(scenario())
+
+
+def test_stats_count_active_and_waiting_updates():
+    async def scenario():
+        scheduler = UpdateScheduler(max_concurrency=2, max_pending_per_user=3)
+        assert scheduler.stats() == {"active": 0, "waiting": 0, "users": 0, "max_user_depth": 0, "dropped": 0}
+        release = asyncio.Event()
+
+        async def update(user_id: int):
+            async with scheduler.lock(key(user_id)):
+                await release.wait()
+
+        # User 1: one running, two queued behind it; users 2 and 3: one each,
+        # of which one runs and one waits for a concurrency slot
+        tasks = [asyncio.create_task(update(user_id)) for user_id in (1, 1, 1, 2, 3)]
+        await asyncio.sleep(0)
+        with pytest.raises(UpdateDropped):
+            async with scheduler.lock(key(1)):
+                pass
+        assert scheduler.stats() == {"active": 2, "waiting": 3, "users": 3, "max_user_depth": 3, "dropped": 1}
+
+        release.set()
+        await asyncio.gather(*tasks)
+        assert scheduler.stats() == {"active": 0, "waiting": 0, "users": 0, "max_user_depth": 0, "dropped": 1}
+
+    asyncio.run(scenario())
@@ -0,0 +1,155 @@
+# test_send_limiter.py - SendLimiter against a local Bot API stand-in that enforces send limits
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict, List, Set, Tuple
+
+from aiogram import Bot
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiohttp import web
+
+from send_limiter import SendLimiter, bulk_sends
+
+TOKEN = "42:TEST"
+
+
+class FakeBotApi:
+    """sendMessage endpoint answering 429 to a chat sent to faster than `chat_interval`
+    or to any request beyond `global_limit` per second overall."""
+
+    def __init__(self, chat_interval: float = 0.0, global_limit: int = 0, retry_after: int = 1):
+        self.chat_interval = chat_interval
+        self.global_limit = global_limit
+        self.retry_after = retry_after
+        self.reject_once: Set[int] = set()  # chats whose first message gets a 429
+        self.sent: List[Tuple[float, int, str]] = []  # (time, chat_id, text) of accepted messages
+        self.rejected = 0
+        self._last_sent: Dict[int, float] = {}
+
+    def _over_limit(self, now: float, chat_id: int) -> bool:
+        if chat_id in self.reject_once:
+            self.reject_once.discard(chat_id)
+            return True
+        if self.chat_interval and now - self._last_sent.get(chat_id, -1e9) < self.chat_interval:
+            return True
+        recent = sum(1 for sent_at, _, _ in self.sent if now - sent_at < 1)
+        return bool(self.global_limit) and recent >= self.global_limit
+
+    async def handle(self, request: web.Request) -> web.Response:
+        form = await request.post()
+        chat_id = int(form["chat_id"])
+        now = time.monotonic()
+        if self._over_limit(now, chat_id):
+            self.rejected += 1
+            return web.json_response({
+                "ok": False, "error_code": 429,
+                "description": f"Too Many Requests: retry after {self.retry_after}",
+                "parameters": {"retry_after": self.retry_after},
+            }, status=429)
+        self._last_sent[chat_id] = now
+        self.sent.append((now, chat_id, form["text"]))
+        return web.json_response({"ok": True, "result": {
+            "message_id": len(self.sent), "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"}, "text": form["text"],
+        }})
+
+
+@asynccontextmanager
+async def limited_bot(api: FakeBotApi, limiter: SendLimiter):
+    app = web.Application()
+    app.router.add_post("/bot{token}/{method}", api.handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    bot = Bot(TOKEN, session=AiohttpSession(api=TelegramAPIServer.from_base(f"http://{host}:{port}")))
+    bot.session.middleware(limiter)
+    try:
+        yield bot
+    finally:
+        await bot.session.close()
+        await runner.cleanup()
+
+
+def test_paces_messages_to_one_chat():
+    async def scenario():
+        # The stand-in allows some jitter between the limiter's sends and their arrival
+        api = FakeBotApi(chat_interval=0.05)
+        limiter = SendLimiter(global_rate=1000, chat_rate=10, chat_burst=1)
+        async with limited_bot(api, limiter) as bot:
+            start = time.monotonic()
+            await asyncio.gather(*(bot.send_message(1, f"m{i}") for i in range(5)))
+            assert time.monotonic() - start >= 0.38
+            # Other chats have their own buckets
+            start = time.monotonic()
+            await asyncio.gather(*(bot.send_message(chat_id, "hi") for chat_id in range(2, 7)))
+            assert time.monotonic() - start < 0.3
+        assert api.rejected == 0
+        assert limiter.retries == 0
+
+    asyncio.run(scenario())
+
+
+def test_paces_messages_globally():
+    async def scenario():
+        api = FakeBotApi(global_limit=10)
+        limiter = SendLimiter(global_rate=9, chat_rate=1000, chat_burst=1000)
+        async with limited_bot(api, limiter) as bot:
+            start = time.monotonic()
+            await asyncio.gather(*(bot.send_message(chat_id, "hi") for chat_id in range(19)))
+            assert time.monotonic() - start >= 1.9
+        assert len(api.sent) == 19
+        assert api.rejected == 0
+
+    asyncio.run(scenario())
+
+
+def test_retries_after_flood_control():
+    async def scenario():
+        api = FakeBotApi(retry_after=1)
+        api.reject_once.add(7)
+        limiter = SendLimiter()
+        async with limited_bot(api, limiter) as bot:
+            start = time.monotonic()
+            message = await bot.send_message(7, "hello")
+            assert time.monotonic() - start >= 1
+        assert message.text == "hello"
+        assert api.rejected == 1
+        assert limiter.retries == 1
+
+    asyncio.run(scenario())
+
+
+def test_bulk_waits_only_for_interactive_held_by_global_bucket():
+    async def bulk(bot: Bot, chat_id: int, text: str):
+        with bulk_sends():
+            await bot.send_message(chat_id, text)
+
+    async def scenario():
+        api = FakeBotApi()
+        # A chat throttled on its own bucket does not hold back bulk sends elsewhere
+        limiter = SendLimiter(global_rate=1000, chat_rate=1, chat_burst=1)
+        async with limited_bot(api, limiter) as bot:
+            await bot.send_message(1, "first")
+            interactive = asyncio.create_task(bot.send_message(1, "second"))
+            await asyncio.sleep(0.05)
+            start = time.monotonic()
+            await bulk(bot, 2, "bulk")
+            assert time.monotonic() - start < 0.3
+            await interactive
+
+        # With the global bucket empty, interactive sends go first
+        api = FakeBotApi()
+        limiter = SendLimiter(global_rate=5, chat_rate=1000, chat_burst=1000)
+        async with limited_bot(api, limiter) as bot:
+            await bot.send_message(0, "fill")
+            queued = [asyncio.create_task(bulk(bot, 10 + i, "bulk")) for i in range(2)]
+            await asyncio.sleep(0.01)
+            queued += [asyncio.create_task(bot.send_message(20 + i, "interactive")) for i in range(2)]
+            await asyncio.gather(*queued)
+        assert [text for _, _, text in api.sent[1:]] == ["interactive", "interactive", "bulk", "bulk"]
+
+    asyncio.run(scenario())
@@ -0,0 +1,65 @@
+# test_sharding.py - ShardRouter routing and restart of dead worker processes
+
+import os
+import time
+
+from sharding import ShardRouter, update_user_id
+
+
+def record_worker(index: int, queue):
+    """Shard worker that appends each update_id to the update's `log` file."""
+    while True:
+        update = queue.get()
+        if update is None:
+            return
+        if update.get("crash"):
+            os._exit(3)
+        with open(update["log"], "a") as log:
+            log.write(f"{index}:{update['update_id']}\n")
+
+
+def make_update(update_id: int, user_id: int, log: str, **extra) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": user_id}}, "log": log, **extra}
+
+
+def read_log(path, lines: int, timeout: float = 30) -> list:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if path.exists() and len(path.read_text().splitlines()) >= lines:
+            return path.read_text().splitlines()
+        time.sleep(0.05)
+    raise AssertionError(f"workers did not log {lines} updates in time")
+
+
+def test_update_user_id():
+    assert update_user_id({"update_id": 1, "message": {"from": {"id": 7}, "chat": {"id": 8}}}) == 7
+    assert update_user_id({"update_id": 1, "poll": {"id": "x"}}) is None
+
+
+def test_routes_users_to_fixed_workers(tmp_path):
+    log = tmp_path / "log"
+    router = ShardRouter(2, record_worker)
+    router.start()
+    try:
+        for update_id, user_id in enumerate((10, 11, 12, 13), 1):
+            router.route(make_update(update_id, user_id, str(log)))
+        assert sorted(read_log(log, 4)) == ["0:1", "0:3", "1:2", "1:4"]
+    finally:
+        router.stop()
+    assert router.routed == [2, 2]
+
+
+def test_dead_worker_is_restarted(tmp_path):
+    log = tmp_path / "log"
+    router = ShardRouter(1, record_worker)
+    router.start()
+    try:
+        router.route(make_update(1, 5, str(log), crash=True))
+        router._processes[0].join(30)
+        assert router._processes[0].exitcode == 3
+
+        router.route(make_update(2, 5, str(log)))
+        assert read_log(log, 1) == ["0:2"]
+        assert router.restarts == [1]
+    finally:
+        router.stop()
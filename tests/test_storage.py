@@ -0,0 +1,205 @@
+# test_storage.py - FSM storage backends: SQLite with write batching, RESP against a stand-in
+
+import asyncio
+import time
+
+import pytest
+from aiogram.fsm.state import State, StatesGroup
+from aiogram.fsm.storage.base import StorageKey
+
+import database as db
+from resp_server import RespServer
+from storage import RespClient, RespStorage, SQLiteStorage
+
+KEY = StorageKey(bot_id=1, chat_id=42, user_id=42)
+
+
+class Form(StatesGroup):
+    amount = State()
+
+
+# ===================== RESP =====================
+
+def run_resp(scenario, password=None, pool_size=4):
+    async def wrapper():
+        server = await RespServer(password).start()
+        client = RespClient.from_url(server.url, pool_size)
+        try:
+            await scenario(server, client)
+        finally:
+            await client.close()
+            await server.stop()
+
+    asyncio.run(wrapper())
+
+
+def test_resp_storage_round_trip():
+    async def scenario(server, client):
+        storage = RespStorage(client, ttl=60)
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_data(KEY) == {}
+        await storage.set_state(KEY, Form.amount)
+        await storage.set_data(KEY, {"language": "uz", "amount": 1.5})
+        assert await storage.get_state(KEY) == "Form:amount"
+        assert await storage.get_data(KEY) == {"language": "uz", "amount": 1.5}
+
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_data(KEY) == {}
+        # Clearing deletes the keys instead of storing empty values
+        assert server.data == {}
+
+    run_resp(scenario)
+
+
+def test_resp_storage_sets_expiry():
+    async def scenario(server, client):
+        storage = RespStorage(client, ttl=1)
+        await storage.set_state(KEY, Form.amount)
+        key = storage.key_builder.build(KEY, "state")
+        assert await client.execute("TTL", key) == 1
+        await asyncio.sleep(1.05)
+        assert await storage.get_state(KEY) is None
+
+        await RespStorage(client, ttl=0).set_state(KEY, Form.amount)
+        assert await client.execute("TTL", key) == -1
+
+    run_resp(scenario)
+
+
+def test_resp_client_authenticates_and_reconnects():
+    async def scenario(server, client):
+        assert await client.execute("PING") == "PONG"
+        server.drop_connections()
+        with pytest.raises(ConnectionError):
+            await client.execute("PING")
+        # The next command opens a new connection and authenticates again
+        assert await client.execute("PING") == "PONG"
+        assert [command[0] for command in server.commands].count(b"AUTH") == 2
+
+    run_resp(scenario, password="secret")
+
+
+def test_resp_client_raises_server_errors():
+    async def scenario(server, client):
+        with pytest.raises(RuntimeError, match="unknown command"):
+            await client.execute("FLUSHALL")
+
+    run_resp(scenario)
+
+
+def test_resp_client_drops_connection_of_cancelled_command():
+    async def scenario(server, client):
+        await client.execute("SET", "a", "AAA")
+        await client.execute("SET", "b", "BBB")
+        server.delay = 0.2
+        pending = asyncio.create_task(client.execute("GET", "a"))
+        await asyncio.sleep(0.05)
+        pending.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await pending
+        server.delay = 0
+        # The late reply to GET a must not answer GET b
+        assert await client.execute("GET", "b") == b"BBB"
+        assert await client.execute("GET", "a") == b"AAA"
+        assert server.connections == 2
+
+    run_resp(scenario, pool_size=1)
+
+
+def test_resp_client_runs_commands_on_a_bounded_pool():
+    async def scenario(server, client):
+        server.delay = 0.2
+        start = time.monotonic()
+        replies = await asyncio.gather(*(client.execute("PING") for _ in range(8)))
+        elapsed = time.monotonic() - start
+        assert replies == ["PONG"] * 8
+        # 8 commands on 4 connections: two rounds, not eight
+        assert 0.4 <= elapsed < 0.8
+        assert server.connections == 4
+
+    run_resp(scenario, pool_size=4)
+
+
+# ===================== SQLITE =====================
+
+def run_sqlite(tmp_path, scenario):
+    async def wrapper():
+        await db.init_db(str(tmp_path / "fsm.db"))
+        try:
+            await scenario()
+        finally:
+            await db.close_db()
+
+    asyncio.run(wrapper())
+
+
+def test_sqlite_storage_batches_and_persists(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(flush_interval=0.05)
+        await storage.set_state(KEY, Form.amount)
+        await storage.set_data(KEY, {"language": "ru"})
+        assert await db.get_fsm_record(storage.key_builder.build(KEY)) is None
+        await asyncio.sleep(0.15)
+        row = await db.get_fsm_record(storage.key_builder.build(KEY))
+        assert row["state"] == "Form:amount"
+
+        # A fresh instance (e.g. after a restart) reads what was flushed
+        restarted = SQLiteStorage()
+        assert await restarted.get_state(KEY) == "Form:amount"
+        assert await restarted.get_data(KEY) == {"language": "ru"}
+        await storage.close()
+        await restarted.close()
+
+    run_sqlite(tmp_path, scenario)
+
+
+def test_sqlite_storage_flushes_full_batch_at_once(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(flush_interval=60, batch_size=3)
+        for chat_id in range(3):
+            await storage.set_state(StorageKey(bot_id=1, chat_id=chat_id, user_id=chat_id), Form.amount)
+        await asyncio.sleep(0.05)
+        assert not storage._dirty
+        await storage.close()
+
+    run_sqlite(tmp_path, scenario)
+
+
+def test_sqlite_storage_retries_failed_flush(tmp_path, monkeypatch):
+    async def scenario():
+        failures = []
+        save = db.save_fsm_records
+
+        async def flaky_save(records, deleted):
+            if not failures:
+                failures.append(records)
+                raise RuntimeError("database is locked")
+            await save(records, deleted)
+
+        monkeypatch.setattr(db, "save_fsm_records", flaky_save)
+        storage = SQLiteStorage(flush_interval=0.05)
+        await storage.set_data(KEY, {"language": "en"})
+        # No further writes: the retry must come from the flush task itself
+        await asyncio.sleep(0.3)
+        assert failures
+        assert not storage._dirty
+        assert (await db.get_fsm_record(storage.key_builder.build(KEY)))["data"] == '{"language": "en"}'
+        await storage.close()
+
+    run_sqlite(tmp_path, scenario)
+
+
+def test_sqlite_storage_expires_stale_records(tmp_path):
+    async def scenario():
+        storage = SQLiteStorage(ttl=60)
+        await storage.set_state(KEY, Form.amount)
+        key = storage.key_builder.build(KEY)
+        state, data, _ = storage._records.peek(key)
+        storage._records.set(key, (state, data, time.time() - 120))
+        storage._dirty.clear()
+        assert await storage.get_state(KEY) is None
+        await storage.close()
+
+    run_sqlite(tmp_path, scenario)
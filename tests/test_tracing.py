@@ -0,0 +1,214 @@
+# test_tracing.py - Sampling, span nesting and export of traces, against a local OTLP collector stand-in
+
+import asyncio
+import json
+from contextlib import asynccontextmanager
+from types import SimpleNamespace
+from typing import Any, Dict, List
+
+import aiohttp
+import pytest
+from aiohttp import web
+
+import tracing
+from tracing import CollectorExporter, JsonLinesExporter, Span, Tracer
+
+
+class MemoryExporter:
+    def __init__(self):
+        self.spans: List[Span] = []
+
+    async def export(self, spans: List[Span]):
+        self.spans.extend(spans)
+
+
+class FakeCollector:
+    """OTLP/HTTP endpoint keeping every JSON payload POSTed to /v1/traces,
+    with a /rates endpoint standing in for an outbound API."""
+
+    def __init__(self):
+        self.payloads: List[Dict[str, Any]] = []
+        self.status = 200
+
+    async def handle(self, request: web.Request) -> web.Response:
+        self.payloads.append(await request.json())
+        return web.json_response({}, status=self.status)
+
+    async def rates(self, request: web.Request) -> web.Response:
+        return web.json_response({"USD": 12500})
+
+
+@asynccontextmanager
+async def running_collector(collector: FakeCollector):
+    app = web.Application()
+    app.router.add_post("/v1/traces", collector.handle)
+    app.router.add_get("/rates", collector.rates)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    host, port = runner.addresses[0][:2]
+    try:
+        yield f"http://{host}:{port}"
+    finally:
+        await runner.cleanup()
+
+
+def update_event(update_id: int = 1):
+    """What UpdateTracingMiddleware reads from an update and its data."""
+    return SimpleNamespace(update_id=update_id, event_type="message"), {"event_from_user": SimpleNamespace(id=42)}
+
+
+def test_sampling_at_zero_and_one():
+    async def scenario():
+        for rate, expected in ((0.0, 0), (1.0, 50)):
+            tracer = Tracer(rate, flush_interval=60)
+            exporter = MemoryExporter()
+            tracer.start(exporter)
+            middleware = tracing.UpdateTracingMiddleware(tracer)
+            roots = []
+
+            async def handler(event, data):
+                roots.append(tracing.current_span.get())
+                # Child spans exist only inside a sampled trace
+                with tracer.span("db query") as child:
+                    assert (child is None) == (rate == 0)
+
+            for update_id in range(50):
+                await middleware(handler, *update_event(update_id))
+            await tracer.stop()
+            assert sum(root is not None for root in roots) == expected
+            assert len(exporter.spans) == 2 * expected
+
+    asyncio.run(scenario())
+
+
+def test_spans_nest_under_one_trace():
+    async def scenario():
+        tracer = Tracer(1.0, flush_interval=60)
+        exporter = MemoryExporter()
+        tracer.start(exporter)
+
+        async def get_balance(user_id: int) -> float:
+            return 100.0
+
+        async def get_state(key: str) -> str:
+            return "Form:amount"
+
+        db = SimpleNamespace(get_balance=get_balance)
+        fsm = SimpleNamespace(get_state=get_state)
+        tracing.instrument(tracer, db, "db", ["get_balance"])
+        tracing.instrument(tracer, fsm, "fsm", ["get_state"])
+
+        async with running_collector(FakeCollector()) as url:
+            async with aiohttp.ClientSession(trace_configs=[tracing.http_trace_config(tracer)]) as session:
+                async def cmd_balance(event, data):
+                    await fsm.get_state("42")
+                    await db.get_balance(42)
+                    async with session.get(f"{url}/rates") as response:
+                        await response.json()
+
+                async def handle_update(event, data):
+                    handler_data = {**data, "handler": SimpleNamespace(callback=cmd_balance)}
+                    await tracing.HandlerTracingMiddleware(tracer)(cmd_balance, event, handler_data)
+
+                await tracing.UpdateTracingMiddleware(tracer)(handle_update, *update_event())
+                # Requests outside a trace make no span
+                async with session.get(f"{url}/rates"):
+                    pass
+        await tracer.stop()
+
+        spans = {span.name: span for span in exporter.spans}
+        assert sorted(spans) == ["db get_balance", "fsm get_state", "handler cmd_balance", "http GET", "update"]
+        root, handler = spans["update"], spans["handler cmd_balance"]
+        assert {span.trace_id for span in spans.values()} == {root.trace_id}
+        assert root.parent_id is None and root.kind == tracing.KIND_SERVER
+        assert root.attributes == {"update_id": 1, "type": "message", "user_id": 42}
+        assert handler.parent_id == root.span_id
+        for name in ("db get_balance", "fsm get_state", "http GET"):
+            assert spans[name].parent_id == handler.span_id
+            assert handler.start <= spans[name].start <= spans[name].end <= handler.end
+        assert spans["http GET"].kind == tracing.KIND_CLIENT
+        assert spans["http GET"].attributes["path"] == "/rates"
+        assert spans["http GET"].attributes["status"] == 200
+
+    asyncio.run(scenario())
+
+
+def test_json_lines_exporter_writes_one_object_per_span(tmp_path):
+    path = tmp_path / "traces.jsonl"
+
+    async def scenario():
+        tracer = Tracer(1.0, flush_interval=60)
+        tracer.start(JsonLinesExporter(str(path)))
+        with tracer.trace("update", user_id=42):
+            with pytest.raises(ValueError):
+                with tracer.span("db add_transaction", amount=1.5):
+                    raise ValueError("bad amount")
+        await tracer.stop()
+        assert tracer.stats() == {"buffered": 0, "exported": 2, "dropped": 0}
+
+    asyncio.run(scenario())
+    child, root = [json.loads(line) for line in path.read_text(encoding="utf-8").splitlines()]
+    assert root["name"] == "update" and root["parent_id"] is None and root["error"] is None
+    assert root["attributes"] == {"user_id": 42}
+    assert child["name"] == "db add_transaction"
+    assert child["trace_id"] == root["trace_id"] and child["parent_id"] == root["span_id"]
+    assert child["attributes"] == {"amount": 1.5}
+    assert child["error"] == "ValueError: bad amount"
+    assert child["duration_ms"] >= 0
+
+
+def test_collector_exporter_posts_otlp_json():
+    async def scenario():
+        collector = FakeCollector()
+        async with running_collector(collector) as url, aiohttp.ClientSession() as session:
+            tracer = Tracer(1.0, flush_interval=60)
+            tracer.start(CollectorExporter(f"{url}/v1/traces", session))
+            with tracer.trace("update", update_id=7, type="message"):
+                with tracer.span("fsm get_state", ok=True):
+                    pass
+            await tracer.flush()
+            assert tracer.stats() == {"buffered": 0, "exported": 2, "dropped": 0}
+
+            # A failing collector drops the batch instead of keeping it forever
+            collector.status = 500
+            with tracer.trace("update"):
+                pass
+            await tracer.stop()
+            assert tracer.stats() == {"buffered": 0, "exported": 2, "dropped": 1}
+
+        resource_spans = collector.payloads[0]["resourceSpans"]
+        assert resource_spans[0]["resource"]["attributes"] == [
+            {"key": "service.name", "value": {"stringValue": tracing.SERVICE_NAME}}
+        ]
+        child, root = resource_spans[0]["scopeSpans"][0]["spans"]
+        assert root["name"] == "update" and root["kind"] == tracing.KIND_SERVER
+        assert "parentSpanId" not in root
+        assert root["attributes"] == [
+            {"key": "update_id", "value": {"intValue": "7"}},
+            {"key": "type", "value": {"stringValue": "message"}},
+        ]
+        assert child["traceId"] == root["traceId"] and child["parentSpanId"] == root["spanId"]
+        assert child["attributes"] == [{"key": "ok", "value": {"boolValue": True}}]
+        assert len(root["traceId"]) == 32 and len(root["spanId"]) == 16
+        assert int(root["startTimeUnixNano"]) <= int(child["startTimeUnixNano"])
+        assert int(child["endTimeUnixNano"]) <= int(root["endTimeUnixNano"])
+
+    asyncio.run(scenario())
+
+
+def test_full_buffer_drops_oldest_spans():
+    async def scenario():
+        tracer = Tracer(1.0, buffer_size=3, flush_interval=60)
+        exporter = MemoryExporter()
+        tracer.start(exporter)
+        for update_id in range(5):
+            with tracer.trace("update", update_id=update_id):
+                pass
+        assert tracer.stats() == {"buffered": 3, "exported": 0, "dropped": 2}
+        await tracer.stop()
+        assert [span.attributes["update_id"] for span in exporter.spans] == [2, 3, 4]
+        assert tracer.stats() == {"buffered": 0, "exported": 3, "dropped": 2}
+
+    asyncio.run(scenario())
@@ -0,0 +1,336 @@
+# tracing.py - Lightweight spans per update, exported as JSON lines or OTLP/JSON
+
+import asyncio
+import functools
+import inspect
+import json
+import logging
+import random
+import time
+from collections import deque
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterable, Iterator, List, Optional
+
+import aiohttp
+from aiogram import BaseMiddleware, Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware, NextRequestMiddlewareType
+from aiogram.methods import TelegramMethod
+from aiogram.methods.base import Response, TelegramType
+from aiogram.types import TelegramObject, Update
+
+SERVICE_NAME = "smartbalance"
+BUFFER_SIZE = 10000  # finished spans kept for export; the oldest are dropped beyond it
+FLUSH_INTERVAL = 5.0
+
+# OTLP span kinds
+KIND_INTERNAL = 1
+KIND_SERVER = 2
+KIND_CLIENT = 3
+
+current_span: ContextVar[Optional["Span"]] = ContextVar("current_span", default=None)
+
+logger = logging.getLogger(__name__)
+
+
+class Span:
+    """One timed operation of a trace."""
+
+    __slots__ = ("trace_id", "span_id", "parent_id", "name", "kind", "attributes", "start", "end", "error")
+
+    def __init__(self, name: str, trace_id: str, parent_id: Optional[str] = None,
+                 kind: int = KIND_INTERNAL, attributes: Optional[Dict[str, Any]] = None):
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes or {}
+        self.start = time.time_ns()
+        self.end = 0
+        self.error: Optional[str] = None
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "name": self.name,
+            "start": self.start / 1e9,
+            "duration_ms": round((self.end - self.start) / 1e6, 3),
+            "attributes": self.attributes,
+            "error": self.error,
+        }
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span = {
+            "traceId": self.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start),
+            "endTimeUnixNano": str(self.end),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.error is not None:
+            span["status"] = {"code": 2, "message": self.error}
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+# ===================== EXPORTERS =====================
+
+class JsonLinesExporter:
+    """Appends one JSON object per span to a file."""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _write(self, text: str):
+        # One write per batch keeps lines from several processes apart
+        with open(self.path, "a", encoding="utf-8") as file:
+            file.write(text)
+
+    async def export(self, spans: List[Span]):
+        text = "".join(json.dumps(span.to_dict(), ensure_ascii=False, default=str) + "\n" for span in spans)
+        await asyncio.get_running_loop().run_in_executor(None, self._write, text)
+
+
+class CollectorExporter:
+    """POSTs spans as OTLP/JSON, e.g. to http://localhost:4318/v1/traces."""
+
+    def __init__(self, url: str, session: aiohttp.ClientSession):
+        self.url = url
+        self.session = session
+
+    async def export(self, spans: List[Span]):
+        payload = {"resourceSpans": [{
+            "resource": {"attributes": [_otlp_attribute("service.name", SERVICE_NAME)]},
+            "scopeSpans": [{"scope": {"name": __name__}, "spans": [span.to_otlp() for span in spans]}],
+        }]}
+        async with self.session.post(self.url, json=payload) as response:
+            response.raise_for_status()
+
+
+# ===================== TRACER =====================
+
+class Tracer:
+    """Samples whole updates and collects their spans for export.
+
+    The sampling decision is made once per trace: `sample_rate` of root
+    spans are recorded, and child spans are only created inside a sampled
+    trace, so unsampled updates cost one random() call. Finished spans
+    are buffered and handed to the exporter every `flush_interval` seconds.
+    """
+
+    def __init__(self, sample_rate: float = 0.0, buffer_size: int = BUFFER_SIZE,
+                 flush_interval: float = FLUSH_INTERVAL):
+        self.sample_rate = sample_rate
+        self.flush_interval = flush_interval
+        self.exporter = None
+        self.exported = 0
+        self.dropped = 0
+        self._buffer: deque = deque(maxlen=buffer_size)
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 and self.exporter is not None
+
+    def start(self, exporter):
+        """Begin exporting; without an exporter tracing stays off."""
+        self.exporter = exporter
+        if self.enabled:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Tracing {self.sample_rate:.0%} of updates to {type(exporter).__name__}")
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+            await self.flush()
+        self.exporter = None
+
+    async def _run(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            await self.flush()
+
+    async def flush(self):
+        if not self._buffer or self.exporter is None:
+            return
+        spans = list(self._buffer)
+        self._buffer.clear()
+        try:
+            await self.exporter.export(spans)
+            self.exported += len(spans)
+        except Exception as e:
+            self.dropped += len(spans)
+            logger.error(f"Error exporting {len(spans)} spans: {e}")
+
+    def start_span(self, name: str, kind: int = KIND_INTERNAL, **attributes) -> Optional[Span]:
+        """A child of the current span, or None outside a sampled trace; not made current."""
+        parent = current_span.get()
+        if parent is None:
+            return None
+        return Span(name, parent.trace_id, parent.span_id, kind, attributes)
+
+    def finish(self, span: Span, error: Optional[BaseException] = None):
+        span.end = time.time_ns()
+        if error is not None:
+            span.error = f"{type(error).__name__}: {error}"
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(span)
+
+    @contextmanager
+    def _activate(self, span: Span) -> Iterator[Span]:
+        token = current_span.set(span)
+        try:
+            yield span
+        except BaseException as e:
+            self.finish(span, e)
+            raise
+        else:
+            self.finish(span)
+        finally:
+            current_span.reset(token)
+
+    @contextmanager
+    def trace(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """Open a root span if this trace is sampled; yields None otherwise."""
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield None
+            return
+        span = Span(name, f"{random.getrandbits(128):032x}", kind=KIND_SERVER, attributes=attributes)
+        with self._activate(span):
+            yield span
+
+    @contextmanager
+    def span(self, name: str, kind: int = KIND_INTERNAL, **attributes) -> Iterator[Optional[Span]]:
+        """Open a child of the current span; a no-op outside a sampled trace."""
+        span = self.start_span(name, kind, **attributes)
+        if span is None:
+            yield None
+            return
+        with self._activate(span):
+            yield span
+
+    def stats(self) -> Dict[str, int]:
+        return {"buffered": len(self._buffer), "exported": self.exported, "dropped": self.dropped}
+
+
+# ===================== INSTRUMENTATION =====================
+
+class UpdateTracingMiddleware(BaseMiddleware):
+    """Outer update middleware opening the root span of each sampled update.
+
+    It runs after the dispatcher's own middlewares, so the span starts once
+    the update holds its user's scheduler slot and FSM state is loaded.
+    """
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        if not self.tracer.enabled:
+            return await handler(event, data)
+        user = data.get("event_from_user")
+        with self.tracer.trace("update", update_id=event.update_id, type=event.event_type,
+                               user_id=user.id if user else 0):
+            return await handler(event, data)
+
+
+class HandlerTracingMiddleware(BaseMiddleware):
+    """Inner router middleware wrapping the handler call in a span named after it."""
+
+    def __init__(self, tracer: Tracer, resolve_name: Optional[Callable[[Dict[str, Any]], Optional[str]]] = None):
+        self.tracer = tracer
+        self.resolve_name = resolve_name
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        if current_span.get() is None:
+            return await handler(event, data)
+        name = (self.resolve_name and self.resolve_name(data)) or data["handler"].callback.__name__
+        with self.tracer.span(f"handler {name}"):
+            return await handler(event, data)
+
+
+class TelegramTracingMiddleware(BaseRequestMiddleware):
+    """Bot session middleware with a span per Bot API call, send limiter waits included."""
+
+    def __init__(self, tracer: Tracer):
+        self.tracer = tracer
+
+    async def __call__(self, make_request: NextRequestMiddlewareType[TelegramType], bot: Bot,
+                       method: TelegramMethod[TelegramType]) -> Response[TelegramType]:
+        if current_span.get() is None:
+            return await make_request(bot, method)
+        with self.tracer.span(f"telegram {method.__api_method__}", KIND_CLIENT):
+            return await make_request(bot, method)
+
+
+def _traced(tracer: Tracer, function: Callable[..., Awaitable[Any]], name: str):
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        if current_span.get() is None:
+            return await function(*args, **kwargs)
+        with tracer.span(name):
+            return await function(*args, **kwargs)
+    return wrapper
+
+
+def instrument(tracer: Tracer, target: Any, prefix: str, names: Optional[Iterable[str]] = None):
+    """Replace coroutine functions of a module or object with traced wrappers.
+
+    Spans are named "{prefix} {function}". Without `names`, every public
+    coroutine function defined in the module is wrapped.
+    """
+    if names is None:
+        names = [
+            name for name, value in vars(target).items()
+            if not name.startswith("_") and inspect.iscoroutinefunction(value)
+            and value.__module__ == target.__name__
+        ]
+    for name in names:
+        setattr(target, name, _traced(tracer, getattr(target, name), f"{prefix} {name}"))
+
+
+def http_trace_config(tracer: Tracer) -> aiohttp.TraceConfig:
+    """aiohttp trace hooks adding a client span per request made inside a trace."""
+
+    async def on_request_start(session, context, params):
+        context.span = tracer.start_span(f"http {params.method}", KIND_CLIENT,
+                                         host=params.url.host, path=params.url.path)
+
+    async def on_request_end(session, context, params):
+        if context.span is not None:
+            context.span.attributes["status"] = params.response.status
+            tracer.finish(context.span)
+
+    async def on_request_exception(session, context, params):
+        if context.span is not None:
+            tracer.finish(context.span, params.exception)
+
+    trace_config = aiohttp.TraceConfig()
+    trace_config.on_request_start.append(on_request_start)
+    trace_config.on_request_end.append(on_request_end)
+    trace_config.on_request_exception.append(on_request_exception)
+    return trace_config